@@ -58,6 +58,7 @@ from electroncash import WalletStorage
 from electroncash.util import (UserCancelled, PrintError, print_error,
                                standardize_path, finalization_print_error,
                                get_new_wallet_name, Handlers)
+from electroncash import startup_profile
 from electroncash import version
 
 from .installwizard import InstallWizard, GoBack
@@ -892,6 +893,9 @@ class ElectrumGui(QObject, PrintError):
         path = self.config.get_wallet_path()
         if not self.start_new_window(path, self.config.get('url')):
             return
+        startup_profile.mark('first window')
+        # --profile-startup: the report is written once the event loop gets going
+        QTimer.singleShot(0, lambda: startup_profile.finish('event loop running'))
         signal.signal(signal.SIGINT, lambda signum, frame: self.shutdown_signal.emit())
 
         self.app.setQuitOnLastWindowClosed(True)
@@ -25,10 +25,10 @@
 
 from functools import partial
 
-from .util import MyTreeWidget, MONOSPACE_FONT, SortableTreeWidgetItem, rate_limited, webopen
-from PyQt5.QtCore import Qt
+from .util import MyTreeView, MyTableModel, MONOSPACE_FONT, ColorScheme, rate_limited, webopen
+from PyQt5.QtCore import Qt, QModelIndex, QPersistentModelIndex
 from PyQt5.QtGui import QFont, QColor, QKeySequence
-from PyQt5.QtWidgets import QTreeWidgetItem, QAbstractItemView, QMenu
+from PyQt5.QtWidgets import QMenu, QComboBox
 from electroncash.i18n import _
 from electroncash.address import Address
 from electroncash.plugins import run_hook
@@ -37,16 +37,181 @@ from electroncash.util import profiler
 from electroncash import networks
 
 
-class AddressList(MyTreeWidget):
-    filter_columns = [0, 1, 2]  # Address, Label, Balance
+class AddressModel(MyTableModel):
+    ''' The wallet's addresses, receiving and change, one row per Address.
+
+    refresh() only gathers what sorting and the type/usage filters need
+    (whether it's a change address, its index, number of txs and balance)
+    for every address; the rest of a row is formatted when the view first
+    asks for it, and kept until the next refresh() or labels_changed(). '''
+
+    TYPE, ADDRESS, INDEX, LABEL, BALANCE = range(5)  # then the fiat balance (optional) and the number of txs
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self.rows = {}  # Address -> (is_change, index, number of txs, balance)
+        self.cells = {}  # Address -> formatted row, see format_row
+        self.fx_rate = None
+        self.show_change = 0  # 0: all, 1: receiving only, 2: change only
+        self.show_used = 0  # 0: all, 1: unused, 2: funded, 3: used (has txs but zero balance)
+        self.monospaceFont = QFont(MONOSPACE_FONT)
+        self.frozenBrush = QColor('lightblue')
+        self.beyondLimitBrush = QColor('red')
+        self.receivingBrush = ColorScheme.GREEN.as_color(True)
+        self.changeBrush = ColorScheme.YELLOW.as_color(True)
+
+    def has_fiat(self):
+        return len(self.headers) > 6
+
+    def refresh(self):
+        wallet = self.window.wallet
+        # Take shallow copies since the Synchronizer thread may grow the
+        # wallet's address lists while we iterate.
+        receiving_addresses = list(wallet.get_receiving_addresses())
+        change_addresses = list(wallet.get_change_addresses())
+        rows = {}
+        for is_change, addr_list in ((False, receiving_addresses), (True, change_addresses)):
+            for n, address in enumerate(addr_list):
+                rows[address] = (is_change, n, len(wallet.get_address_history(address)),
+                                 sum(wallet.get_addr_balance(address)))
+        fx = self.window.fx
+        self.fx_rate = fx.exchange_rate() if fx and fx.get_fiat_address_config() else None
+        # rows on their way out stay formattable until they're removed
+        self.rows.update(rows)
+        self.cells.clear()
+        self.set_keys(rows)
+        self.rows = rows
+        self.rows_changed()
+
+    def labels_changed(self):
+        self.cells.clear()
+        self.rows_changed(column=self.LABEL)
+        if self.sort_column == self.LABEL:
+            self.resort()
+
+    def row_visible(self, address):
+        is_change, n, num_tx, balance = self.rows[address]
+        if self.show_change and is_change != (self.show_change == 2):
+            return False
+        if self.show_used == 1:
+            return not num_tx
+        if self.show_used == 2:
+            return bool(balance)
+        if self.show_used == 3:
+            return bool(num_tx) and not balance
+        return True
+
+    def format_row(self, address):
+        ''' Returns (column texts, address column background) '''
+        wallet = self.window.wallet
+        is_change, n, num_tx, balance = self.rows[address]
+        label = wallet.labels.get(address.to_storage_string(), '')
+        texts = [_("change") if is_change else _("receiving"), address.to_ui_string(), str(n), label,
+                 self.window.format_amount(balance, whitespaces=True)]
+        if self.has_fiat():
+            texts.append(self.window.fx.value_str(balance, self.fx_rate))
+        texts.append(str(num_tx))
+        background = None
+        if wallet.is_frozen(address):
+            background = self.frozenBrush
+        if wallet.is_beyond_limit(address, is_change):
+            background = self.beyondLimitBrush
+        return texts, background
+
+    def get_cell(self, address):
+        cell = self.cells.get(address)
+        if cell is None:
+            cell = self.cells[address] = self.format_row(address)
+        return cell
+
+    def is_amount_column(self, column):
+        return column == self.BALANCE or (column == self.BALANCE + 1 and self.has_fiat())
+
+    def row_data(self, address, column, role):
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            texts = self.get_cell(address)[0]
+            return texts[column] if column < len(texts) else None
+        if role == Qt.UserRole:
+            return address
+        if role == Qt.FontRole:
+            if column == self.ADDRESS or self.is_amount_column(column):
+                return self.monospaceFont
+        elif role == Qt.TextAlignmentRole:
+            if self.is_amount_column(column):
+                return int(Qt.AlignRight | Qt.AlignVCenter)
+        elif role == Qt.BackgroundRole:
+            if column == self.ADDRESS:
+                return self.get_cell(address)[1]
+            if column == self.TYPE:
+                return self.changeBrush if self.rows[address][0] else self.receivingBrush
+        return None
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.column() == self.LABEL:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or index.column() != self.LABEL:
+            return False
+        address = self.keys[index.row()]
+        if value == self.window.wallet.labels.get(address.to_storage_string(), ''):
+            return False
+        self.window.wallet.set_label(address, value)
+        self.window.update_labels()
+        self.dataChanged.emit(index, index)
+        return True
+
+    def default_key(self):
+        rows = self.rows
+        return lambda a: rows[a][:2]
+
+    def sort_key(self, column):
+        rows = self.rows
+        if column == self.TYPE:
+            return self.default_key()
+        if column == self.ADDRESS:
+            return lambda a: a.to_ui_string()
+        if column == self.INDEX:
+            return lambda a: rows[a][1]
+        if column == self.LABEL:
+            labels = self.window.wallet.labels
+            return lambda a: labels.get(a.to_storage_string(), '').lower()
+        if self.is_amount_column(column):
+            return lambda a: rows[a][3]
+        return lambda a: rows[a][2]
+
+
+class AddressList(MyTreeView):
+    filter_columns = [AddressModel.ADDRESS, AddressModel.LABEL, AddressModel.BALANCE]
+    default_sort = MyTreeView.SortSpec(AddressModel.TYPE, Qt.AscendingOrder)
 
     def __init__(self, parent=None):
-        super().__init__(parent, self.create_menu, [], 2, deferred_updates=True)
+        super().__init__(parent, self.create_menu, AddressModel(parent), [], AddressModel.LABEL,
+                         deferred_updates=True)
         self.refresh_headers()
-        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.setSortingEnabled(True)
         # force attributes to always be defined, even if None, at construction.
         self.wallet = self.parent.wallet
+        self.change_combo = QComboBox()
+        self.change_combo.addItems([_('All'), _('Receiving'), _('Change')])
+        self.change_combo.currentIndexChanged.connect(self.toggle_change)
+        self.used_combo = QComboBox()
+        self.used_combo.addItems([_('All status'), _('Unused'), _('Funded'), _('Used')])
+        self.used_combo.currentIndexChanged.connect(self.toggle_used)
+
+    def get_toolbar_widgets(self):
+        ''' The widgets that go above the list, see ElectrumWindow.create_list_tab '''
+        return [self.change_combo, self.used_combo]
+
+    def toggle_change(self, state):
+        self.source_model.show_change = state
+        self.proxy.invalidateFilter()
+
+    def toggle_used(self, state):
+        self.source_model.show_used = state
+        self.proxy.invalidateFilter()
 
     def filter(self, p):
         ''' Reimplementation from superclass filter.  Chops off the
@@ -62,10 +227,10 @@ class AddressList(MyTreeWidget):
         super().filter(p)  # call super on chopped-off-piece
 
     def refresh_headers(self):
-        headers = [ _('Address'), _('Index'),_('Label'), _('Balance'), _('Tx')]
+        headers = [ _('Type'), _('Address'), _('Index'),_('Label'), _('Balance'), _('Tx')]
         fx = self.parent.fx
         if fx and fx.get_fiat_address_config():
-            headers.insert(4, '{} {}'.format(fx.get_currency(), _('Balance')))
+            headers.insert(5, '{} {}'.format(fx.get_currency(), _('Balance')))
         self.update_headers(headers)
 
     @rate_limited(1.0, ts_after=True) # We rate limit the address list refresh no more than once every second
@@ -77,129 +242,19 @@ class AddressList(MyTreeWidget):
 
     @profiler
     def on_update(self):
-        def item_path(item): # Recursively builds the path for an item eg 'parent_name/item_name'
-            return item.text(0) if not item.parent() else item_path(item.parent()) + "/" + item.text(0)
-        def remember_expanded_items(root):
-            # Save the set of expanded items... so that address list updates don't annoyingly collapse
-            # our tree list widget due to the update. This function recurses. Pass self.invisibleRootItem().
-            expanded_item_names = set()
-            for i in range(0, root.childCount()):
-                it = root.child(i)
-                if it and it.childCount():
-                    if it.isExpanded():
-                        expanded_item_names.add(item_path(it))
-                    expanded_item_names |= remember_expanded_items(it) # recurse
-            return expanded_item_names
-        def restore_expanded_items(root, expanded_item_names):
-            # Recursively restore the expanded state saved previously. Pass self.invisibleRootItem().
-            for i in range(0, root.childCount()):
-                it = root.child(i)
-                if it and it.childCount():
-                    restore_expanded_items(it, expanded_item_names) # recurse, do leaves first
-                    old = bool(it.isExpanded())
-                    new = bool(item_path(it) in expanded_item_names)
-                    if old != new:
-                        it.setExpanded(new)
         self.wallet = self.parent.wallet
-        had_item_count = self.topLevelItemCount()
-        sels = self.selectedItems()
-        addresses_to_re_select = {item.data(0, Qt.UserRole) for item in sels}
-        expanded_item_names = remember_expanded_items(self.invisibleRootItem())
-        del sels  # avoid keeping reference to about-to-be delete C++ objects
-        self.clear()
-        # Note we take a shallow list-copy because we want to avoid
-        # race conditions with the wallet while iterating here. The wallet may
-        # touch/grow the returned lists at any time if a history comes (it
-        # basically returns a reference to its own internal lists). The wallet
-        # may then, in another thread such as the Synchronizer thread, grow
-        # the receiving or change addresses on Deterministic wallets.  While
-        # probably safe in a language like Python -- and especially since
-        # the lists only grow at the end, we want to avoid bad habits.
-        # The performance cost of the shallow copy below is negligible for 10k+
-        # addresses even on huge wallets because, I suspect, internally CPython
-        # does this type of operation extremely cheaply (probably returning
-        # some copy-on-write-semantics handle to the same list).
-        receiving_addresses = list(self.wallet.get_receiving_addresses())
-        change_addresses = list(self.wallet.get_change_addresses())
-
-        if self.parent.fx and self.parent.fx.get_fiat_address_config():
-            fx = self.parent.fx
-        else:
-            fx = None
-        account_item = self
-        sequences = [0,1] if change_addresses else [0]
-        items_to_re_select = []
-        for is_change in sequences:
-            if len(sequences) > 1:
-                name = _("Receiving") if not is_change else _("Change")
-                seq_item = QTreeWidgetItem( [ name, '', '', '', '', ''] )
-                account_item.addChild(seq_item)
-                if not had_item_count: # first time we create this widget, auto-expand the default address list
-                    seq_item.setExpanded(True)
-                    expanded_item_names.add(item_path(seq_item))
-            else:
-                seq_item = account_item
-            hidden_item = QTreeWidgetItem( [ _("Empty") if is_change else _("Used"), '', '', '', '', ''] )
-            has_hidden = False
-            addr_list = change_addresses if is_change else receiving_addresses
-            for n, address in enumerate(addr_list):
-                num = len(self.wallet.get_address_history(address))
-                if is_change:
-                    is_hidden = self.wallet.is_empty(address)
-                else:
-                    is_hidden = self.wallet.is_used(address)
-                balance = sum(self.wallet.get_addr_balance(address))
-                address_text = address.to_ui_string()
-                label = self.wallet.labels.get(address.to_storage_string(), '')
-                balance_text = self.parent.format_amount(balance, whitespaces=True)
-                columns = [address_text, str(n), label, balance_text, str(num)]
-                if fx:
-                    rate = fx.exchange_rate()
-                    fiat_balance = fx.value_str(balance, rate)
-                    columns.insert(4, fiat_balance)
-                address_item = SortableTreeWidgetItem(columns)
-                address_item.setTextAlignment(3, Qt.AlignRight)
-                address_item.setFont(3, QFont(MONOSPACE_FONT))
-                if fx:
-                    address_item.setTextAlignment(4, Qt.AlignRight)
-                    address_item.setFont(4, QFont(MONOSPACE_FONT))
-
-                address_item.setFont(0, QFont(MONOSPACE_FONT))
-                address_item.setData(0, Qt.UserRole, address)
-                address_item.setData(0, Qt.UserRole+1, True) # label can be edited
-                if self.wallet.is_frozen(address):
-                    address_item.setBackground(0, QColor('lightblue'))
-                if self.wallet.is_beyond_limit(address, is_change):
-                    address_item.setBackground(0, QColor('red'))
-                if is_hidden:
-                    if not has_hidden:
-                        seq_item.insertChild(0, hidden_item)
-                        has_hidden = True
-                    hidden_item.addChild(address_item)
-                else:
-                    seq_item.addChild(address_item)
-                if address in addresses_to_re_select:
-                    items_to_re_select.append(address_item)
-
-        for item in items_to_re_select:
-            # NB: Need to select the item at the end becasue internally Qt does some index magic
-            # to pick out the selected item and the above code mutates the TreeList, invalidating indices
-            # and other craziness, which might produce UI glitches. See #1042
-            item.setSelected(True)
-
-        # Now, at the very end, enforce previous UI state with respect to what was expanded or not. See #1042
-        restore_expanded_items(self.invisibleRootItem(), expanded_item_names)
+        # The model diffs against what it already has, so the selection
+        # and scroll position survive the update.
+        self.source_model.refresh()
 
     def create_menu(self, position):
         from electroncash.wallet import Multisig_Wallet
         is_multisig = isinstance(self.wallet, Multisig_Wallet)
         can_delete = self.wallet.can_delete_address()
-        selected = self.selectedItems()
-        multi_select = len(selected) > 1
-        addrs = [item.data(0, Qt.UserRole) for item in selected]
+        addrs = self.selected_keys()
+        multi_select = len(addrs) > 1
         if not addrs:
             return
-        addrs = [addr for addr in addrs if isinstance(addr, Address)]
 
         menu = QMenu()
 
@@ -207,35 +262,34 @@ class AddressList(MyTreeWidget):
             txt = txt.strip()
             self.parent.copy_to_clipboard(txt)
 
-        col = self.currentColumn()
-        column_title = self.headerItem().text(col)
+        index = self.indexAt(position)
+        col = index.column() if index.isValid() else self.currentIndex().column()
+        column_title = self.source_model.headerData(col, Qt.Horizontal)
 
         if not multi_select:
-            item = self.itemAt(position)
-            if not item:
-                return
-            if not addrs:
-                item.setExpanded(not item.isExpanded())
+            if not index.isValid():
                 return
             addr = addrs[0]
 
             alt_copy_text, alt_column_title = None, None
-            if col == 0:
+            if col == AddressModel.ADDRESS:
                 copy_text = addr.to_full_ui_string()
                 if Address.FMT_UI == Address.FMT_LEGACY:
                     alt_copy_text, alt_column_title = addr.to_full_string(Address.FMT_CASHADDR), _('Cash Address')
                 else:
                     alt_copy_text, alt_column_title = addr.to_full_string(Address.FMT_LEGACY), _('Legacy Address')
             else:
-                copy_text = item.text(col)
+                copy_text = index.data() or ''
             menu.addAction(_("Copy {}").format(column_title), lambda: doCopy(copy_text))
             if alt_copy_text and alt_column_title:
                 # Add 'Copy Legacy Address' and 'Copy Cash Address' alternates if right-click is on column 0
                 menu.addAction(_("Copy {}").format(alt_column_title), lambda: doCopy(alt_copy_text))
             menu.addAction(_('Details'), lambda: self.parent.show_address(addr))
             if col in self.editable_columns:
-                menu.addAction(_("Edit {}").format(column_title), lambda: self.editItem(self.itemAt(position), # NB: C++ item may go away if this widget is refreshed while menu is up -- so need to re-grab and not store in lamba. See #953
-                                                                                        col))
+                # NB: the row may move or go away if this list is refreshed while the menu is up. See #953
+                pindex = QPersistentModelIndex(index)
+                menu.addAction(_("Edit {}").format(column_title),
+                               lambda: pindex.isValid() and self.edit(QModelIndex(pindex)))
             a = menu.addAction(_("Request payment"), lambda: self.parent.receive_at(addr))
             if self.wallet.get_num_tx(addr) or self.wallet.has_payment_request(addr):
                 # This address cannot be used for a payment request because
@@ -258,14 +312,15 @@ class AddressList(MyTreeWidget):
             # multi-select
             if col > -1:
                 texts, alt_copy, alt_copy_text = None, None, None
-                if col == 0: # address column
+                if col == AddressModel.ADDRESS:
                     texts = [a.to_ui_string() for a in addrs]
                     # Add additional copy option: "Address, Balance (n)"
                     alt_copy = _("Copy {}").format(_("Address") + ", " + _("Balance")) + f" ({len(addrs)})"
                     alt_copy_text = "\n".join([a.to_ui_string() + ", " + self.parent.format_amount(sum(self.wallet.get_addr_balance(a)))
                                               for a in addrs])
                 else:
-                    texts = [i.text(col).strip() for i in selected]
+                    get_cell = self.source_model.get_cell
+                    texts = [get_cell(a)[0][col].strip() for a in addrs]
                     texts = [t for t in texts if t]  # omit empty items
                 if texts:
                     copy_text = '\n'.join(texts)
@@ -288,9 +343,9 @@ class AddressList(MyTreeWidget):
         menu.exec_(self.viewport().mapToGlobal(position))
 
     def keyPressEvent(self, event):
-        if event.matches(QKeySequence.Copy) and self.currentColumn() == 0:
-            addrs = [i.data(0, Qt.UserRole) for i in self.selectedItems()]
-            if addrs and isinstance(addrs[0], Address):
+        if event.matches(QKeySequence.Copy) and self.currentIndex().column() == AddressModel.ADDRESS:
+            addrs = self.selected_keys()
+            if addrs:
                 text = addrs[0].to_full_ui_string()
                 self.parent.app.clipboard().setText(text)
         else:
@@ -299,14 +354,4 @@ class AddressList(MyTreeWidget):
     def update_labels(self):
         if self.should_defer_update_incr():
             return
-        def update_recurse(root):
-            child_count = root.childCount()
-            for i in range(child_count):
-                item = root.child(i)
-                addr = item.data(0, Qt.UserRole)
-                if isinstance(addr, Address):
-                    label = self.wallet.labels.get(addr.to_storage_string(), '')
-                    item.setText(2, label)
-                if item.childCount():
-                    update_recurse(item)
-        update_recurse(self.invisibleRootItem())
+        self.source_model.labels_changed()
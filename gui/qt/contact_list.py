@@ -27,7 +27,7 @@ from electroncash.i18n import _
 import electroncash.web as web
 from electroncash.address import Address
 from electroncash.plugins import run_hook
-from electroncash.util import FileImportFailed
+from electroncash.util import FileImportFailed, profiler
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import (
@@ -102,6 +102,7 @@ class ContactList(MyTreeWidget):
         run_hook('create_contact_menu', menu, selected)
         menu.exec_(self.viewport().mapToGlobal(position))
 
+    @profiler
     def on_update(self):
         item = self.currentItem()
         current_key = item.data(0, Qt.UserRole) if item else None
@@ -23,10 +23,13 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import bisect
+import itertools
+
 from .util import *
 import electroncash.web as web
 from electroncash.i18n import _
-from electroncash.util import timestamp_to_datetime, profiler, Weak
+from electroncash.util import profiler
 
 
 TX_ICONS = [
@@ -42,23 +45,276 @@ TX_ICONS = [
     "confirmed.svg",
 ]
 
-class HistoryList(MyTreeWidget):
+class TxStatusCache:
+    ''' Memoizes wallet.get_tx_status() per tx, which only has to be redone
+    when the tx's height, timestamp or (up to the last clock icon)
+    confirmation count change. '''
+
+    CONF_CAP = len(TX_ICONS) - 3
+
+    def __init__(self):
+        self.d = {}  # tx_hash -> ((height, capped conf, timestamp), (status, status_str))
+
+    def get(self, wallet, tx_hash, height, conf, timestamp):
+        key = (height, min(conf, self.CONF_CAP), timestamp)
+        cached = self.d.get(tx_hash)
+        if cached and cached[0] == key:
+            return cached[1]
+        status = wallet.get_tx_status(tx_hash, height, conf, timestamp)
+        self.d[tx_hash] = (key, status)
+        return status
+
+    def discard(self, tx_hash):
+        self.d.pop(tx_hash, None)
+
+
+class HistoryModel(MyTableModel):
+    ''' The wallet history, one row per tx.
+
+    Nothing is formatted up front: data() formats a row the first time it
+    is asked for it (in practice, when it scrolls into view) and caches the
+    result until the row changes. set_history() diffs a whole new history
+    against what the model already holds. apply_changes() only looks at the
+    txs a batch of wallet changes touched: it works out their rows from the
+    wallet, carries their amounts over to the running balances of the rows
+    after them, and inserts, removes or moves just the rows that changed. '''
+
+    LABEL_COLUMN = 3
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self.rows = {}  # tx_hash -> [height, conf, timestamp, value, balance, txpos]
+        self.chrono = []  # tx hashes, oldest first
+        self.chrono_pos = []  # their txpos, to bisect self.chrono with
+        self.base_balance = 0  # the balance before the oldest tx
+        self.complete = False  # all the values and balances are known
+        self.statuses = TxStatusCache()
+        self.texts = {}  # tx_hash -> formatted amount/balance/fiat strings
+        self.monospaceFont = QFont(MONOSPACE_FONT)
+        self.withdrawalBrush = QBrush(QColor("#BC1E1E"))
+        self.invoiceIcon = QIcon(":icons/seal")
+
+    def set_headers(self, headers):
+        self.texts.clear()
+        super().set_headers(headers)
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.column() == self.LABEL_COLUMN:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def get_status(self, tx_hash):
+        return self.statuses.get(self.window.wallet, tx_hash, *self.rows[tx_hash][:3])
+
+    def get_texts(self, tx_hash):
+        texts = self.texts.get(tx_hash)
+        if texts is None:
+            height, conf, timestamp, value, balance = self.rows[tx_hash][:5]
+            format_amount = self.window.format_amount
+            texts = [format_amount(value, True, whitespaces=True),
+                     format_amount(balance, whitespaces=True)]
+            fx = self.window.fx
+            if fx and fx.show_history():
+                rate = fx.timestamp_rate(time.time() if conf <= 0 else timestamp)
+                for amount in [value, balance]:
+                    texts.append(fx.value_str(amount, rate))
+            self.texts[tx_hash] = texts
+        return texts
+
+    def text(self, tx_hash, column):
+        if column == 1:
+            return tx_hash
+        if column == 2:
+            return self.get_status(tx_hash)[1]
+        if column == self.LABEL_COLUMN:
+            return self.window.wallet.get_label(tx_hash)
+        if column > 3:
+            texts = self.get_texts(tx_hash)
+            if column - 4 < len(texts):
+                return texts[column - 4]
+        return ''
+
+    def row_data(self, tx_hash, column, role):
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.text(tx_hash, column)
+        if role == Qt.UserRole:
+            return tx_hash
+        if role == Qt.DecorationRole:
+            if column == 0:
+                return HistoryList._get_icon_for_status(self.get_status(tx_hash)[0])
+            if column == self.LABEL_COLUMN and self.window.wallet.invoices.paid.get(tx_hash):
+                return self.invoiceIcon
+        elif role == Qt.ToolTipRole and column == 0:
+            conf = self.rows[tx_hash][1]
+            return str(conf) + " confirmation" + ("s" if conf != 1 else "")
+        elif role == Qt.FontRole and column != 2:
+            return self.monospaceFont
+        elif role == Qt.TextAlignmentRole and column > 3:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        elif role == Qt.ForegroundRole and column in (3, 4):
+            value = self.rows[tx_hash][3]
+            if value and value < 0:
+                return self.withdrawalBrush
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or index.column() != self.LABEL_COLUMN:
+            return False
+        tx_hash = self.keys[index.row()]
+        if value == self.window.wallet.get_label(tx_hash):
+            return False
+        self.window.wallet.set_label(tx_hash, value)
+        self.window.update_labels()
+        self.dataChanged.emit(index, index)
+        return True
+
+    def default_key(self):
+        rows = self.rows
+        return lambda h: (-rows[h][5][0], -rows[h][5][1])  # newest first
+
+    def sort_key(self, column):
+        rows = self.rows
+        if column == 0:
+            return lambda h: (self.get_status(h)[0], rows[h][1])
+        if column == 1:
+            return lambda h: h
+        if column == 2:
+            return lambda h: rows[h][5]  # chronological
+        if column == self.LABEL_COLUMN:
+            get_label = self.window.wallet.get_label
+            return lambda h: get_label(h).lower()
+        if column in (4, 5):
+            i = column - 1
+            return lambda h: (rows[h][i] is None, rows[h][i] or 0)
+        return lambda h: self.numeric_text_key(self.text(h, column))
+
+    def set_history(self, history):
+        ''' Brings the model in line with `history', as returned by
+        wallet.get_history(..., reverse=True). '''
+        get_txpos = self.window.wallet.get_txpos
+        old_rows, new_rows = self.rows, {}
+        for tx_hash, height, conf, timestamp, value, balance in history:
+            new_rows[tx_hash] = [height, conf, timestamp, value, balance, get_txpos(tx_hash)]
+        self.chrono = [item[0] for item in reversed(history)]
+        self.chrono_pos = [new_rows[h][5] for h in self.chrono]
+        oldest = new_rows[self.chrono[0]] if history else None
+        self.complete = all(row[3] is not None and row[4] is not None for row in new_rows.values())
+        self.base_balance = oldest[4] - oldest[3] if oldest and self.complete else 0
+        # Rows that stay keep their cached texts unless they changed, or are
+        # unconfirmed (their fiat amounts are at the current rate).
+        changed = [h for h, row in new_rows.items()
+                   if h in old_rows and (old_rows[h] != row or row[1] <= 0)]
+        for h in changed:
+            self.texts.pop(h, None)
+        gone = {h: old_rows[h] for h in self.keys if h not in new_rows}
+        keys = set(new_rows) if gone else new_rows
+        # rows on their way out must still have data until they're removed
+        new_rows.update(gone)
+        self.rows = new_rows
+        self.set_keys(keys, on_removed=self.statuses.discard)
+        for h in gone:
+            del new_rows[h]
+            self.texts.pop(h, None)
+        self.rows_changed(changed)
+
+    def _chrono_index(self, tx_hash):
+        i = bisect.bisect_left(self.chrono_pos, self.rows[tx_hash][5])
+        while self.chrono[i] != tx_hash:
+            i += 1
+        return i
+
+    def apply_changes(self, tx_hashes):
+        ''' Brings the rows of `tx_hashes' (txs that were added, removed
+        or verified, or whose addresses' history changed) in line with the
+        wallet, along with the balances of the rows after them. Returns
+        False, having changed nothing, if that can't be done row by row and
+        the caller should set_history() instead: if some amount or balance
+        is unknown, or there are too many txs. '''
+        wallet = self.window.wallet
+        if not self.complete or len(tx_hashes) > self.RESET_THRESHOLD:
+            return False
+        entries = {h: wallet.get_history_entry(h) for h in tx_hashes}
+        if any(entry is not None and entry[3] is None for entry in entries.values()):
+            return False
+        with wallet.lock:
+            # txs that lost the value of an input with a removed tx
+            if any(h in self.rows for h in wallet.pruned_txo_values):
+                return False
+        lo = len(self.chrono)  # the oldest row whose balance may have changed
+        added, removed, changed = [], [], set()
+        for h, entry in entries.items():
+            row = self.rows.get(h)
+            if row is not None:
+                if entry is not None and entry[3:] == (row[3], row[5]):
+                    # same place, same amount
+                    if list(entry[:3]) != row[:3]:
+                        row[:3] = entry[:3]
+                        changed.add(h)
+                    continue
+                i = self._chrono_index(h)
+                del self.chrono[i], self.chrono_pos[i]
+                lo = min(lo, i)
+                if entry is None:
+                    removed.append(h)
+                    continue
+                row[:] = list(entry[:4]) + [row[4], entry[4]]
+                changed.add(h)
+            elif entry is None:
+                continue
+            else:
+                self.rows[h] = list(entry[:4]) + [None, entry[4]]
+                added.append(h)
+            i = bisect.bisect_right(self.chrono_pos, entry[4])
+            self.chrono.insert(i, h)
+            self.chrono_pos.insert(i, entry[4])
+            lo = min(lo, i)
+        balance = self.base_balance if lo == 0 else self.rows[self.chrono[lo - 1]][4]
+        for h in itertools.islice(self.chrono, lo, None):
+            row = self.rows[h]
+            balance += row[3]
+            if row[4] != balance:
+                row[4] = balance
+                changed.add(h)
+        self.remove_keys(removed, on_removed=self.statuses.discard)
+        for h in removed:
+            del self.rows[h]
+            self.texts.pop(h, None)
+        changed.difference_update(added)
+        for h in changed:
+            self.texts.pop(h, None)
+        self.rows_changed(changed)
+        self.reposition(changed)
+        self.insert_keys(added)
+        return True
+
+    def update_item(self, tx_hash, height, conf, timestamp):
+        row = self.rows.get(tx_hash)
+        if row is None:
+            return False
+        row[:3] = [height, conf, timestamp]
+        self.texts.pop(tx_hash, None)
+        self.rows_changed([tx_hash])
+        return True
+
+    def labels_changed(self):
+        self.rows_changed(column=self.LABEL_COLUMN)
+
+
+class HistoryList(MyTreeView):
     filter_columns = [2, 3, 4]  # Date, Description, Amount
     statusIcons = {}
-    default_sort = MyTreeWidget.SortSpec(0, Qt.AscendingOrder)
+    default_sort = MyTreeView.SortSpec(0, Qt.AscendingOrder)
 
     def __init__(self, parent):
-        super().__init__(parent, self.create_menu, [], 3, deferred_updates=True)
+        super().__init__(parent, self.create_menu, HistoryModel(parent), [],
+                         HistoryModel.LABEL_COLUMN, deferred_updates=True)
         self.refresh_headers()
         self.setColumnHidden(1, True)
         # force attributes to always be defined, even if None, at construction.
         self.wallet = self.parent.wallet
 
-        self.monospaceFont = QFont(MONOSPACE_FONT)
-        self.withdrawalBrush = QBrush(QColor("#BC1E1E"))
-        self.invoiceIcon = QIcon(":icons/seal")
-        self._item_cache = Weak.ValueDictionary()
-
         self.has_unknown_balances = False
 
     def clean_up(self):
@@ -82,22 +338,6 @@ class HistoryList(MyTreeWidget):
             return
         super().update()
 
-    def clear(self):
-        self._item_cache.clear()
-        super().clear()
-
-    def insertTopLevelItem(self, index, item, tx_hash=None):
-        super().insertTopLevelItem(index, item)
-        tx_hash = tx_hash or item.data(0, Qt.UserRole)
-        if tx_hash:
-            self._item_cache[tx_hash] = item
-
-    def addTopLevelItem(self, item, tx_hash=None):
-        super().addTopLevelItem(item)
-        tx_hash = tx_hash or item.data(0, Qt.UserRole)
-        if tx_hash:
-            self._item_cache[tx_hash] = item
-
     @classmethod
     def _get_icon_for_status(cls, status):
         ret = cls.statusIcons.get(status)
@@ -109,62 +349,31 @@ class HistoryList(MyTreeWidget):
     def on_update(self):
         self.wallet = self.parent.wallet
         h = self.wallet.get_history(self.get_domain(), reverse=True)
-        sels = self.selectedItems()
-        current_tx = sels[0].data(0, Qt.UserRole) if sels else None
-        del sels #  make sure not to hold stale ref to C++ list of items which will be deleted in clear() call below
-        self.clear()
-        self.has_unknown_balances = False
         fx = self.parent.fx
         if fx: fx.history_used_spot = False
-        for h_item in h:
-            tx_hash, height, conf, timestamp, value, balance = h_item
-            label = self.wallet.get_label(tx_hash)
-            if value is None or balance is None:
-                # Workaround to the fact that sometimes the wallet doesn't
-                # know the actual balance for history items while it's
-                # downloading history, and we want to flag that situation
-                # and redraw the GUI sometime later when it finishes updating.
-                # This flag is checked in main_window.py, TxUpadteMgr class.
-                self.has_unknown_balances = True
-            status, status_str = self.wallet.get_tx_status(tx_hash, height, conf, timestamp)
-            has_invoice = self.wallet.invoices.paid.get(tx_hash)
-            icon = self._get_icon_for_status(status)
-            v_str = self.parent.format_amount(value, True, whitespaces=True)
-            balance_str = self.parent.format_amount(balance, whitespaces=True)
-            entry = ['', tx_hash, status_str, label, v_str, balance_str]
-            if fx and fx.show_history():
-                date = timestamp_to_datetime(time.time() if conf <= 0 else timestamp)
-                for amount in [value, balance]:
-                    text = fx.historical_value_str(amount, date)
-                    entry.append(text)
-            item = SortableTreeWidgetItem(entry)
-            if icon: item.setIcon(0, icon)
-            item.setToolTip(0, str(conf) + " confirmation" + ("s" if conf != 1 else ""))
-            item.setData(0, SortableTreeWidgetItem.DataRole, (status, conf))
-            if has_invoice:
-                item.setIcon(3, self.invoiceIcon)
-            for i in range(len(entry)):
-                if i>3:
-                    item.setTextAlignment(i, Qt.AlignRight | Qt.AlignVCenter)
-                if i!=2:
-                    item.setFont(i, self.monospaceFont)
-            if value and value < 0:
-                item.setForeground(3, self.withdrawalBrush)
-                item.setForeground(4, self.withdrawalBrush)
-            item.setData(0, Qt.UserRole, tx_hash)
-            self.addTopLevelItem(item, tx_hash)
-            if current_tx == tx_hash:
-                # Note that it's faster to setSelected once the item is in
-                # the tree. Also note that doing setSelected() on the item
-                # itself is much faster than doing setCurrentItem()
-                # which must do a linear search in the tree (wastefully)
-                item.setSelected(True)
-
-    def on_doubleclick(self, item, column):
-        if self.permit_edit(item, column):
-            super(HistoryList, self).on_doubleclick(item, column)
+        # Workaround to the fact that sometimes the wallet doesn't know the
+        # actual balance for history items while it's downloading history,
+        # and we want to flag that situation and redraw the GUI sometime
+        # later when it finishes updating. This flag is checked in
+        # main_window.py, TxUpadteMgr class.
+        self.has_unknown_balances = any(item[4] is None or item[5] is None for item in h)
+        self.source_model.set_history(h)
+
+    def apply_wallet_changes(self, changes):
+        ''' Applies a WalletChanges batch to the rows it concerns. Returns
+        False if the list needs a full update instead. '''
+        if not self.wallet:
+            return False
+        txs = changes.tx_added | changes.tx_removed | set(changes.tx_verified)
+        for addr in changes.address_history_changed:
+            txs.update(tx_hash for tx_hash, height in self.wallet.get_address_history(addr))
+        return not txs or self.source_model.apply_changes(txs)
+
+    def on_doubleclick(self, index):
+        if self.permit_edit(index):
+            super().on_doubleclick(index)
         else:
-            tx_hash = item.data(0, Qt.UserRole)
+            tx_hash = index.data(Qt.UserRole)
             tx = self.wallet.transactions.get(tx_hash)
             if tx:
                 label = self.wallet.get_label(tx_hash) or None
@@ -173,55 +382,29 @@ class HistoryList(MyTreeWidget):
     def update_labels(self):
         if self.should_defer_update_incr():
             return
-        root = self.invisibleRootItem()
-        child_count = root.childCount()
-        for i in range(child_count):
-            item = root.child(i)
-            txid = item.data(0, Qt.UserRole)
-            label = self.wallet.get_label(txid)
-            item.setText(3, label)
+        self.source_model.labels_changed()
 
     def update_item(self, tx_hash, height, conf, timestamp):
         if not self.wallet: return # can happen on startup if this is called before self.on_update()
-        item = self._item_cache.get(tx_hash)
-        if item:
-            idx = self.invisibleRootItem().indexOfChild(item)
-            was_cur = False
-            if idx > -1:
-                # We must take the child out of the view when updating.
-                # This is because otherwise for widgets with many thousands of
-                # items, this method becomes *horrendously* slow (500ms per
-                # call!)... but doing this hack makes it fast (~1ms per call).
-                was_cur = self.currentItem() is item
-                self.invisibleRootItem().takeChild(idx)
-            status, status_str = self.wallet.get_tx_status(tx_hash, height, conf, timestamp)
-            icon = self._get_icon_for_status(status)
-            if icon: item.setIcon(0, icon)
-            item.setData(0, SortableTreeWidgetItem.DataRole, (status, conf))
-            item.setText(2, status_str)
-            if idx > -1:
-                # Now, put the item back again
-                self.invisibleRootItem().insertChild(idx, item)
-                if was_cur:
-                    self.setCurrentItem(item)
-        elif self.should_defer_update_incr():
+        updated = self.source_model.update_item(tx_hash, height, conf, timestamp)
+        if not updated and self.should_defer_update_incr():
             return False
-        return bool(item)  # indicate to client code whether an actual update occurred
+        return updated  # indicate to client code whether an actual update occurred
 
     def create_menu(self, position):
-        item = self.currentItem()
-        if not item:
+        index = self.indexAt(position)
+        if not index.isValid():
             return
-        column = self.currentColumn()
-        tx_hash = item.data(0, Qt.UserRole)
+        column = index.column()
+        tx_hash = index.data(Qt.UserRole)
         if not tx_hash:
             return
-        if column is 0:
+        if column == 0:
             column_title = "ID"
             column_data = tx_hash
         else:
-            column_title = self.headerItem().text(column)
-            column_data = item.text(column)
+            column_title = self.source_model.headerData(column, Qt.Horizontal)
+            column_data = index.data() or ''
 
         tx_URL = web.BE_URL(self.config, 'tx', tx_hash)
         height, conf, timestamp = self.wallet.get_tx_height(tx_hash)
@@ -234,9 +417,10 @@ class HistoryList(MyTreeWidget):
 
         menu.addAction(_("&Copy {}").format(column_title), lambda: self.parent.app.clipboard().setText(column_data.strip()))
         if column in self.editable_columns:
-            # We grab a fresh reference to the current item, as it has been deleted in a reported issue.
+            # The row may have moved or gone by the time the action fires
+            pindex = QPersistentModelIndex(index)
             menu.addAction(_("&Edit {}").format(column_title),
-                lambda: self.currentItem() and self.editItem(self.currentItem(), column))
+                lambda: pindex.isValid() and self.edit(QModelIndex(pindex)))
         label = self.wallet.get_label(tx_hash) or None
         menu.addAction(_("&Details"), lambda: self.parent.show_transaction(tx, label))
         if is_unconfirmed and tx:
@@ -244,7 +428,7 @@ class HistoryList(MyTreeWidget):
             if child_tx:
                 menu.addAction(_("Child pays for parent"), lambda: self.parent.cpfp(tx, child_tx))
         if pr_key:
-            menu.addAction(self.invoiceIcon, _("View invoice"), lambda: self.parent.show_invoice(pr_key))
+            menu.addAction(self.source_model.invoiceIcon, _("View invoice"), lambda: self.parent.show_invoice(pr_key))
         if tx_URL:
             menu.addAction(_("View on block explorer"), lambda: webopen(tx_URL))
 
@@ -26,7 +26,7 @@
 from .util import *
 
 from electroncash.i18n import _
-from electroncash.util import format_time, FileImportFailed
+from electroncash.util import format_time, FileImportFailed, profiler
 
 
 class InvoiceList(MyTreeWidget):
@@ -38,6 +38,7 @@ class InvoiceList(MyTreeWidget):
         self.header().setSectionResizeMode(1, QHeaderView.Interactive)
         self.setColumnWidth(1, 200)
 
+    @profiler
     def on_update(self):
         inv_list = self.parent.invoices.unpaid_invoices()
         self.clear()
@@ -50,7 +50,7 @@ from electroncash.util import (format_time, format_satoshis, PrintError,
                                format_fee_satoshis, Weak, print_error)
 import electroncash.web as web
 from electroncash import Transaction
-from electroncash import util, bitcoin, commands
+from electroncash import util, bitcoin, commands, coinchooser
 from electroncash import paymentrequest
 from electroncash.wallet import Multisig_Wallet, sweep_preparations
 try:
@@ -119,6 +119,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
     new_fx_quotes_signal = pyqtSignal()
     new_fx_history_signal = pyqtSignal()
     network_signal = pyqtSignal(str, object)
+    wallet_changes_signal = pyqtSignal(object)
     alias_received_signal = pyqtSignal()
     cashaddr_toggled_signal = pyqtSignal()
     history_updated_signal = pyqtSignal()
@@ -218,6 +219,15 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
         tabs.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.setCentralWidget(tabs)
 
+        self.tab_refresher = TabRefreshScheduler(self)
+        for name, l in (('history', self.history_list), ('requests', self.request_list),
+                        ('addresses', self.address_list), ('utxos', self.utxo_list),
+                        ('contacts', self.contact_list), ('invoices', self.invoice_list)):
+            self.tab_refresher.add(name, l)
+        if self.is_slp_wallet:
+            self.tab_refresher.add('slp_history', self.slp_history_list)
+            self.tab_refresher.add('tokens', self.token_list)
+
         if self.config.get("is_maximized"):
             self.showMaximized()
 
@@ -402,13 +412,58 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
                 pass
             self.show_error(str(exc_info[1]))
 
+    # The lists (by their names in self.tab_refresher) each network event
+    # may have made stale. Changes to the wallet's txs, coins and SLP data
+    # come in through on_wallet_changes instead, and anything else goes
+    # through update_wallet(), which marks all of them.
+    _tabs_for_event = {
+        'wallet_updated': ('requests', 'addresses'),  # sync status, new addresses
+        'blockchain_updated': ('history', 'requests', 'utxos', 'slp_history'),
+    }
+
+    def on_wallet_changes(self, changes):
+        ''' Subscribed to self.wallet.events, so this runs in the network
+        thread, once per batch of changes. The lists that can apply the
+        changes row by row get them in the GUI thread, in
+        on_wallet_changes_qt; the others are marked stale here. '''
+        if self.cleaned_up: return
+        tabs = set()
+        if changes.tx_added or changes.tx_removed:
+            tabs.update(('requests', 'addresses', 'invoices', 'tokens'))
+        if changes.utxo_added or changes.utxo_spent:
+            tabs.update(('addresses', 'tokens'))
+        if changes.address_history_changed:
+            tabs.add('addresses')
+        if changes.slp_validity_changed:
+            tabs.add('tokens')  # the SLP history tab gets these via slp_validity_signal
+        if tabs:
+            self.tab_refresher.mark_dirty(tabs)
+        if tabs or changes.tx_verified:
+            self.need_update.set()  # for the balance in the status bar
+        self.wallet_changes_signal.emit(changes)
+        if changes.label_changed:
+            self.update_labels()
+
+    def on_wallet_changes_qt(self, changes):
+        ''' Hands a batch of wallet changes to the lists that apply them row
+        by row. Those that are stale anyway, or can't apply this batch, are
+        marked for a full update instead. '''
+        if self.cleaned_up: return
+        lists = [('history', self.history_list), ('utxos', self.utxo_list)]
+        if self.is_slp_wallet:
+            lists.append(('slp_history', self.slp_history_list))
+        stale = [name for name, l in lists
+                 if self.tab_refresher.is_dirty(name) or not l.apply_wallet_changes(changes)]
+        if stale:
+            self.tab_refresher.mark_dirty(stale)
+            self.need_update.set()
+
     def on_network(self, event, *args):
         #self.print_error("on_network:", event, *args)
-        if event == 'wallet_updated':
-            if args[0] is self.wallet:
+        if event in self._tabs_for_event:
+            if event != 'wallet_updated' or args[0] is self.wallet:
+                self.tab_refresher.mark_dirty(self._tabs_for_event[event])
                 self.need_update.set()
-        elif event == 'blockchain_updated':
-            self.need_update.set()
         elif event == 'new_transaction':
             self.tx_update_mgr.notif_add(args)  # added only if this wallet's tx
             if args[1] is self.wallet:
@@ -525,13 +580,15 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
     def load_wallet(self):
         self.wallet.thread = TaskThread(self, self.on_error, name = self.wallet.diagnostic_name() + '/Wallet')
         self.wallet.ui_emit_validity_updated = self.gui_object.slp_validity_signal.emit
+        self.wallet_changes_signal.connect(self.on_wallet_changes_qt)
+        self.wallet.events.subscribe(self.on_wallet_changes)
         self.wallet.ui_emit_validation_fetch = self.gui_object.slp_validation_fetch_signal.emit
         self.update_recently_visited(self.wallet.storage.path)
         # address used to create a dummy transaction and estimate transaction fee
         self.history_list.update()
         self.address_list.update()
         self.utxo_list.update()
-        self.need_update.set()
+        self.update_wallet()
         # update menus
         self.seed_menu.setEnabled(self.wallet.has_seed())
         self.update_lock_icon()
@@ -935,8 +992,11 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
         if self.labels_need_update.is_set():
             self._update_labels() # will clear flag when it runs.
 
-        # resolve aliases
-        # FIXME this is a blocking network call that has a timeout of 5 sec
+        if self.wallet.events_job is None:
+            # Offline, nothing else delivers the wallet's changes
+            self.wallet.events.flush()
+
+        # resolve aliases (in a background thread, if there's anything new to resolve)
         self.payto_e.resolve()
         # update fee
         if self.require_fee_update:
@@ -1055,6 +1115,10 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
             # Display the synchronizing message in that case.
             if not self.wallet.up_to_date or server_height == 0:
                 text = _("Synchronizing...")
+                synchronizer = self.wallet.synchronizer
+                done, total = synchronizer.get_subscription_progress() if synchronizer else (0, 0)
+                if total:
+                    text += " ({}/{})".format(done, total)
                 icon = icon_dict["status_waiting"]
                 status_tip = status_tip_dict["status_waiting"]
             elif server_lag > 1:
@@ -1128,6 +1192,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
                 self.seed_button.setStatusTip(None)
 
     def update_wallet(self):
+        self.tab_refresher.mark_dirty()
         self.need_update.set() # will enqueue an _update_wallet() call in at most 0.5 seconds from now.
 
     def _update_wallet(self):
@@ -1139,17 +1204,11 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
 
     @rate_limited(1.0, classlevel=True, ts_after=True) # Limit tab updates to no more than 1 per second, app-wide. Multiple calls across instances will be collated into 1 deferred series of calls (1 call per extant instance)
     def update_tabs(self):
+        ''' Refreshes the lists that are out of date and on screen. The
+        others are refreshed by self.tab_refresher when they're shown. '''
         if self.cleaned_up: return
-        self.history_list.update()
-        self.request_list.update()
-        self.address_list.update()
-        self.utxo_list.update()
-        self.contact_list.update()
-        self.invoice_list.update()
+        self.tab_refresher.refresh()
         self.update_completions()
-        if self.is_slp_wallet:
-            self.slp_history_list.update()
-            self.token_list.update()
         self.history_updated_signal.emit() # inform things like address_dialog that there's a new history, also clears self.tx_update_mgr.verif_q
         self.need_update.clear() # clear flag
         if self.labels_need_update.is_set():
@@ -3056,7 +3115,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
         from .address_list import AddressList
         self.address_list = l = AddressList(self)
         self.cashaddr_toggled_signal.connect(l.update)
-        return self.create_list_tab(l)
+        return self.create_list_tab(l, l.get_toolbar_widgets())
 
     def create_utxo_tab(self):
         from .utxo_list import UTXOList
@@ -4903,6 +4962,22 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
             lines = [ln.lstrip(" ") for ln in klass.__doc__.split("\n")]
             return '\n'.join([key, "", " ".join(lines)])
 
+        choosers = sorted(coinchooser.COIN_CHOOSERS.keys())
+        if len(choosers) > 1:
+            chooser_name = coinchooser.get_name(self.config)
+            msg = _('Choose coin (UTXO) selection method.  The following are available:\n\n')
+            msg += '\n\n'.join(fmt_docs(*item) for item in sorted(coinchooser.COIN_CHOOSERS.items()))
+            chooser_label = HelpLabel(_('Coin selection') + ':', msg)
+            chooser_combo = QComboBox()
+            chooser_combo.addItems(choosers)
+            i = choosers.index(chooser_name) if chooser_name in choosers else 0
+            chooser_combo.setCurrentIndex(i)
+            def on_chooser(x):
+                chooser_name = choosers[chooser_combo.currentIndex()]
+                self.config.set_key('coin_chooser', chooser_name)
+            chooser_combo.currentIndexChanged.connect(on_chooser)
+            global_tx_widgets.append((chooser_label, chooser_combo))
+
         def on_unconf(x):
             self.config.set_key('confirmed_only', bool(x))
         conf_only = self.config.get('confirmed_only', False)
@@ -5171,6 +5246,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
             self.wallet.ui_emit_validity_updated = None  # detach callback
         if self.wallet.ui_emit_validation_fetch:
             self.wallet.ui_emit_validation_fetch = None
+        self.wallet.events.unsubscribe(self.on_wallet_changes)
 
         self.tx_update_mgr.clean_up()  # disconnects some signals
 
@@ -5561,6 +5637,7 @@ class TxUpdateMgr(QObject, PrintError):
                 # Wallet has settled. Schedule an update. Note this function may be called again
                 # in 1 second to check if the 'Unknown' situation has corrected itself.
                 self.print_error("History tab: Wallet has settled down, latching need_update to true")
+                parent.tab_refresher.mark_dirty(['history'])
                 parent.need_update.set()
             self._full_refresh_ctr += 1
         else:
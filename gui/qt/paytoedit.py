@@ -30,6 +30,7 @@ from .qrtextedit import ScanQRTextEdit
 
 import re
 import sys
+import threading
 from decimal import Decimal as PyDecimal  # Qt 5.12 also exports Decimal
 from electroncash import bitcoin
 from electroncash.address import Address, ScriptOutput, AddressError
@@ -49,6 +50,8 @@ normal_style = "PayToEdit { }"
 
 class PayToEdit(ScanQRTextEdit):
 
+    alias_resolved_signal = pyqtSignal(str, object)
+
     def __init__(self, win):
         ScanQRTextEdit.__init__(self)
         self.win = win
@@ -74,6 +77,7 @@ class PayToEdit(ScanQRTextEdit):
         self.errors = []
         self.is_pr = False
         self.is_alias = self.validated = False
+        self.alias_resolved_signal.connect(self.on_alias_resolved)
         self.scan_f = win.pay_to_URI
         self.update_size()
         self.payto_address = None
@@ -331,7 +335,9 @@ class PayToEdit(ScanQRTextEdit):
         super(PayToEdit,self).qr_input(_on_qr_success)
 
     def resolve(self):
-        self.is_alias, self.validated = False, False
+        ''' Called periodically by the window. If the text has changed and
+        looks like an OpenAlias, resolves it in a background thread; see
+        on_alias_resolved. '''
         if self.hasFocus():
             return
         if self.is_multiline():  # only supports single line entries atm
@@ -343,17 +349,29 @@ class PayToEdit(ScanQRTextEdit):
         if key == self.previous_payto:
             return
         self.previous_payto = key
+        self.is_alias, self.validated = False, False
         if not (('.' in key) and (not '<' in key) and (not ' ' in key)):
             return
         parts = key.split(sep=',')  # assuming single line
         if parts and len(parts) > 0 and Address.is_valid(parts[0]):
             return
-        try:
-            data = self.win.contacts.resolve(key)
-        except Exception as e:
-            print_error(f'error resolving alias: {repr(e)}')
+        contacts = self.win.contacts
+        def resolve_thread():
+            # This is a blocking network call with a timeout of several
+            # seconds. Results are cached by contacts.resolve_openalias().
+            try:
+                data = contacts.resolve(key)
+            except Exception as e:
+                print_error(f'error resolving alias: {repr(e)}')
+                data = None
+            self.alias_resolved_signal.emit(key, data)
+        threading.Thread(target=resolve_thread, name='PayToEdit/resolve', daemon=True).start()
+
+    def on_alias_resolved(self, key, data):
+        if not data or key != self.previous_payto:
+            # failed, or the text was changed while we were resolving
             return
-        if not data:
+        if self.is_pr or str(self.toPlainText()).strip() != key:
             return
 
         address = data.get('address')
@@ -25,7 +25,7 @@
 
 from electroncash.address import Address
 from electroncash.i18n import _
-from electroncash.util import format_time, age
+from electroncash.util import format_time, age, profiler
 from electroncash.plugins import run_hook
 from electroncash.paymentrequest import PR_UNKNOWN
 from PyQt5.QtGui import *
@@ -119,6 +119,7 @@ class RequestList(MyTreeWidget):
             self.parent.expires_label.hide()
             self.parent.expires_combo.show()
 
+    @profiler
     def on_update(self):
         self.chkVisible()
 
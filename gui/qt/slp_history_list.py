@@ -35,7 +35,8 @@ from electroncash.util import format_satoshis_nofloat
 from .slp_add_token_dialog import SlpAddTokenDialog
 
 from locale import localeconv
-from collections import defaultdict
+
+from .history_list import TxStatusCache
 
 TX_ICONS = [
     "warning.png",
@@ -51,45 +52,262 @@ TX_ICONS = [
 ]
 
 
-class HistoryList(MyTreeWidget):
+class SlpHistoryModel(MyTableModel):
+    ''' The wallet's token history, one row per (tx_hash, token_id).
+
+    refresh() only computes token deltas for txs that are new to it, or
+    whose inputs have just become known, via wallet.get_slp_tx_deltas();
+    everything else it already has. apply_changes() does the same for just
+    the txs a batch of wallet changes touched. Token names, amounts and
+    validity icons are formatted when a row is first painted and cached
+    until the next refresh() or until the row's tx changes. '''
+
+    # The tab shows tokens moved by invalid and burning txs too
+    VALIDITIES = (None, 0, 1, 2, 3, 4)
+
+    _icons = {}
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self.deltas = {}  # (tx_hash, token_id) -> delta
+        self.heights = {}  # tx_hash -> (height, conf, timestamp)
+        self.tx_keys = {}  # tx_hash -> the keys of its rows
+        self.seen = set()  # txs that self.deltas is up to date for
+        self.pruned = set()  # txs that were still missing inputs last refresh
+        self.statuses = TxStatusCache()
+        self.cells = {}  # (tx_hash, token_id) -> formatted row, see format_row
+        self.monospaceFont = QFont(MONOSPACE_FONT)
+        self.unknownBrush = QBrush(QColor("#888888"))
+        self.withdrawalBrush = QBrush(QColor("#BC1E1E"))
+
+    @classmethod
+    def _get_icon(cls, name):
+        ret = cls._icons.get(name)
+        if not ret:
+            cls._icons[name] = ret = QIcon(":icons/" + name)
+        return ret
+
+    def get_status(self, tx_hash):
+        return self.statuses.get(self.window.wallet, tx_hash, *self.heights[tx_hash])
+
+    def format_row(self, key):
+        ''' Returns (icon, icon tooltip, amount text, token name, is unknown token). '''
+        tx_hash, token_id = key
+        wallet = self.window.wallet
+        delta = self.deltas[key]
+        try:
+            validity = wallet.get_slp_token_info(tx_hash)['validity']
+        except KeyError: # Can happen if non-token tx (if burning tokens)
+            validity = None
+
+        tinfo = wallet.token_types.get(token_id)
+        if tinfo is None or tinfo['decimals'] == '?':
+            unktoken = True
+            tokenname = _("%.4s... (unknown - right click to add)"%(token_id,))
+            deltastr = '%+d'%(delta,)
+        else:
+            unktoken = False
+            tokenname=tinfo['name']
+            deltastr = format_satoshis_nofloat(delta, is_diff=True, decimal_point=tinfo['decimals'],)
+
+            # right-pad so the decimal points line up
+            # (note that because zeros are stripped, we have to locate decimal point here)
+            dp = localeconv()['decimal_point']
+            d1,d2 = deltastr.rsplit(dp,1)
+            deltastr += "\u2014"*(9-len(d2)) # \u2014 is long dash
+
+        if unktoken and validity in (None,0,1,2,3,4):
+            # If a token is not in our list of known token_ids, warn the user.
+            icon = self._get_icon("warning.png")
+            icontooltip = _("Unknown token ID")
+        elif validity == 0:
+            # For in-progress validation, always show gears regardless of confirmation status.
+            icon = self._get_icon("unconfirmed.svg")
+            icontooltip = _("SLP unvalidated")
+        elif validity in (None,2,3):
+            icon = self._get_icon("expired.svg")
+            if validity is None:
+                icontooltip = "non-SLP (tokens burned!)"
+            else:
+                icontooltip = "SLP invalid (tokens burned!)"
+        elif validity == 4:
+            icon = self._get_icon("expired.svg")
+            icontooltip = "Bad NFT1 Parent"
+        elif validity == 1:
+            # For SLP valid known txes, show the confirmation status (gears, few-confirmations, or green check)
+            conf = self.heights[tx_hash][1]
+            icon = self._get_icon(TX_ICONS[self.get_status(tx_hash)[0]])
+            icontooltip = _("SLP valid; ") + str(conf) + " confirmation" + ("s" if conf != 1 else "")
+        else:
+            raise ValueError(validity)
+        return icon, icontooltip, deltastr, tokenname, unktoken
+
+    def get_cell(self, key):
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = self.format_row(key)
+        return cell
+
+    def row_data(self, key, column, role):
+        tx_hash = key[0]
+        if role == Qt.DisplayRole:
+            if column == 1:
+                return tx_hash
+            if column == 2:
+                return self.get_status(tx_hash)[1]
+            if column in (3, 4):
+                return self.get_cell(key)[column - 1]
+            return ''
+        if role == Qt.UserRole:
+            return tx_hash
+        if role == Qt.DecorationRole and column == 0:
+            return self.get_cell(key)[0]
+        if role == Qt.ToolTipRole and column == 0:
+            return self.get_cell(key)[1]
+        if role == Qt.FontRole and column == 3:
+            return self.monospaceFont
+        if role == Qt.TextAlignmentRole and column == 3:
+            return int(Qt.AlignRight)
+        if role == Qt.ForegroundRole and column in (3, 4):
+            if self.get_cell(key)[4]:
+                return self.unknownBrush
+            if column == 3 and self.deltas[key] < 0:
+                return self.withdrawalBrush
+        return None
+
+    def default_key(self):
+        get_txpos = self.window.wallet.get_txpos
+        return lambda k: get_txpos(k[0])
+
+    def sort_key(self, column):
+        heights = self.heights
+        if column == 0:
+            return lambda k: (self.get_status(k[0])[0], heights[k[0]][1])
+        if column == 1:
+            return lambda k: k
+        if column == 2:
+            return self.default_key()  # chronological
+        if column == 3:
+            token_types = self.window.wallet.token_types
+            def amount(k):
+                decimals = token_types.get(k[1], {}).get('decimals')
+                return self.deltas[k] / 10**decimals if isinstance(decimals, int) else self.deltas[k]
+            return amount
+        return lambda k: self.get_cell(k)[3].lower()
+
+    def refresh(self):
+        wallet = self.window.wallet
+        with wallet.lock:
+            txs = {h for h in wallet.tx_addr_hist if h in wallet.transactions}
+            pruned = set(wallet.pruned_txo_values)
+        # New txs, and ones whose inputs were filled in since last time
+        dirty = ((txs - self.seen) | (self.pruned - pruned)) & txs
+        self.seen, self.pruned = txs, pruned
+
+        keys = {k for k in self.deltas if k[0] in txs and k[0] not in dirty}
+        for tx_hash in dirty:
+            self.statuses.discard(tx_hash)
+            for token_id, delta in wallet.get_slp_tx_deltas(tx_hash, self.VALIDITIES).items():
+                key = (tx_hash, token_id)
+                self.deltas[key] = delta
+                keys.add(key)
+        self.heights = {k[0]: wallet.get_tx_height(k[0]) for k in keys}
+        # keep rows on their way out sortable until they're removed
+        self.heights.update((k[0], (0, 0, 0)) for k in self.keys if k[0] not in self.heights)
+        self.cells.clear()
+        self.set_keys(keys)
+        for k in self.deltas.keys() - keys:
+            del self.deltas[k]
+        self.tx_keys = {}
+        for k in keys:
+            self.tx_keys.setdefault(k[0], []).append(k)
+        self.rows_changed()
+
+    def apply_changes(self, tx_hashes):
+        ''' Redoes the rows of `tx_hashes' (txs that were added, removed or
+        verified), and of the txs whose inputs have come in since, with row
+        insertions, removals and updates for just those. Returns False,
+        having changed nothing, if there are too many txs and the caller
+        should refresh() instead. '''
+        wallet = self.window.wallet
+        with wallet.lock:
+            pruned = set(wallet.pruned_txo_values)
+            tx_hashes = set(tx_hashes) | (self.pruned - pruned)
+            if len(tx_hashes) > self.RESET_THRESHOLD:
+                return False
+            present = {h for h in tx_hashes if h in wallet.tx_addr_hist and h in wallet.transactions}
+        self.pruned = pruned
+        added, removed, changed = [], [], []
+        for tx_hash in tx_hashes:
+            old_keys = self.tx_keys.pop(tx_hash, ())
+            new_deltas = {}
+            self.seen.discard(tx_hash)
+            if tx_hash in present:
+                self.seen.add(tx_hash)
+                self.statuses.discard(tx_hash)
+                new_deltas = {(tx_hash, token_id): delta for token_id, delta
+                              in wallet.get_slp_tx_deltas(tx_hash, self.VALIDITIES).items()}
+            removed.extend(k for k in old_keys if k not in new_deltas)
+            for k, delta in new_deltas.items():
+                (changed if k in old_keys else added).append(k)
+                self.deltas[k] = delta
+            if new_deltas:
+                self.tx_keys[tx_hash] = list(new_deltas)
+                self.heights[tx_hash] = wallet.get_tx_height(tx_hash)
+        # rows on their way out keep their data until they're removed
+        self.remove_keys(removed)
+        for k in removed:
+            del self.deltas[k]
+            self.cells.pop(k, None)
+            if k[0] not in self.tx_keys:
+                self.heights.pop(k[0], None)
+        for k in changed:
+            self.cells.pop(k, None)
+        self.rows_changed(changed)
+        self.reposition(changed)
+        self.insert_keys(added)
+        return True
+
+    def tx_changed(self, tx_hash, height=None, conf=None, timestamp=None):
+        ''' Updates the rows of tx_hash after a change of its validity or
+        (if given) its height. '''
+        keys = self.tx_keys.get(tx_hash)
+        if not keys:
+            return
+        if height is not None:
+            self.heights[tx_hash] = (height, conf, timestamp)
+        for k in keys:
+            self.cells.pop(k, None)
+        self.rows_changed(keys)
+
+
+class HistoryList(MyTreeView):
     filter_columns = [2, 3, 4]  # Date, Description, Amount
+    default_sort = MyTreeView.SortSpec(0, Qt.AscendingOrder)
 
 
     def slp_validity_slot(self, txid, validity):
         # This gets pinged by the SLP validator when a validation job finishes.
         # (see lib/wallet.py : slp_check_validation() )
-        if validity in (2,3,4):
-            # If validator found 'invalid', then we need to update balances,
-            # which requires recalculating / refreshing the whole list.
-            self.update()
-        else:
-            # If validator found 'valid' then the balances are OK, so just
-            # update the relevant items (note: may be multiple matches.).
-            items = self._allitems.get(txid, [])
-            for item in items:
-                self.update_item_state(item)
+        # Only the validity icon changes: the tab counts the tokens moved by
+        # txs of any validity, so their amounts stay the same.
+        self.source_model.tx_changed(txid)
 
     def __init__(self, parent=None):
-        MyTreeWidget.__init__(self, parent, self.create_menu, [], 4, deferred_updates=True)
+        super().__init__(parent, self.create_menu, SlpHistoryModel(parent), [], 4, [],
+                         deferred_updates=True)
         self.slp_validity_signal = parent.gui_object.slp_validity_signal
         self.slp_validity_signal.connect(self.slp_validity_slot, Qt.QueuedConnection)
-        self.editable_columns=[]
         self.refresh_headers()
         self.setColumnHidden(1, True)
-        self.setSortingEnabled(True)
-        self.sortByColumn(0, Qt.AscendingOrder)
         self.wallet = None
-        self._allitems = defaultdict(list)
 
     def refresh_headers(self):
         headers = [ '', '',_('Date'), _('Amount'), _('Token') ]
 
         self.update_headers(headers)
 
-    def get_domain(self):
-        '''Replaced in address_dialog.py'''
-        return self.wallet.get_addresses()
-
     @rate_limited(1.0, classlevel=True, ts_after=True) # We rate limit the history list refresh no more than once every second, app-wide
     def update(self):
         if self.parent and self.parent.cleaned_up:
@@ -100,137 +318,39 @@ class HistoryList(MyTreeWidget):
     @profiler
     def on_update(self):
         self.wallet = self.parent.wallet
-        h = self.wallet.get_history(self.get_domain())
-        slp_history =self.wallet.get_slp_history(domain=None, validities_considered=(None,0,1,2,3,4))
-
-        item = self.currentItem()
-        current_tx = item.data(0, Qt.UserRole) if item else None
-        self.clear()
-
-        self._allitems.clear()
-        for h_item in slp_history:
-            tx_hash, height, conf, timestamp, delta, token_id = h_item
-            status, status_str = self.wallet.get_tx_status(tx_hash, height, conf, timestamp)
-
-            entry = ['', tx_hash, status_str, '', '']
-            item = SortableTreeWidgetItem(entry)
-            item.setData(0, SortableTreeWidgetItem.DataRole, (status, conf))
-            item.setData(0, Qt.UserRole, tx_hash)
-            item.setData(4, Qt.UserRole, token_id)
-            item.setData(3, Qt.UserRole, delta)
-
-            item.setTextAlignment(3, Qt.AlignRight)
-            item.setFont(3, QFont(MONOSPACE_FONT))
-
-            self.update_item_state(item)
-
-            self.insertTopLevelItem(0, item)
-            if current_tx == tx_hash:
-                self.setCurrentItem(item)
-
-            self._allitems[tx_hash].append(item)
-
-    def on_doubleclick(self, item, column):
-        tx_hash = item.data(0, Qt.UserRole)
+        self.source_model.refresh()
+
+    def apply_wallet_changes(self, changes):
+        ''' Applies a WalletChanges batch to the rows of the txs it concerns.
+        Returns False if the list needs a full update instead. '''
+        if not self.wallet:
+            return False
+        txs = changes.tx_added | changes.tx_removed | set(changes.tx_verified)
+        return not txs or self.source_model.apply_changes(txs)
+
+    def on_doubleclick(self, index):
+        tx_hash = index.data(Qt.UserRole)
         tx = self.wallet.transactions.get(tx_hash)
         self.parent.show_transaction(tx)
 
-    def update_item_state(self, item):
-        tx_hash = item.data(0, Qt.UserRole)
-        status, conf = item.data(0, SortableTreeWidgetItem.DataRole)
-        token_id = item.data(4, Qt.UserRole)
-        delta = item.data(3, Qt.UserRole)
-
-        try:
-            validity = self.wallet.get_slp_token_info(tx_hash)['validity']
-        except KeyError: # Can happen if non-token tx (if burning tokens)
-            validity = None
-
-        try:
-            tinfo = self.wallet.token_types[token_id]
-        except KeyError:
-            unktoken = True
-            tokenname = _("%.4s... (unknown - right click to add)"%(token_id,))
-            deltastr = '%+d'%(delta,)
-        else:
-            if tinfo['decimals'] == '?':
-                unktoken = True
-                tokenname = _("%.4s... (unknown - right click to add)"%(token_id,))
-                deltastr = '%+d'%(delta,)
-            else:
-                unktoken = False
-                tokenname=tinfo['name']
-                deltastr = format_satoshis_nofloat(delta, is_diff=True, decimal_point=tinfo['decimals'],)
-
-                # right-pad so the decimal points line up
-                # (note that because zeros are stripped, we have to locate decimal point here)
-                dp = localeconv()['decimal_point']
-                d1,d2 = deltastr.rsplit(dp,1)
-                deltastr += "\u2014"*(9-len(d2)) # \u2014 is long dash
-
-        if unktoken and validity in (None,0,1,2,3,4):
-            # If a token is not in our list of known token_ids, warn the user.
-            icon=QIcon(":icons/warning.png")
-            icontooltip = _("Unknown token ID")
-        elif validity == 0:
-            # For in-progress validation, always show gears regardless of confirmation status.
-            icon=QIcon(":icons/unconfirmed.svg")
-            icontooltip = _("SLP unvalidated")
-        elif validity in (None,2,3):
-            icon=QIcon(":icons/expired.svg")
-            if validity is None:
-                icontooltip = "non-SLP (tokens burned!)"
-            else:
-                icontooltip = "SLP invalid (tokens burned!)"
-        elif validity == 4:
-            icon=QIcon(":icons/expired.svg")
-            icontooltip = "Bad NFT1 Parent"
-        elif validity == 1:
-            # For SLP valid known txes, show the confirmation status (gears, few-confirmations, or green check)
-            icon = QIcon(":icons/" + TX_ICONS[status])
-            icontooltip = _("SLP valid; ") + str(conf) + " confirmation" + ("s" if conf != 1 else "")
-        else:
-            raise ValueError(validity)
-
-        if unktoken:
-            item.setForeground(3, QBrush(QColor("#888888")))
-            item.setForeground(4, QBrush(QColor("#888888")))
-        elif delta < 0:
-            item.setForeground(3, QBrush(QColor("#BC1E1E")))
-
-        item.setIcon(0, icon)
-        item.setToolTip(0, icontooltip)
-        item.setText(4, tokenname)
-        item.setText(3, deltastr)
-
     def update_item_netupdate(self, tx_hash, height, conf, timestamp):
         wallet = getattr(self,'wallet', None)
         if not wallet:
             return
-        items = self._allitems.get(tx_hash, [])
-        if not items:
-            return
-        status, status_str = wallet.get_tx_status(tx_hash, height, conf, timestamp)
-        for item in items:
-            item.setData(0, SortableTreeWidgetItem.DataRole, (status, conf))
-            item.setText(2, status_str)
-            self.update_item_state(item)
+        self.source_model.tx_changed(tx_hash, height, conf, timestamp)
 
     def create_menu(self, position):
-        item = self.currentItem()
-        if not item:
-            return
-        column = self.currentColumn()
-        tx_hash = item.data(0, Qt.UserRole)
-        token_id = item.data(4, Qt.UserRole)
-        if not tx_hash:
+        index = self.indexAt(position)
+        if not index.isValid():
             return
-        if column is 0:
+        column = index.column()
+        tx_hash, token_id = self.key_at(index)
+        if column == 0:
             column_title = "ID"
             column_data = tx_hash
         else:
-            column_title = self.headerItem().text(column)
-            column_data = item.text(column)
+            column_title = self.source_model.headerData(column, Qt.Horizontal)
+            column_data = index.data() or ''
 
         tx_URL = web.BE_URL(self.config, 'tx', tx_hash)
         height, conf, timestamp = self.wallet.get_tx_height(tx_hash)
@@ -247,10 +367,6 @@ class HistoryList(MyTreeWidget):
             menu.addAction(_("Add this token"), lambda: SlpAddTokenDialog(self.parent, token_id_hex = token_id, allow_overwrite=True))
 
         menu.addAction(_("Copy {}").format(column_title), lambda: self.parent.app.clipboard().setText(column_data))
-        if column in self.editable_columns:
-            # We grab a fresh reference to the current item, as it has been deleted in a reported issue.
-            menu.addAction(_("Edit {}").format(column_title),
-                lambda: self.currentItem() and self.editItem(self.currentItem(), column))
 
         menu.addAction(_("Details"), lambda: self.parent.show_transaction(tx))
         if is_unconfirmed and tx:
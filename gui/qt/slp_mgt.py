@@ -28,7 +28,7 @@ from electroncash.i18n import _
 import electroncash.web as web
 from electroncash.address import Address
 from electroncash.plugins import run_hook
-from electroncash.util import FileImportFailed
+from electroncash.util import FileImportFailed, profiler
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import (
@@ -141,6 +141,7 @@ class SlpMgt(MyTreeWidget):
             return
         super().update()
 
+    @profiler
     def on_update(self):
         selected_item = self.currentItem()
         current_token_id = selected_item.data(0, Qt.UserRole) if selected_item else None
@@ -7,6 +7,7 @@ import threading
 import os
 import webbrowser
 from collections import namedtuple
+from itertools import groupby
 from functools import partial, wraps
 
 from electroncash.address import Address
@@ -778,6 +779,396 @@ class MyTreeWidget(QTreeWidget):
                                 for column in columns]))
 
 
+class MyTreeView(QTreeView):
+    ''' The model/view counterpart of MyTreeWidget, for lists that can get
+    too big to build a QTreeWidgetItem for every row on every update.
+
+    Subclasses pass in a MyTableModel whose data() formats rows only when
+    the view asks for them, and implement on_update() to bring that
+    model in line with the wallet incrementally, so that Qt keeps the
+    selection and scroll position across updates. The view shows the model
+    through a MyFilterProxyModel, so indexes the view hands out are proxy
+    indexes; use key_at() to get at the model's key for one. The update
+    deferral, sorting, filtering and editing conventions are the same as
+    MyTreeWidget's. '''
+
+    SortSpec = MyTreeWidget.SortSpec
+    default_sort : SortSpec = None
+    filter_columns = []
+
+    def __init__(self, parent, create_menu, model, headers, stretch_column=None,
+                 editable_columns=None,
+                 *, deferred_updates=False, save_sort_settings=False):
+        QTreeView.__init__(self, parent)
+        self.parent = parent
+        self.config = self.parent.config
+        self.stretch_column = stretch_column
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.customContextMenuRequested.connect(create_menu)
+        self.setUniformRowHeights(True)
+        self.setRootIsDecorated(False)
+        self.setItemsExpandable(False)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        # Editing is only ever started explicitly, see on_doubleclick
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.deferred_updates = deferred_updates
+        self.deferred_update_ct, self._forced_update = 0, False
+        self._save_sort_settings = save_sort_settings
+        self.pending_update = False
+        if editable_columns is None:
+            editable_columns = [stretch_column]
+        self.editable_columns = editable_columns
+        self.source_model = model
+        model.setParent(self)
+        self.proxy = MyFilterProxyModel(self, self.filter_columns)
+        self.proxy.setSourceModel(model)
+        self.setModel(self.proxy)
+        self.doubleClicked.connect(self.on_doubleclick)
+        self.update_headers(headers)
+        self.current_filter = ""
+
+        self._setup_save_sort_mechanism()
+
+    # These don't depend on the kind of view
+    _setup_save_sort_mechanism = MyTreeWidget._setup_save_sort_mechanism
+    should_defer_update_incr = MyTreeWidget.should_defer_update_incr
+
+    def update_headers(self, headers):
+        model = self.source_model
+        model.set_headers(headers)
+        self.header().setStretchLastSection(False)
+        for col in range(len(headers)):
+            sm = QHeaderView.Stretch if col == self.stretch_column else QHeaderView.ResizeToContents
+            self.header().setSectionResizeMode(col, sm)
+        if self.isSortingEnabled() and model.sort_column is not None and 0 <= model.sort_column < len(headers):
+            # A change in the number of columns resets the header's sort indicator
+            self.header().setSortIndicator(model.sort_column, model.sort_order)
+
+    def is_editing(self):
+        return self.state() == QAbstractItemView.EditingState
+
+    def keyPressEvent(self, event):
+        if event.key() in [ Qt.Key_F2, Qt.Key_Return ] and not self.is_editing():
+            index = self.currentIndex()
+            if index.isValid():
+                self.on_activated(index)
+        else:
+            QTreeView.keyPressEvent(self, event)
+
+    def permit_edit(self, index):
+        return (index.column() in self.editable_columns
+                and self.on_permit_edit(index))
+
+    def on_permit_edit(self, index):
+        return True
+
+    def on_doubleclick(self, index):
+        if self.permit_edit(index):
+            self.edit(index)
+
+    def on_activated(self, index):
+        # on 'enter' we show the menu
+        pt = self.visualRect(index).bottomLeft()
+        pt.setX(50)
+        self.customContextMenuRequested.emit(pt)
+
+    def closeEditor(self, editor, hint):
+        super().closeEditor(editor, hint)
+        # Now do any update that came in while editing
+        if self.pending_update:
+            self.pending_update = False
+            self.update()
+
+    def update(self):
+        # Defer updates if editing
+        if self.is_editing():
+            self.pending_update = True
+        else:
+            # Deferred update mode won't actually update the GUI if it's
+            # not on-screen, and will instead update it the next time it is
+            # shown.
+            if self.should_defer_update_incr():
+                return
+            self.on_update()
+            self.deferred_update_ct = 0
+
+    def on_update(self):
+        # Reimplemented in subclasses
+        pass
+
+    def key_at(self, index):
+        ''' The model key of the row at (proxy) index, or None. '''
+        if not index.isValid():
+            return None
+        return self.source_model.keys[self.proxy.mapToSource(index).row()]
+
+    def selected_keys(self):
+        ''' The model keys of the selected rows, in display order. '''
+        rows = sorted(self.selectionModel().selectedRows(), key=lambda i: i.row())
+        return [self.key_at(index) for index in rows]
+
+    def showEvent(self, e):
+        super().showEvent(e)
+        if e.isAccepted() and self.deferred_update_ct:
+            self._forced_update = True
+            self.update()
+            self._forced_update = False
+
+    def filter(self, p):
+        if not self.filter_columns:
+            return
+        self.current_filter = p.lower()
+        self.proxy.set_filter_text(self.current_filter)
+
+
+class MyFilterProxyModel(QSortFilterProxyModel):
+    ''' Does the filtering for MyTreeView: a row is shown if its model's
+    row_visible() allows it and one of `filter_columns' contains the filter
+    text. Sorting is handed down to the MyTableModel, which does it with
+    precomputed keys, and the proxy just keeps the model's row order. '''
+
+    def __init__(self, parent, filter_columns):
+        super().__init__(parent)
+        self.filter_columns = filter_columns
+        self.filter_text = ''
+
+    def set_filter_text(self, p):
+        if p != self.filter_text:
+            self.filter_text = p
+            self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        model = self.sourceModel()
+        if not model.row_visible(model.keys[source_row]):
+            return False
+        p = self.filter_text
+        return not p or any(p in (model.index(source_row, column).data() or '').lower()
+                            for column in self.filter_columns)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sourceModel().sort(column, order)
+
+
+class MyTableModel(QAbstractTableModel):
+    ''' A flat model for MyTreeView: one row per (hashable) key, in the
+    order of self.keys. Subclasses implement row_data() to produce cell data
+    on demand, sort_key() for the sortable columns and default_key() for the
+    order rows are in before the view is ever sorted.
+
+    Sorting is done here, in Python, with precomputed keys, rather than
+    in the view's QSortFilterProxyModel -- which would call back into data()
+    twice per comparison. Models that learn of their changes row by row can
+    keep the order up with insert_keys(), remove_keys() and reposition()
+    instead of set_keys(). '''
+
+    # Past this many inserted or removed rows it's cheaper to just reset.
+    RESET_THRESHOLD = 1000
+
+    def __init__(self):
+        super().__init__()
+        self.headers = []
+        self.keys = []  # display order
+        self.row_of = {}  # key -> index into self.keys
+        self.sort_column, self.sort_order = None, Qt.AscendingOrder
+
+    def set_headers(self, headers):
+        if len(headers) != len(self.headers):
+            self.beginResetModel()
+            self.headers = list(headers)
+            self.endResetModel()
+        else:
+            self.headers = list(headers)
+            self.headerDataChanged.emit(Qt.Horizontal, 0, len(headers) - 1)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.keys)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and section < len(self.headers):
+            return self.headers[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        row = index.row()
+        if not index.isValid() or row >= len(self.keys):
+            return None
+        return self.row_data(self.keys[row], index.column(), role)
+
+    def row_data(self, key, column, role):
+        raise NotImplementedError
+
+    def row_visible(self, key):
+        ''' Reimplement to hide rows regardless of the filter text. The
+        view's proxy.invalidateFilter() has to be called when the answer
+        changes other than through a dataChanged for the row. '''
+        return True
+
+    def default_key(self):
+        raise NotImplementedError
+
+    def sort_key(self, column):
+        raise NotImplementedError
+
+    @staticmethod
+    def numeric_text_key(text):
+        ''' A sort key for text that is usually a number, like
+        SortableTreeWidgetItem's. '''
+        try:
+            return (0, float(text.replace(',', '')), '')
+        except ValueError:
+            return (1, 0.0, text)
+
+    def _sort_spec(self):
+        if self.sort_column is None or self.sort_column < 0:
+            return self.default_key(), False
+        return self.sort_key(self.sort_column), self.sort_order == Qt.DescendingOrder
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column, self.sort_order = column, order
+        self.resort()
+
+    def resort(self):
+        ''' Puts self.keys back into sort order, keeping persistent indexes
+        -- and so the view's selection and current row -- on the same keys. '''
+        key, reverse = self._sort_spec()
+        sort_keys = {k: key(k) for k in self.keys}
+        self._set_order(sorted(self.keys, key=sort_keys.__getitem__, reverse=reverse))
+
+    def _set_order(self, new_order):
+        ''' Changes the order of the rows to `new_order' (same keys). '''
+        if new_order == self.keys:
+            return
+        self.layoutAboutToBeChanged.emit()
+        old_order = self.keys
+        self.keys = new_order
+        self.row_of = row_of = {k: i for i, k in enumerate(new_order)}
+        old_indexes = self.persistentIndexList()
+        self.changePersistentIndexList(old_indexes, [self.index(row_of[old_order[i.row()]], i.column())
+                                                     for i in old_indexes])
+        self.layoutChanged.emit()
+
+    def set_keys(self, keys, on_removed=None):
+        ''' Makes the model's rows be exactly `keys' (a dict or set), with
+        row removals and insertions for the differences, and re-sorts.
+        on_removed(key) is called for each key that goes away. Doesn't
+        signal any change to the rows that stay; see rows_changed(). '''
+        removed = [k for k in self.keys if k not in keys]
+        added = [k for k in keys if k not in self.row_of]
+        if on_removed:
+            for k in removed:
+                on_removed(k)
+        if len(removed) + len(added) > self.RESET_THRESHOLD:
+            self.beginResetModel()
+            key, reverse = self._sort_spec()
+            self.keys = sorted(keys, key=key, reverse=reverse)
+            self.row_of = {k: i for i, k in enumerate(self.keys)}
+            self.endResetModel()
+            return
+        root = QModelIndex()
+        for row in sorted((self.row_of[k] for k in removed), reverse=True):
+            self.beginRemoveRows(root, row, row)
+            del self.keys[row]
+            self.endRemoveRows()
+        if added:
+            n = len(self.keys)
+            self.beginInsertRows(root, n, n + len(added) - 1)
+            self.keys.extend(added)
+            self.endInsertRows()
+        self.row_of = {k: i for i, k in enumerate(self.keys)}
+        self.resort()
+
+    def _reindex(self, first=0, last=None):
+        ''' Brings self.row_of up to date for rows first..last-1. '''
+        keys, row_of = self.keys, self.row_of
+        for row in range(first, len(keys) if last is None else last):
+            row_of[keys[row]] = row
+
+    def _bisect(self, key, reverse, sort_key):
+        ''' The row a row with `sort_key' goes to: after any equal ones. '''
+        keys, lo, hi = self.keys, 0, len(self.keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (key(keys[mid]) < sort_key) if reverse else (sort_key < key(keys[mid])):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def insert_keys(self, keys):
+        ''' Inserts rows for `keys' (none of which may be in the model yet),
+        each at its place in the sort order. '''
+        key, reverse = self._sort_spec()
+        root, first = QModelIndex(), len(self.keys)
+        for k in keys:
+            row = self._bisect(key, reverse, key(k))
+            self.beginInsertRows(root, row, row)
+            self.keys.insert(row, k)
+            self.endInsertRows()
+            first = min(first, row)
+        self._reindex(first)
+
+    def remove_keys(self, keys, on_removed=None):
+        ''' Removes the rows of those of `keys' that are in the model.
+        on_removed(key) is called for each of them, before its removal. '''
+        rows = sorted((self.row_of[k] for k in keys if k in self.row_of), reverse=True)
+        root = QModelIndex()
+        for row in rows:
+            k = self.keys[row]
+            if on_removed:
+                on_removed(k)
+            self.beginRemoveRows(root, row, row)
+            del self.keys[row]
+            del self.row_of[k]
+            self.endRemoveRows()
+        if rows:
+            self._reindex(rows[-1])
+
+    def reposition(self, keys):
+        ''' Puts the rows of `keys', whose sort keys may have changed, back
+        in sort order among the others. Only their sort keys are computed;
+        a row that is still in order where it is stays put. '''
+        moving = {k for k in keys if k in self.row_of}
+        if not moving:
+            return
+        key, reverse = self._sort_spec()
+        before = (lambda a, b: b < a) if reverse else (lambda a, b: a < b)
+        rest = [k for k in self.keys if k not in moving]  # still in order
+        old_keys, self.keys = self.keys, rest
+        places = []
+        for n, row in enumerate(sorted(self.row_of[k] for k in moving)):
+            k, sort_key = old_keys[row], key(old_keys[row])
+            place = row - n  # where it is now, among the rest
+            if ((place > 0 and before(sort_key, key(rest[place - 1])))
+                    or (place < len(rest) and before(key(rest[place]), sort_key))):
+                place = self._bisect(key, reverse, sort_key)
+            places.append((place, sort_key, k))
+        self.keys = old_keys
+        new_order, prev = [], 0
+        # rows going to the same place go in their own order (stable, as
+        # places is in row order)
+        for place, group in groupby(sorted(places, key=lambda p: p[0]), key=lambda p: p[0]):
+            new_order.extend(rest[prev:place])
+            new_order.extend(p[2] for p in sorted(group, key=lambda p: p[1], reverse=reverse))
+            prev = place
+        new_order.extend(rest[prev:])
+        self._set_order(new_order)
+
+    def rows_changed(self, keys=None, column=None):
+        ''' Signals that the given rows (default: all of them) changed, in
+        one column or all of them. '''
+        first, last = (column, column) if column is not None else (0, len(self.headers) - 1)
+        if keys is None:
+            if self.keys:
+                self.dataChanged.emit(self.index(0, first), self.index(len(self.keys) - 1, last))
+            return
+        for k in keys:
+            row = self.row_of.get(k)
+            if row is not None:
+                self.dataChanged.emit(self.index(row, first), self.index(row, last))
+
 class OverlayControlMixin:
     STYLE_SHEET_COMMON = '''
     QPushButton { border-width: 1px; padding: 0px; margin: 0px; }
@@ -882,6 +1273,56 @@ class ButtonsTextEdit(OverlayControlMixin, QPlainTextEdit):
         self.setText = self.setPlainText
         self.text = self.toPlainText
 
+class TabRefreshScheduler(PrintError, QObject):
+    ''' Keeps track of which of a window's lists are out of date, and
+    only refreshes the ones that are on screen. A list that is hidden when
+    it goes stale is refreshed when it is next shown.
+
+    Lists are registered by name with add(). mark_dirty() may be called
+    from any thread; refresh() must be called from the GUI thread. '''
+
+    def __init__(self, parent):
+        QObject.__init__(self, parent)
+        self.lists = {}  # name -> list widget
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def add(self, name, widget):
+        self.lists[name] = widget
+        widget.installEventFilter(self)
+
+    def mark_dirty(self, names=None):
+        ''' Marks the lists called `names' (default: all of them) as out of
+        date. Names of lists that weren't add()ed are ignored. '''
+        with self.lock:
+            self.dirty.update(self.lists if names is None else (n for n in names if n in self.lists))
+
+    def is_dirty(self, name):
+        with self.lock:
+            return name in self.dirty
+
+    def refresh(self):
+        ''' Refreshes the dirty lists that are visible. Returns their names. '''
+        with self.lock:
+            todo = [name for name in self.dirty if self.lists[name].isVisible()]
+            self.dirty.difference_update(todo)
+        for name in todo:
+            self.lists[name].update()
+        return todo
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Show:
+            for name, widget in self.lists.items():
+                if widget is obj:
+                    with self.lock:
+                        was_dirty = name in self.dirty
+                        self.dirty.discard(name)
+                    if was_dirty:
+                        widget.update()
+                    break
+        return False
+
+
 class TaskThread(PrintError, QThread):
     '''Thread that runs background tasks.  Callbacks are guaranteed
     to happen in the context of its parent.'''
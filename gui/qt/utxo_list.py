@@ -25,31 +25,175 @@
 from .util import *
 from electroncash.i18n import _
 from electroncash.address import Address
+from electroncash.util import profiler
 
 
-class UTXOList(MyTreeWidget):
+class UTXOModel(MyTableModel):
+    ''' The wallet's coins, one row per coin, keyed by "prevout_hash:n".
+
+    Rows are formatted when the view first asks for them and the result is
+    kept until the next set_coins() or labels_changed(), or until the coin
+    changes. apply_changes() redoes just the coins of some addresses. '''
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self.coins = {}  # name -> coin dict, as returned by wallet.get_utxos()
+        self.by_address = {}  # Address -> set of the names of its coins
+        self.cells = {}  # name -> formatted row, see format_row
+        # cache some values to avoid constructing Qt objects for every data() call (this is important for large wallets)
+        self.monospaceFont = QFont(MONOSPACE_FONT)
+        self.lightBlue = QColor('lightblue') if not ColorScheme.dark_scheme else QColor('blue')
+        self.blue = ColorScheme.BLUE.as_color(True)
+        self.cyanBlue = QColor('#3399ff')
+
+    def set_coins(self, coins):
+        new_coins = {UTXOList.get_name(x): x for x in coins}
+        # rows on their way out stay formattable until they're removed
+        self.coins.update(new_coins)
+        self.cells.clear()
+        self.set_keys(new_coins)
+        self.coins = new_coins
+        self.by_address = by_address = {}
+        for name, x in new_coins.items():
+            by_address.setdefault(x['address'], set()).add(name)
+        self.rows_changed()
+
+    def apply_changes(self, addresses):
+        ''' Brings the coins of `addresses' in line with the wallet, with
+        row insertions, removals and updates for just those. Returns False,
+        having changed nothing, if there are too many addresses and the
+        caller should set_coins() instead. '''
+        if len(addresses) > self.RESET_THRESHOLD:
+            return False
+        wallet = self.window.wallet
+        added, removed, changed = [], [], []
+        for addr in addresses:
+            coins = wallet.get_addr_utxo(addr, exclude_slp=False)
+            names = self.by_address.pop(addr, set())
+            removed.extend(names - coins.keys())
+            for name, x in coins.items():
+                if name not in names:
+                    added.append(name)
+                elif x != self.coins[name]:
+                    changed.append(name)
+                self.coins[name] = x
+            if coins:
+                self.by_address[addr] = set(coins)
+        # rows on their way out keep their data until they're removed
+        self.remove_keys(removed)
+        for name in removed:
+            del self.coins[name]
+            self.cells.pop(name, None)
+        for name in changed:
+            self.cells.pop(name, None)
+        self.rows_changed(changed)
+        self.reposition(changed)
+        self.insert_keys(added)
+        return True
+
+    def labels_changed(self):
+        self.cells.clear()
+        self.rows_changed(column=1)
+        if self.sort_column == 1:
+            self.resort()
+
+    def format_row(self, name):
+        ''' Returns (column texts, background, foreground, frozen tooltip, frozen flags) '''
+        wallet = self.window.wallet
+        x = self.coins[name]
+        address = x['address']
+        label = wallet.get_label(x['prevout_hash'])
+        amount = self.window.format_amount(x['value'], is_diff=False, whitespaces=True)
+        texts = [address.to_ui_string(), label, amount, str(x['height']), UTXOList.get_name_short(x)]
+        a_frozen = wallet.is_frozen(address)
+        c_frozen = x['is_frozen_coin']
+        background = foreground = None
+        toolTipFrozen = ''
+        if a_frozen and not c_frozen:
+            # address is frozen, coin is not frozen
+            # emulate the "Look" off the address_list .py's frozen entry
+            background = self.lightBlue
+            toolTipFrozen = _("Address is frozen")
+        elif c_frozen and not a_frozen:
+            # coin is frozen, address is not frozen
+            background = self.blue
+            toolTipFrozen = _("Coin is frozen")
+        elif c_frozen and a_frozen:
+            # both coin and address are frozen so color-code it to indicate that.
+            background = self.lightBlue
+            foreground = self.cyanBlue
+            toolTipFrozen = _("Coin & Address are frozen")
+        # the address-level-frozen and coin-level-frozen flags, for create_menu() below.
+        flags = "{}{}".format(("a" if a_frozen else ""), ("c" if c_frozen else ""))
+        return texts, background, foreground, toolTipFrozen, flags
+
+    def get_cell(self, name):
+        cell = self.cells.get(name)
+        if cell is None:
+            cell = self.cells[name] = self.format_row(name)
+        return cell
+
+    def row_data(self, name, column, role):
+        if role == Qt.DisplayRole:
+            return self.get_cell(name)[0][column]
+        if role == Qt.FontRole:
+            if column in (0, 2, 4):
+                return self.monospaceFont
+        elif role == Qt.ToolTipRole:
+            if column == 0:
+                return self.get_cell(name)[3] or None
+            if column == 1:
+                # just in case it doesn't fit horizontally, we also provide it as a tool tip where hopefully it won't be elided
+                return self.get_cell(name)[0][1] or None
+            if column == 4:
+                return name  # just in case they like to see lots of hex digits :)
+        elif role == Qt.BackgroundRole and column == 0:
+            return self.get_cell(name)[1]
+        elif role == Qt.ForegroundRole and column == 0:
+            return self.get_cell(name)[2]
+        elif role == Qt.UserRole:
+            return name
+        elif role == Qt.UserRole+1:
+            return self.get_cell(name)[4]
+        return None
+
+    def default_key(self):
+        return lambda name: name
+
+    def sort_key(self, column):
+        coins = self.coins
+        if column == 0:
+            return lambda name: coins[name]['address'].to_ui_string()
+        if column == 1:
+            get_label = self.window.wallet.get_label
+            return lambda name: get_label(coins[name]['prevout_hash']).lower()
+        if column == 2:
+            return lambda name: coins[name]['value']
+        if column == 3:
+            return lambda name: coins[name]['height']
+        return self.default_key()
+
+
+class UTXOList(MyTreeView):
     filter_columns = [0, 2]  # Address, Label
     col_output_point = 4  # <-- index of the 'Output point' column. make sure to update this if you modify the header below...
     col_address = 0
-    default_sort = MyTreeWidget.SortSpec(2, Qt.DescendingOrder)  # sort by amount, descending
+    default_sort = MyTreeView.SortSpec(2, Qt.DescendingOrder)  # sort by amount, descending
 
     def __init__(self, parent=None):
-        MyTreeWidget.__init__(self, parent, self.create_menu, [ _('Address'), _('Label'), _('Amount'), _('Height'), _('Output point')], 1, deferred_updates=True, save_sort_settings=True)
-        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.setSortingEnabled(True)
+        super().__init__(parent, self.create_menu, UTXOModel(parent),
+                         [ _('Address'), _('Label'), _('Amount'), _('Height'), _('Output point')], 1, [],
+                         deferred_updates=True, save_sort_settings=True)
         # force attributes to always be defined, even if None, at construction.
         self.wallet = self.parent.wallet
-        self.utxos = list()
-        # cache some values to avoid constructing Qt objects for every pass through self.on_update (this is important for large wallets)
-        self.monospaceFont = QFont(MONOSPACE_FONT)
-        self.lightBlue = QColor('lightblue') if not ColorScheme.dark_scheme else QColor('blue')
-        self.blue = ColorScheme.BLUE.as_color(True)
-        self.cyanBlue = QColor('#3399ff')
 
-    def get_name(self, x):
+    @staticmethod
+    def get_name(x):
         return x.get('prevout_hash') + ":%d"%x.get('prevout_n')
 
-    def get_name_short(self, x):
+    @staticmethod
+    def get_name_short(x):
         return x.get('prevout_hash')[:10] + '...' + ":%d"%x.get('prevout_n')
 
     @rate_limited(1.0, ts_after=True) # performance tweak -- limit updates to no more than oncer per second
@@ -59,59 +203,31 @@ class UTXOList(MyTreeWidget):
             return
         super().update()
 
+    @profiler
     def on_update(self):
-        prev_selection = self.get_selected() # cache previous selection, if any
-        self.clear()
         self.wallet = self.parent.wallet
         if not self.wallet: return
-        self.utxos = self.wallet.get_utxos(exclude_slp=False)
-        for x in self.utxos:
-            address = x['address']
-            address_text = address.to_ui_string()
-            height = x['height']
-            name = self.get_name(x)
-            name_short = self.get_name_short(x)
-            label = self.wallet.get_label(x['prevout_hash'])
-            amount = self.parent.format_amount(x['value'], is_diff=False, whitespaces=True)
-            utxo_item = SortableTreeWidgetItem([address_text, label, amount,
-                                                str(height), name_short])
-            if label:
-                utxo_item.setToolTip(1, label)  # just in case it doesn't fit horizontally, we also provide it as a tool tip where hopefully it won't be elided
-            utxo_item.setToolTip(4, name)  # just in case they like to see lots of hex digits :)
-            utxo_item.DataRole = Qt.UserRole+100 # set this here to avoid sorting based on Qt.UserRole+1
-            utxo_item.setFont(0, self.monospaceFont)
-            utxo_item.setFont(2, self.monospaceFont)
-            utxo_item.setFont(4, self.monospaceFont)
-            utxo_item.setData(0, Qt.UserRole, name)
-            a_frozen = self.wallet.is_frozen(address)
-            c_frozen = x['is_frozen_coin']
-            toolTipFrozen = ''
-            if a_frozen and not c_frozen:
-                # address is frozen, coin is not frozen
-                # emulate the "Look" off the address_list .py's frozen entry
-                utxo_item.setBackground(0, self.lightBlue)
-                toolTipFrozen = _("Address is frozen")
-            elif c_frozen and not a_frozen:
-                # coin is frozen, address is not frozen
-                utxo_item.setBackground(0, self.blue)
-                toolTipFrozen = _("Coin is frozen")
-            elif c_frozen and a_frozen:
-                # both coin and address are frozen so color-code it to indicate that.
-                utxo_item.setBackground(0, self.lightBlue)
-                utxo_item.setForeground(0, self.cyanBlue)
-                toolTipFrozen = _("Coin & Address are frozen")
-            # save the address-level-frozen and coin-level-frozen flags to the data item for retrieval later in create_menu() below.
-            utxo_item.setData(0, Qt.UserRole+1, "{}{}".format(("a" if a_frozen else ""), ("c" if c_frozen else "")))
-            if toolTipFrozen:
-                utxo_item.setToolTip(0, toolTipFrozen)
-            self.addChild(utxo_item)
-            if name in prev_selection:
-                # NB: This needs to be here after the item is added to the widget. See #979.
-                utxo_item.setSelected(True) # restore previous selection
+        # The model diffs against what it already has, so the selection
+        # and scroll position survive the update.
+        self.source_model.set_coins(self.wallet.get_utxos(exclude_slp=False))
+
+    def apply_wallet_changes(self, changes):
+        ''' Applies a WalletChanges batch to the coins of the addresses it
+        concerns. Returns False if the list needs a full update instead. '''
+        if not self.wallet:
+            return False
+        model = self.source_model
+        addresses = set(changes.address_history_changed)
+        addresses.update(model.coins[name]['address'] for name in changes.utxo_spent if name in model.coins)
+        with self.wallet.lock:
+            for tx_hash in {name.split(':')[0] for name in changes.utxo_added}.union(changes.tx_verified):
+                addresses.update(self.wallet.txo.get(tx_hash, ()))
+        return not addresses or model.apply_changes(addresses)
 
     def get_selected(self):
-        return { x.data(0, Qt.UserRole) : x.data(0, Qt.UserRole+1) # dict of "name" -> frozen flags string (eg: "ac")
-                for x in self.selectedItems() }
+        model = self.source_model
+        return { name : model.get_cell(name)[4] # dict of "name" -> frozen flags string (eg: "ac")
+                for name in self.selected_keys() }
 
     def are_any_slp_coins(self, coins):
         for coin in coins:
@@ -129,7 +245,8 @@ class UTXOList(MyTreeWidget):
         if not selected:
             return
         menu = QMenu()
-        coins = filter(lambda x: self.get_name(x) in selected, self.utxos)
+        all_coins = self.source_model.coins
+        coins = [all_coins[name] for name in selected if name in all_coins]
         if not coins:
             return
         spendable_coins = list(filter(lambda x: not selected.get(self.get_name(x), ''), coins))
@@ -137,18 +254,18 @@ class UTXOList(MyTreeWidget):
         menu.addAction(_("Spend"), lambda: self.parent.spend_coins(spendable_coins)).setEnabled(bool(spendable_coins) and not self.are_any_slp_coins(spendable_coins))
         if len(selected) == 1:
             # "Copy ..."
-            item = self.itemAt(position)
-            if not item:
+            index = self.indexAt(position)
+            if not index.isValid():
                 return
 
-            col = self.currentColumn()
-            column_title = self.headerItem().text(col)
+            col = index.column()
+            column_title = self.source_model.headerData(col, Qt.Horizontal)
             alt_column_title, alt_copy_text = None, None
             if col == self.col_output_point:
-                copy_text = item.data(0, Qt.UserRole)
+                copy_text = index.data(Qt.UserRole)
             elif col == self.col_address:
                 # Determine the "alt copy text" "Legacy Address" or "Cash Address"
-                copy_text = item.text(col).strip()
+                copy_text = index.data().strip()
                 try:
                     addr = Address.from_string(copy_text)
                 except:
@@ -161,7 +278,7 @@ class UTXOList(MyTreeWidget):
                         alt_copy_text, alt_column_title = addr.to_full_string(Address.FMT_LEGACY), _('Legacy Address')
                 del addr
             else:
-                copy_text = item.text(col)
+                copy_text = index.data()
             if copy_text:
                 copy_text = copy_text.strip()  # make sure formatted amount is not whitespaced
             menu.addAction(_("Copy {}").format(column_title), lambda: QApplication.instance().clipboard().setText(copy_text))
@@ -209,34 +326,18 @@ class UTXOList(MyTreeWidget):
 
         menu.exec_(self.viewport().mapToGlobal(position))
 
-    def on_permit_edit(self, item, column):
-        # disable editing fields in this tab (labels)
-        return False
-
     def set_frozen_coins(self, coins, b):
         if self.parent:
             self.parent.set_frozen_coin_state(coins, b)
 
     def set_frozen_addresses_for_coins(self, coins, b):
         if not self.parent: return
-        addrs = set()
-        for utxo in self.utxos:
-            name = self.get_name(utxo)
-            if name in coins:
-                addrs.add(utxo['address'])
+        all_coins = self.source_model.coins
+        addrs = {all_coins[name]['address'] for name in coins if name in all_coins}
         if addrs:
             self.parent.set_frozen_state(list(addrs), b)
 
     def update_labels(self):
         if self.should_defer_update_incr():
             return
-        root = self.invisibleRootItem()
-        child_count = root.childCount()
-        for i in range(child_count):
-            item = root.child(i)
-            try:
-                txid = item.data(0, Qt.UserRole).split(':', 1)[0]
-            except IndexError:
-                continue # name is iinvalid. should be txid:prevout_n
-            label = self.wallet.get_label(txid)
-            item.setText(1, label)
+        self.source_model.labels_changed()
@@ -29,6 +29,7 @@ import base64
 import hmac
 import os
 import json
+from ctypes import byref, c_size_t, create_string_buffer
 
 import ecdsa
 import pyaes
@@ -39,6 +40,8 @@ from . import networks
 from .util import (bfh, bh2u, to_string, print_error, InvalidPassword,
                    assert_bytes, to_bytes, inv_dict, profiler)
 from . import version
+from . import ecc_fast
+from . import secp256k1
 from .ecc_fast import do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1
 
 # Ensure Python interpreter is not running with -O, since this entire
@@ -197,6 +200,18 @@ def var_int(i):
         return "ff"+int_to_hex(i,8)
 
 
+def var_int_bytes(i):
+    ''' Like var_int() above but returns bytes rather than hex. '''
+    if i<0xfd:
+        return bytes((i,))
+    elif i<=0xffff:
+        return b'\xfd' + i.to_bytes(2, 'little')
+    elif i<=0xffffffff:
+        return b'\xfe' + i.to_bytes(4, 'little')
+    else:
+        return b'\xff' + i.to_bytes(8, 'little')
+
+
 def op_push(i):
     if i<0x4c:
         return int_to_hex(i)
@@ -643,6 +658,69 @@ class MyVerifyingKey(ecdsa.VerifyingKey):
         return klass.from_public_point( Q, curve )
 
 
+def ecdsa_verify_batch(items, *, max_workers=1):
+    '''Verify many DER encoded ECDSA signatures, returning a list of bools
+    (one for each item, in order).
+
+    `items` is a sequence of (pubkey, sig, msghash) tuples of bytes: the
+    serialized public key, the DER signature (without any sighash byte) and
+    the 32 byte digest that was signed. A bad or garbage item is reported as
+    False rather than raising, so the caller can tell which ones failed.
+
+    Each distinct pubkey is parsed only once. When libsecp256k1 is in use the
+    checks go straight to it, skipping python-ecdsa's per-call overhead, and
+    `max_workers` > 1 spreads them over that many threads (libsecp256k1
+    releases the GIL).'''
+    items = list(items)
+    lib = secp256k1.secp256k1 if ecc_fast.is_using_fast_ecc() else None
+    order = SECP256k1.order
+
+    def parse(pubkey):
+        if not isinstance(pubkey, bytes) or not pubkey or pubkey[0] not in (2, 3, 4):
+            return None
+        if lib:
+            parsed = create_string_buffer(64)
+            if lib.secp256k1_ec_pubkey_parse(lib.ctx, parsed, pubkey, len(pubkey)):
+                return parsed
+            return None
+        try:
+            return MyVerifyingKey.from_public_point(ser_to_point(pubkey), curve=SECP256k1)
+        except Exception:
+            return None
+
+    parsed = {}
+    for pubkey, _, _ in items:
+        if pubkey not in parsed:
+            parsed[pubkey] = parse(pubkey)
+
+    def check(item):
+        pubkey, sig, msghash = item
+        key = parsed[pubkey]
+        if (key is None or not isinstance(sig, bytes) or not isinstance(msghash, bytes)
+                or len(msghash) != 32):
+            return False
+        try:
+            if not lib:
+                return key.verify_digest(sig, msghash, sigdecode=ecdsa.util.sigdecode_der)
+            r, s = ecdsa.util.sigdecode_der(sig, order)
+            compact = create_string_buffer(64)
+            if not lib.secp256k1_ecdsa_signature_parse_compact(
+                    lib.ctx, compact, r.to_bytes(32, 'big') + s.to_bytes(32, 'big')):
+                return False
+            lib.secp256k1_ecdsa_signature_normalize(lib.ctx, compact, compact)
+            return 1 == lib.secp256k1_ecdsa_verify(lib.ctx, compact, msghash, key)
+        except Exception:
+            # bad DER, r or s out of range, BadSignatureError, etc.
+            return False
+
+    if max_workers > 1 and lib and len(items) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        chunksize = -(-len(items) // max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ECDSAVerify') as executor:
+            return list(executor.map(check, items, chunksize=chunksize))
+    return [check(item) for item in items]
+
+
 def pubkey_from_signature(sig, h):
     if len(sig) != 65:
         raise Exception("Wrong encoding")
@@ -821,6 +899,55 @@ def _CKD_pub(cK, c, s):
     cK_n = GetPubKey(public_key.pubkey,True)
     return cK_n, c_n
 
+def CKD_pub_batch(cK, c, indices, *, max_workers=1):
+    '''Derive the non-hardened children `indices` of the public node (cK, c).
+    Returns a list of (cK_n, c_n) tuples in the same order as `indices`.
+
+    Same result as [CKD_pub(cK, c, n) for n in indices], but the parent point
+    is decoded only once for the whole range. With libsecp256k1 the point
+    addition is a single secp256k1_ec_pubkey_tweak_add and `max_workers` > 1
+    spreads the children over that many threads (libsecp256k1 releases the
+    GIL). The pure python fallback is GIL bound and always runs serially.'''
+    indices = list(indices)
+    for n in indices:
+        if n & BIP32_PRIME or n < 0:
+            raise ValueError('cannot derive hardened index {} from a public key'.format(n))
+    lib = secp256k1.secp256k1 if ecc_fast.is_using_fast_ecc() else None
+
+    if lib:
+        parent = create_string_buffer(64)
+        if not lib.secp256k1_ec_pubkey_parse(lib.ctx, parent, cK, len(cK)):
+            raise ValueError('invalid parent public key')
+        parent = parent.raw
+
+        def derive(n):
+            I = hmac.new(c, cK + n.to_bytes(4, 'big'), hashlib.sha512).digest()
+            child = create_string_buffer(parent, 64)
+            if not lib.secp256k1_ec_pubkey_tweak_add(lib.ctx, child, I[0:32]):
+                # I_L >= order; astronomically unlikely, let the slow path deal with it
+                return _CKD_pub(cK, c, n.to_bytes(4, 'big'))
+            out = create_string_buffer(33)
+            size = c_size_t(33)
+            lib.secp256k1_ec_pubkey_serialize(lib.ctx, out, byref(size), child,
+                                              secp256k1.SECP256K1_EC_COMPRESSED)
+            return out.raw, I[32:]
+
+        if max_workers > 1 and len(indices) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            chunksize = -(-len(indices) // max_workers)
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='CKDPub') as executor:
+                return list(executor.map(derive, indices, chunksize=chunksize))
+        return [derive(n) for n in indices]
+
+    parent_point = ser_to_point(cK)
+    generator = SECP256k1.generator
+    result = []
+    for n in indices:
+        I = hmac.new(c, cK + n.to_bytes(4, 'big'), hashlib.sha512).digest()
+        point = string_to_number(I[0:32]) * generator + parent_point
+        result.append((point_to_ser(point, True), I[32:]))
+    return result
+
 
 def xprv_header(xtype, *, net=None):
     if net is None: net = networks.net
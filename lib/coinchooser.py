@@ -70,6 +70,12 @@ class PRNG:
 
 Bucket = namedtuple('Bucket', ['desc', 'size', 'value', 'coins'])
 
+# What the chosen buckets have to pay for, on top of the mandatory coins:
+# spent_amount is the output value not already covered by the mandatory coins
+# and base_size the size of the tx with just the mandatory inputs and no
+# change. Set by make_tx for choosers that want more than sufficient_funds().
+SpendTarget = namedtuple('SpendTarget', ['spent_amount', 'base_size', 'fee_estimator', 'dust_threshold'])
+
 def strip_unneeded(bkts, sufficient_funds):
     '''Remove buckets that are unnecessary in achieving the spend amount'''
     bkts = sorted(bkts, key = lambda bkt: bkt.value)
@@ -173,14 +179,15 @@ class CoinChooserBase(PrintError):
         added to the transaction fee.'''
 
         # Remove mandatory_coin items from coin chooser's list
-        for c in mandatory_coins:
-            for coin in coins.copy():
-                if coin['prevout_hash'] == c['prevout_hash'] and coin['prevout_n'] == c['prevout_n']:
-                    coins.remove(coin)
+        if mandatory_coins:
+            mandatory_outpoints = {(c['prevout_hash'], c['prevout_n']) for c in mandatory_coins}
+            coins[:] = [coin for coin in coins
+                        if (coin['prevout_hash'], coin['prevout_n']) not in mandatory_outpoints]
 
         # Deterministic randomness from coins
         utxos = [c['prevout_hash'] + str(c['prevout_n']) for c in coins]
-        self.p = PRNG(''.join(sorted(utxos)))
+        self.seed = ''.join(sorted(utxos))
+        self.p = PRNG(self.seed)
 
         # Copy the ouputs so when adding change we don't modify "outputs"
         tx = Transaction.from_io([], outputs, sign_schnorr=sign_schnorr)
@@ -188,12 +195,17 @@ class CoinChooserBase(PrintError):
         base_size = tx.estimated_size()
         spent_amount = tx.output_value()
 
+        # The mandatory coins are always spent; sum them up once rather than
+        # on every sufficient_funds() call
+        mandatory_coins_bucket = self.bucketize_coins(mandatory_coins, sign_schnorr=sign_schnorr)
+        mandatory_input = sum(bucket.value for bucket in mandatory_coins_bucket)
+        mandatory_input_size = sum(bucket.size for bucket in mandatory_coins_bucket)
+        self.target = SpendTarget(spent_amount - mandatory_input, base_size + mandatory_input_size,
+                                  fee_estimator, dust_threshold)
+
         def sufficient_funds(buckets):
             '''Given a list of buckets, return True if it has enough
             value to pay for the transaction'''
-            mandatory_coins_bucket = self.bucketize_coins(mandatory_coins, sign_schnorr=sign_schnorr)
-            mandatory_input = sum(coin.value for coin in mandatory_coins_bucket)
-            mandatory_input_size = sum(coin.size for coin in mandatory_coins_bucket)
             total_input = sum(bucket.value for bucket in buckets) + mandatory_input
             total_size = sum(bucket.size for bucket in buckets) + mandatory_input_size + base_size
             return total_input >= spent_amount + fee_estimator(total_size)
@@ -202,11 +214,21 @@ class CoinChooserBase(PrintError):
         buckets = self.bucketize_coins(coins, sign_schnorr=sign_schnorr)
         buckets = self.choose_buckets(buckets, sufficient_funds, self.penalty_func(tx))
 
+        # Remember the pick so reuse_selection() can rebuild the tx for a
+        # different fee without choosing again
+        self.selected = [coin for b in buckets for coin in b.coins]
         tx.add_inputs(mandatory_coins)
-        tx.add_inputs([coin for b in buckets for coin in b.coins])
-        slp_size = sum(bucket.size for bucket in self.bucketize_coins(mandatory_coins))
-        tx_size = base_size + sum(bucket.size for bucket in buckets) + slp_size
+        tx.add_inputs(self.selected)
+        tx_size = base_size + sum(bucket.size for bucket in buckets) + mandatory_input_size
+
+        self.add_change(tx, tx_size, change_addrs, fee_estimator, dust_threshold)
+
+        self.print_error("using %d inputs" % len(tx.inputs()))
+        self.print_error("using buckets:", [bucket.desc for bucket in buckets])
 
+        return tx
+
+    def add_change(self, tx, tx_size, change_addrs, fee_estimator, dust_threshold):
         # This takes a count of change outputs and returns a tx fee;
         # each pay-to-bitcoin-address output serializes as 34 bytes
         fee = lambda count: fee_estimator(tx_size + count * 34)
@@ -214,9 +236,23 @@ class CoinChooserBase(PrintError):
         tx.add_outputs(change)
         tx.ephemeral['dust_to_fee'] = dust
 
-        self.print_error("using %d inputs" % len(tx.inputs()))
-        self.print_error("using buckets:", [bucket.desc for bucket in buckets])
-
+    def reuse_selection(self, selected, seed, outputs, change_addrs, fee_estimator,
+                        dust_threshold, sign_schnorr=False, *, mandatory_coins=[]):
+        '''Rebuilds the transaction from coins an earlier make_tx() call
+        selected (its .selected and .seed), for instance after just the fee
+        rate changed. Returns None if those coins no longer pay for the
+        outputs plus the fee, in which case make_tx() has to choose again.'''
+        self.seed = seed
+        self.p = PRNG(seed)
+        self.selected = list(selected)
+        tx = Transaction.from_io([], outputs, sign_schnorr=sign_schnorr)
+        tx.add_inputs(mandatory_coins)
+        tx.add_inputs(self.selected)
+        tx_size = tx.estimated_size()
+        if tx.input_value() < tx.output_value() + fee_estimator(tx_size):
+            return None
+        self.add_change(tx, tx_size, change_addrs, fee_estimator, dust_threshold)
+        self.print_error("reusing %d inputs" % len(tx.inputs()))
         return tx
 
     def choose_buckets(self, buckets, sufficient_funds, penalty_func):
@@ -298,8 +334,121 @@ class CoinChooserPrivacy(CoinChooserRandom):
         return penalty
 
 
+class CoinChooserBnB(CoinChooserBase):
+    '''Built for wallets with many coins. First it looks for a set of
+    coins that pays for the transaction with no change output at all,
+    using a bounded branch-and-bound search over the coins sorted by
+    value. If there is no such set it spends the smallest single coin
+    that covers the amount or, failing that, the largest coins needed,
+    dropping any that turn out to be unnecessary. As with the privacy
+    chooser, coins on the same address are always spent together.'''
+
+    # Upper bound on the search steps, so the search stays quick enough to
+    # re-run as the user edits the amount or fee.
+    max_tries = 20000
+
+    def keys(self, coins):
+        return [coin['address'] for coin in coins]
+
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+        t = self.target
+        # Marginal fee per byte; 0 for a fixed fee
+        fee_rate = (t.fee_estimator(t.base_size + 1000) - t.fee_estimator(t.base_size)) / 1000
+        # Value the buckets need to contribute, net of the fee they add
+        need = t.spent_amount + t.fee_estimator(t.base_size)
+        if need <= 0:
+            return []
+        effective = [bucket.value - bucket.size * fee_rate for bucket in buckets]
+        if sum(e for e in effective if e > 0) < need:
+            raise NotEnoughFunds()
+
+        # Anything below the cost of a change output plus dust would be
+        # thrown away as dust by change_outputs() anyway
+        upper = need + 34 * fee_rate + t.dust_threshold
+        winner = self.branch_and_bound(buckets, effective, need, upper)
+        if winner is not None and sufficient_funds(winner):
+            self.print_error("Bucket sets:", len(buckets), "change-free match with", len(winner))
+            return winner
+
+        winner = self.fallback(buckets, effective, need, sufficient_funds)
+        self.print_error("Bucket sets:", len(buckets), "fallback with", len(winner))
+        return winner
+
+    def branch_and_bound(self, buckets, effective, need, upper):
+        '''Depth-first search for the subset of buckets whose effective value
+        lands in [need, upper] with the least excess. Buckets are tried
+        largest first, and a branch is cut as soon as it overshoots `upper`
+        or can no longer reach `need`. Gives up after max_tries steps.
+        Returns a list of buckets, or None.'''
+        order = sorted((i for i, e in enumerate(effective) if e > 0),
+                       key=lambda i: effective[i], reverse=True)
+        values = [effective[i] for i in order]
+        n = len(values)
+        # remaining[d] is the most the buckets from depth d on can add
+        remaining = [0] * (n + 1)
+        for d in range(n - 1, -1, -1):
+            remaining[d] = remaining[d + 1] + values[d]
+
+        included = []  # the include/skip decision taken at each depth
+        value = 0
+        best, best_excess = None, None
+        for _ in range(self.max_tries):
+            d = len(included)
+            if need <= value <= upper:
+                excess = value - need
+                if best is None or excess < best_excess:
+                    best = [order[i] for i, inc in enumerate(included) if inc]
+                    best_excess = excess
+                    if not excess:
+                        break
+            elif value < need <= value + remaining[d]:
+                included.append(True)
+                value += values[d]
+                continue
+            # Unwind the trailing skips, then turn the last include into a skip
+            while included and not included[-1]:
+                included.pop()
+            if not included:
+                break  # search space exhausted
+            included[-1] = False
+            value -= values[len(included) - 1]
+        if best is None:
+            return None
+        return [buckets[i] for i in best]
+
+    def fallback(self, buckets, effective, need, sufficient_funds):
+        '''Used when there is no change-free match: spend the smallest single
+        bucket that is enough on its own, else add buckets largest first
+        until there's enough and strip the ones not needed.'''
+        t = self.target
+        order = sorted(range(len(buckets)), key=lambda i: effective[i])
+        for i in order:
+            if effective[i] >= need and sufficient_funds([buckets[i]]):
+                return [buckets[i]]
+
+        chosen = []
+        total_value = total_size = 0
+        for i in reversed(order):
+            bucket = buckets[i]
+            chosen.append(bucket)
+            total_value += bucket.value
+            total_size += bucket.size
+            if total_value >= t.spent_amount + t.fee_estimator(t.base_size + total_size):
+                return strip_unneeded(chosen, sufficient_funds)
+        raise NotEnoughFunds()
+
+
+COIN_CHOOSERS = {
+    'Privacy': CoinChooserPrivacy,
+    'BranchAndBound': CoinChooserBnB,
+}
+
 def get_name(config):
     kind = config.get('coin_chooser')
     if not kind in COIN_CHOOSERS:
-        kind = 'Priority'
+        kind = 'Privacy'
     return kind
+
+def get_coin_chooser(config):
+    klass = COIN_CHOOSERS[get_name(config)]
+    return klass()
@@ -27,6 +27,7 @@ import argparse
 import ast
 import base64
 import datetime
+import itertools
 import json
 import queue
 import sys
@@ -40,6 +41,7 @@ from . import slp
 from . import util
 from .address import Address, AddressError
 from .bitcoin import hash_160, COIN, TYPE_ADDRESS
+from .caches import ExpiringCache
 from .i18n import _
 from .paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 from .plugins import run_hook
@@ -110,6 +112,11 @@ def command(s):
 
 class Commands(PrintError):
 
+    # The rest of the listings being read page by page, keyed by what their
+    # next page will be asked for with. Shared by all instances, since the
+    # daemon makes a new one for each call.
+    _open_pages = ExpiringCache(maxlen=32, timeout=600, name="Paginated listings")
+
     def __init__(self, config, wallet, network, callback = None):
         self.config = config
         self.wallet = wallet
@@ -252,16 +259,47 @@ class Commands(PrintError):
         sh = Address.from_string(address).to_scripthash_hex()
         return self.network.synchronous_get(('blockchain.scripthash.get_history', [sh]))
 
+    def _paginate(self, make_items, limit, after, cursor_of, key):
+        ''' With a `limit`, returns one page of the items after the cursor
+        `after` as {'items': [...], 'next': cursor}, where `next` is the
+        `after` value for the following page, or None if this was the last
+        one. Without a limit, returns all the items as a list.
+
+        make_items(after) returns an iterable of the items after `after` (or
+        of all of them, for None). When the previous page was read in this
+        process, the same iterable simply carries on, so reading a listing
+        page by page (eg --stream) goes over it once rather than once per
+        page. `key` identifies the listing: the command and its filters. '''
+        limit = int(limit or 0)
+        if limit <= 0:
+            return list(make_items(after))
+        key = (self.wallet and self.wallet.storage.path,) + key
+        items = self._open_pages.pop(key + (after,)) if after is not None else None
+        if items is None:
+            items = iter(make_items(after))
+        page = list(itertools.islice(items, limit + 1))
+        if len(page) <= limit:
+            return {'items': page, 'next': None}
+        extra = page.pop()
+        next_cursor = cursor_of(page[-1])
+        self._open_pages.put(key + (next_cursor,), itertools.chain((extra,), items))
+        return {'items': page, 'next': next_cursor}
+
     @command('w')
-    def listunspent(self):
+    def listunspent(self, limit=0, after=None):
         """List unspent outputs. Returns the list of unspent transaction
         outputs in your wallet."""
-        l = self.wallet.get_utxos(exclude_frozen=False)
-        for i in l:
+        def fmt(i):
+            i = dict(i)
             v = i["value"]
             i["value"] = str(PyDecimal(v)/COIN) if v is not None else None
             i["address"] = i["address"].to_ui_string()
-        return l
+            return i
+        def make_items(after):
+            return map(fmt, self.wallet.iter_utxos(exclude_frozen=False, after=after))
+        return self._paginate(make_items, limit, after,
+                              lambda i: "{}:{}".format(i['prevout_hash'], i['prevout_n']),
+                              ('listunspent',))
 
     @command('n')
     def getaddressunspent(self, address):
@@ -418,6 +456,14 @@ class Commands(PrintError):
         from .version import PACKAGE_VERSION
         return PACKAGE_VERSION
 
+    @command('')
+    def cachestats(self):
+        """Return the size and hit/miss/eviction counts of the in-memory
+        caches, including the shared transaction store."""
+        from .caches import cache_stats
+        from .tx_store import get_tx_store
+        return cache_stats() + [get_tx_store().stats()]
+
     @command('w')
     def getmpk(self):
         """Get master public key. Return your wallet\'s master public key"""
@@ -639,7 +685,7 @@ class Commands(PrintError):
         return True
 
     @command('w')
-    def history(self, year=0, show_addresses=False, show_fiat=False, use_net=False, timeout=30.0):
+    def history(self, year=0, show_addresses=False, show_fiat=False, use_net=False, timeout=30.0, limit=0, after=None):
         """Wallet history. Returns the transaction history of your wallet."""
         t0 = time.time()
         year, show_addresses, show_fiat, use_net, timeout = (
@@ -672,7 +718,8 @@ class Commands(PrintError):
             fx = FxThread(self.config, fakenet)
             kwargs['fx'] = fx
             fx.run()  # invoke the fx to grab history rates at least once, otherwise results will always contain "No data" (see #1671)
-            if fakenet and q and fx.is_enabled() and fx.get_history_config():
+            # when paging, the rates were already downloaded for the first page
+            if fakenet and q and fx.is_enabled() and fx.get_history_config() and not after:
                 # queue.get docs aren't clean on whether 0 means block or don't
                 # block, so we ensure at least 1ms timeout.
                 # we also limit waiting for fx to 10 seconds in case it had
@@ -680,7 +727,10 @@ class Commands(PrintError):
                 try: q.get(timeout=min(max(time_remaining()/2.0, 0.001), 10.0))
                 except queue.Empty: pass
                 kwargs['fee_calc_timeout'] = time_remaining()  # since we blocked above, recompute time_remaining for kwargs
-        return self.wallet.export_history(**kwargs)
+        def make_items(after):
+            return self.wallet.iter_export_history(after=after, **kwargs)
+        return self._paginate(make_items, limit, after, lambda item: item['txid'],
+                              ('history', year, show_addresses, show_fiat, use_net))
 
     @command('w')
     def setlabel(self, key, label):
@@ -708,10 +758,23 @@ class Commands(PrintError):
         return results
 
     @command('w')
-    def listaddresses(self, receiving=False, change=False, labels=False, frozen=False, unused=False, funded=False, balance=False):
+    def listaddresses(self, receiving=False, change=False, labels=False, frozen=False, unused=False, funded=False, balance=False, limit=0, after=None):
         """List wallet addresses. Returns the list of all addresses in your wallet. Use optional arguments to filter the results."""
-        out = []
-        for addr in self.wallet.get_addresses():
+        def make_items(after):
+            addresses = self.wallet.get_addresses()
+            if after is not None:
+                i = self.wallet.get_address_position(Address.from_string(after))
+                if i is None:
+                    raise ValueError(f"unknown address: {after}")
+                addresses = itertools.islice(addresses, i + 1, None)
+            return self._iter_addresses(addresses, receiving, change, labels, frozen, unused, funded, balance)
+        def cursor_of(item):
+            return item[0] if isinstance(item, tuple) else item
+        return self._paginate(make_items, limit, after, cursor_of,
+                              ('listaddresses', receiving, change, labels, frozen, unused, funded, balance))
+
+    def _iter_addresses(self, addresses, receiving, change, labels, frozen, unused, funded, balance):
+        for addr in addresses:
             if frozen and not self.wallet.is_frozen(addr):
                 continue
             if receiving and self.wallet.is_change(addr):
@@ -729,8 +792,7 @@ class Commands(PrintError):
                 item += (format_satoshis(sum(self.wallet.get_addr_balance(addr))),)
             if labels:
                 item += (repr(self.wallet.labels.get(addr.to_storage_string(), '')),)
-            out.append(item)
-        return out
+            yield item
 
     @command('n')
     def gettransaction(self, txid):
@@ -973,6 +1035,7 @@ param_descriptions = {
 }
 
 command_options = {
+    'after':       (None, "Only return the items after this one (the 'next' value of the previous page)"),
     'balance':     ("-b", "Show the balances of listed addresses"),
     'change':      (None, "Show only change addresses"),
     'change_addr': ("-c", "Change address. Default is a spare address, or the source address if it's not in the wallet"),
@@ -989,6 +1052,7 @@ command_options = {
     'index_url':   (None, 'Override the URL where you would like users to be shown the BIP70 Payment Request'),
     'labels':      ("-l", "Show the labels of listed addresses"),
     'language':    ("-L", "Default language for wordlist"),
+    'limit':       (None, "Return at most this many items, as a page: {\"items\": [...], \"next\": <cursor>}"),
     'locktime':    (None, "Set locktime block number"),
     'memo':        ("-m", "Description of the request"),
     'nbits':       (None, "Number of bits of entropy"),
@@ -1019,6 +1083,7 @@ arg_types = {
     'num': int,
     'nbits': int,
     'imax': int,
+    'limit': int,
     'year': int,
     'entropy': int,
     'tx': tx_from_str,
@@ -1100,6 +1165,7 @@ def add_network_options(parser):
     parser.add_argument("-1", "--oneserver", action="store_true", dest="oneserver", default=False, help="connect to one server only")
     parser.add_argument("-s", "--server", dest="server", default=None, help="set server host:port:protocol, where protocol is either t (tcp) or s (ssl)")
     parser.add_argument("-p", "--proxy", dest="proxy", default=None, help="set proxy [type:]host[:port], where type is socks4,socks5 or http")
+    parser.add_argument("--network_engine", dest="network_engine", default=None, choices=['select', 'asyncio'], help="select the engine that drives server connections (default: select)")
     parser.add_argument("-x", "--disable_preferred_servers_only", action='store_false', dest="whitelist_servers_only", default=None, help="Disables 'preferred servers only' for this session. This must be used in conjunction with --server or --oneserver for them to work if they are outside the whitelist in servers.json (or the user-specified whitelist).")
 
 def add_global_options(parser):
@@ -1110,6 +1176,7 @@ def add_global_options(parser):
     group.add_argument("-w", "--wallet", dest="wallet_path", help="wallet path")
     group.add_argument("-wp", "--walletpassword", dest="wallet_password", default=None, help="Supply wallet password")
     group.add_argument("--testnet", action="store_true", dest="testnet", default=False, help="Use Testnet")
+    group.add_argument("--profile-startup", action="store_true", dest="profile_startup", default=False, help="Write the time spent in each import and startup phase to startup_profile.txt in the electron cash directory")
 
 def get_parser():
     # create main parser
@@ -1160,6 +1227,10 @@ def get_parser():
             else:
                 p.add_argument(*args, dest=optname, action=action, default=default, help=help)
 
+        if 'limit' in cmd.options:
+            p.add_argument("--stream", action="store_true", dest="stream", default=False,
+                           help="Print the results one JSON object per line, fetching them a page at a time")
+
         for param in cmd.params:
             h = param_descriptions.get(param, '')
             _type = arg_types.get(param, str)
@@ -21,19 +21,21 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import re
-import dns
-from dns.exception import DNSException
 import json
 import traceback
 import sys
 
 from .address import Address
-from . import dnssec
+from .caches import ExpiringCache
 from .util import print_error
 
 
 class Contacts(dict):
 
+    # url -> (address, name, validated) of aliases that resolved. Failed
+    # lookups aren't remembered, since they're often just network trouble.
+    _openalias_cache = ExpiringCache(maxlen=100, name="OpenAlias cache", timeout=600)
+
     def __init__(self, storage):
         self.storage = storage
         d = self.storage.get('contacts', {})
@@ -107,6 +109,18 @@ class Contacts(dict):
     def resolve_openalias(self, url):
         # support email-style addresses, per the OA standard
         url = url.replace('@', '.')
+        ret = self._openalias_cache.get(url)
+        if ret is None:
+            ret = self._resolve_openalias(url)
+            if ret is not None:
+                self._openalias_cache.put(url, ret)
+        return ret
+
+    def _resolve_openalias(self, url):
+        # dnspython is slow to import and only needed for OpenAlias lookups
+        import dns
+        from dns.exception import DNSException
+        from . import dnssec
         try:
             records, validated = dnssec.query(url, dns.rdatatype.TXT)
         except DNSException as e:
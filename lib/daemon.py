@@ -26,6 +26,8 @@ import ast
 import os
 import time
 import sys
+import threading
+from functools import wraps
 
 # from jsonrpc import JSONRPCResponseManager
 import jsonrpclib
@@ -152,6 +154,10 @@ class Daemon(DaemonThread):
             self.network.add_jobs([self.fx])
         self.gui = None
         self.wallets = {}
+        # Guards self.wallets against concurrent load/close from RPC workers
+        self.wallets_lock = threading.RLock()
+        # path -> lock serializing the RPC commands run against that wallet
+        self.wallet_rpc_locks = {}
         # Setup JSONRPC server
         self.init_server(config, fd, is_gui)
 
@@ -162,7 +168,8 @@ class Daemon(DaemonThread):
         rpc_user, rpc_password = get_rpc_credentials(config)
         try:
             server = VerifyingJSONRPCServer((host, port), logRequests=False,
-                                            rpc_user=rpc_user, rpc_password=rpc_password)
+                                            rpc_user=rpc_user, rpc_password=rpc_password,
+                                            num_threads=config.get('rpcthreads', 8))
         except Exception as e:
             self.print_error('Warning: cannot initialize RPC server on host', host, e)
             self.server = None
@@ -173,16 +180,42 @@ class Daemon(DaemonThread):
         self.server = server
         server.timeout = 0.1
         server.register_function(self.ping, 'ping')
+        server.register_function(server.get_stats, 'rpcstats')
         server.register_function(self.run_gui, 'gui')
         server.register_function(self.run_daemon, 'daemon')
         self.cmd_runner = Commands(self.config, None, self.network)
         for cmdname in known_commands:
-            server.register_function(getattr(self.cmd_runner, cmdname), cmdname)
+            func = getattr(self.cmd_runner, cmdname)
+            if known_commands[cmdname].requires_wallet:
+                func = self.with_cmd_runner_wallet_lock(func)
+            server.register_function(func, cmdname)
         server.register_function(self.run_cmdline, 'run_cmdline')
 
     def ping(self):
         return True
 
+    def get_wallet_rpc_lock(self, wallet):
+        ''' RPC workers run concurrently, but commands against the same
+        wallet are run one at a time. This is a separate lock from
+        wallet.lock on purpose: commands may wait on the network, which
+        needs wallet.lock to make progress. '''
+        path = wallet.storage.path
+        with self.wallets_lock:
+            lock = self.wallet_rpc_locks.get(path)
+            if lock is None:
+                lock = self.wallet_rpc_locks[path] = threading.RLock()
+            return lock
+
+    def with_cmd_runner_wallet_lock(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            wallet = self.cmd_runner.wallet
+            if wallet is None:
+                return func(*args, **kwargs)
+            with self.get_wallet_rpc_lock(wallet):
+                return func(*args, **kwargs)
+        return wrapper
+
     def run_daemon(self, config_options):
         config = SimpleConfig(config_options)
         sub = config.get('subcommand')
@@ -219,7 +252,7 @@ class Daemon(DaemonThread):
                     'auto_connect': p[4],
                     'version': PACKAGE_VERSION,
                     'wallets': {k: w.is_up_to_date()
-                                for k, w in self.wallets.items()},
+                                for k, w in list(self.wallets.items())},
                     'fee_per_kb': self.config.fee_per_kb(),
                 }
             else:
@@ -249,6 +282,10 @@ class Daemon(DaemonThread):
         return response
 
     def load_wallet(self, path, password):
+        with self.wallets_lock:
+            return self._load_wallet(path, password)
+
+    def _load_wallet(self, path, password):
         path = standardize_path(path)
         # wizard will be launched if we return
         if path in self.wallets:
@@ -274,7 +311,8 @@ class Daemon(DaemonThread):
 
     def add_wallet(self, wallet):
         path = wallet.storage.path
-        self.wallets[path] = wallet
+        with self.wallets_lock:
+            self.wallets[path] = wallet
 
     def get_wallet(self, path):
         return self.wallets.get(path)
@@ -288,8 +326,10 @@ class Daemon(DaemonThread):
 
     def stop_wallet(self, path):
         # Issue #659 wallet may already be stopped.
-        if path in self.wallets:
-            wallet = self.wallets.pop(path)
+        with self.wallets_lock:
+            wallet = self.wallets.pop(path, None)
+            self.wallet_rpc_locks.pop(path, None)
+        if wallet is not None:
             wallet.stop_threads()
 
     def run_cmdline(self, config_options):
@@ -317,7 +357,11 @@ class Daemon(DaemonThread):
         cmd_runner = Commands(config, wallet, self.network)
         func = getattr(cmd_runner, cmd.name)
         try:
-            result = func(*args, **kwargs)
+            if wallet is not None:
+                with self.get_wallet_rpc_lock(wallet):
+                    result = func(*args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
         except TypeError as e:
             raise Exception("Wrapping TypeError to prevent JSONRPC-Pelix from hiding traceback") from e
         return result
@@ -325,7 +369,9 @@ class Daemon(DaemonThread):
     def run(self):
         while self.is_running():
             self.server.handle_request() if self.server else time.sleep(0.1)
-        for k, wallet in self.wallets.items():
+        if self.server:
+            self.server.server_close()
+        for k, wallet in list(self.wallets.items()):
             wallet.stop_threads()
         if self.network:
             self.print_error("shutting down network")
@@ -1,6 +1,7 @@
-from datetime import datetime
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime
 import inspect
-import requests
 import sys
 import os
 import json
@@ -30,6 +31,72 @@ CCY_PRECISIONS = {'BHD': 3, 'BIF': 0, 'BYR': 0, 'CLF': 4, 'CLP': 0,
                   'VUV': 0, 'XAF': 0, 'XAU': 4, 'XOF': 0, 'XPF': 0}
 
 
+class HistoricalRates:
+    ''' The daily rates of one currency, as two parallel arrays sorted by
+    day: the day numbers (date.toordinal()) and the rates. Built from, and
+    turned back into, the {'YYYY-MM-DD': rate} dicts that the exchanges
+    return and that the cache files hold.
+
+    The fetch thread updates these while the GUI and export threads read
+    them, so both arrays are held in the one `table` tuple, replaced in a
+    single assignment, and every reader takes its own reference to it. '''
+
+    __slots__ = ('table',)
+
+    def __init__(self, d=None):
+        self.table = (array('l'), array('d'))
+        if d:
+            self.update(d)
+
+    @staticmethod
+    def day_of(date_str):
+        y, m, d = date_str.split('-')
+        return date(int(y), int(m), int(d)).toordinal()
+
+    def update(self, d):
+        ''' Merges in the rates of the dict `d`, which win over the ones
+        already here for the same day. '''
+        merged = dict(zip(*self.table))
+        for k, v in d.items():
+            if v is not None:
+                merged[self.day_of(k)] = float(v)
+        days = sorted(merged)
+        self.table = (array('l', days), array('d', (merged[day] for day in days)))
+
+    def to_dict(self):
+        return {date.fromordinal(day).isoformat(): rate for day, rate in zip(*self.table)}
+
+    def last_day(self):
+        days = self.table[0]
+        return days[-1] if days else None
+
+    def get(self, day):
+        days, rates = self.table
+        i = bisect_left(days, day)
+        if i < len(days) and days[i] == day:
+            return rates[i]
+
+    def get_many(self, days):
+        ''' Returns the rates for the list `days` (None where there is no
+        rate), in the same order. The lookup is one merge-like pass over the
+        sorted unique days rather than a search per day. '''
+        found = {}
+        table_days, rates = self.table
+        n = len(table_days)
+        i = 0
+        for day in sorted(set(days)):
+            while i < n and table_days[i] < day:
+                i += 1
+            if i == n:
+                break
+            if table_days[i] == day:
+                found[day] = rates[i]
+        return [found.get(day) for day in days]
+
+    def __len__(self):
+        return len(self.table[0])
+
+
 class ExchangeBase(PrintError):
 
     def __init__(self, on_quotes, on_history):
@@ -41,6 +108,7 @@ class ExchangeBase(PrintError):
 
     def get_json(self, site, get_string):
         # APIs must have https
+        import requests
         url = ''.join(['https://', site, get_string])
         response = requests.request('GET', url, headers={'User-Agent' : 'Electron Cash'}, timeout=10)
         if response.status_code != 200:
@@ -48,6 +116,7 @@ class ExchangeBase(PrintError):
         return response.json()
 
     def get_csv(self, site, get_string):
+        import requests
         url = ''.join(['https://', site, get_string])
         response = requests.request('GET', url, headers={'User-Agent' : 'Electron-Cash'})
         if response.status_code != 200:
@@ -114,21 +183,30 @@ class ExchangeBase(PrintError):
 
     def get_historical_rates_safe(self, ccy, cache_dir):
         h, timestamp = self.read_historical_rates(ccy, cache_dir)
-        if not h or self._is_timestamp_old(timestamp):
+        table = HistoricalRates(h) if h else self.history.get(ccy)
+        if not table or self._is_timestamp_old(timestamp):
+            # Only ask for the days since the last one we have (that one
+            # included, its rate may have been a partial day's)
+            since = table.last_day() if table else None
             try:
-                self.print_error("requesting fx history for", ccy)
-                h = self.request_history(ccy)
+                self.print_error("requesting fx history for", ccy, "since day", since)
+                h = self.request_history(ccy, since=since)
                 self.print_error("received fx history for", ccy)
                 if not h:
                     # Paranoia: No data; abort early rather than write out an
                     # empty file
                     raise RuntimeWarning(f"received empty history for {ccy}")
-                self._cache_historical_rates(h, ccy, cache_dir)
+                if table:
+                    table.update(h)
+                else:
+                    table = HistoricalRates(h)
+                self._cache_historical_rates(table.to_dict(), ccy, cache_dir)
+                timestamp = time.time()
             except Exception as e:
                 self.print_error("failed fx history:", repr(e))
                 return
-        self.print_error("received history rates of length", len(h))
-        self.history[ccy] = h
+        self.print_error("received history rates of length", len(table))
+        self.history[ccy] = table
         self.history_timestamps[ccy] = timestamp
         self.on_history()
 
@@ -143,8 +221,19 @@ class ExchangeBase(PrintError):
     def history_ccys(self):
         return []
 
+    def request_history(self, ccy, since=None):
+        ''' Returns a {'YYYY-MM-DD': rate} dict of the daily rates of ccy,
+        from day number `since` on if that is given, or all of them. '''
+        raise NotImplementedError()
+
     def historical_rate(self, ccy, d_t):
-        return self.history.get(ccy, {}).get(d_t.strftime('%Y-%m-%d'))
+        table = self.history.get(ccy)
+        return table.get(d_t.toordinal()) if table else None
+
+    def historical_rates(self, ccy, days):
+        ''' Bulk version of historical_rate, for a list of day numbers. '''
+        table = self.history.get(ccy)
+        return table.get_many(days) if table else [None] * len(days)
 
     def get_currencies(self):
         rates = self.get_rates('')
@@ -259,12 +348,18 @@ class CoinCap(ExchangeBase):
     def history_ccys(self):
         return ['USD']
 
-    def request_history(self, ccy):
+    def request_history(self, ccy, since=None):
         from datetime import datetime as dt
-        # Currently 2000 days is the maximum in 1 API call which needs to be fixed
-        # sometime before the year 2023...
-        history = self.get_json('api.coincap.io',
-                               "/v2/assets/bitcoin-cash/history?interval=d1&limit=2000")
+        if since is not None:
+            start_ms = int(datetime.combine(date.fromordinal(since), datetime.min.time()).timestamp() * 1000)
+            history = self.get_json('api.coincap.io',
+                                    "/v2/assets/bitcoin-cash/history?interval=d1&start=%d&end=%d"
+                                    % (start_ms, int(time.time() * 1000)))
+        else:
+            # Currently 2000 days is the maximum in 1 API call which needs to be fixed
+            # sometime before the year 2023...
+            history = self.get_json('api.coincap.io',
+                                   "/v2/assets/bitcoin-cash/history?interval=d1&limit=2000")
         return dict([(dt.utcfromtimestamp(h['time']/1000).strftime('%Y-%m-%d'),
                         h['priceUsd'])
                      for h in history['data']])
@@ -285,8 +380,9 @@ class CoinGecko(ExchangeBase):
                 'PHP', 'PKR', 'PLN', 'RUB', 'SAR', 'SEK', 'SGD', 'THB',
                 'TRY', 'TWD', 'USD', 'VEF', 'XAG', 'XAU', 'XDR', 'ZAR']
 
-    def request_history(self, ccy):
-        history = self.get_json('api.coingecko.com', '/api/v3/coins/bitcoin-cash/market_chart?vs_currency=%s&days=max' % ccy)
+    def request_history(self, ccy, since=None):
+        days = 'max' if since is None else '%d&interval=daily' % max(1, date.today().toordinal() - since + 1)
+        history = self.get_json('api.coingecko.com', '/api/v3/coins/bitcoin-cash/market_chart?vs_currency=%s&days=%s' % (ccy, days))
 
         from datetime import datetime as dt
         return dict([(dt.utcfromtimestamp(h[0]/1000).strftime('%Y-%m-%d'), h[1])
@@ -495,13 +591,22 @@ class FxThread(ThreadJob):
         return _("No data")
 
     def history_rate(self, d_t):
-        rate = self.exchange.historical_rate(self.ccy, d_t)
-        # Frequently there is no rate for today, until tomorrow :)
-        # Use spot quotes in that case
-        if rate is None and (datetime.today().date() - d_t.date()).days <= 2:
-            rate = self.exchange.quotes.get(self.ccy)
-            self.history_used_spot = True
-        return PyDecimal(rate) if rate is not None else None
+        return self.history_rates([d_t.toordinal()])[0]
+
+    def history_rates(self, days):
+        ''' Returns the rates (PyDecimal or None) for a list of day numbers
+        (date.toordinal()), in one lookup. '''
+        rates = self.exchange.historical_rates(self.ccy, days)
+        today = date.today().toordinal()
+        ret = []
+        for day, rate in zip(days, rates):
+            # Frequently there is no rate for today, until tomorrow :)
+            # Use spot quotes in that case
+            if rate is None and today - day <= 2:
+                rate = self.exchange.quotes.get(self.ccy)
+                self.history_used_spot = True
+            ret.append(PyDecimal(rate) if rate is not None else None)
+        return ret
 
     def historical_value_str(self, satoshis, d_t):
         rate = self.history_rate(d_t)
@@ -513,6 +618,9 @@ class FxThread(ThreadJob):
             return PyDecimal(satoshis) / COIN * PyDecimal(rate)
 
     def timestamp_rate(self, timestamp):
-        from .util import timestamp_to_datetime
-        date = timestamp_to_datetime(timestamp)
-        return self.history_rate(date)
+        return self.timestamp_rates([timestamp])[0]
+
+    def timestamp_rates(self, timestamps):
+        ''' Bulk version of timestamp_rate: the rates on the (local) days of
+        a list of timestamps. '''
+        return self.history_rates([datetime.fromtimestamp(ts).toordinal() for ts in timestamps])
@@ -22,6 +22,8 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import asyncio
+import json
 import os
 import re
 import socket
@@ -30,12 +32,15 @@ import sys
 import threading
 import time
 import traceback
-
-import requests
+from collections import deque
 
 from .util import print_error
 
-ca_path = requests.certs.where()
+def get_ca_path():
+    ''' The CA bundle shipped with requests, resolved on first use since
+    importing requests costs more than the rest of this module. '''
+    import requests
+    return requests.certs.where()
 
 from . import util
 from . import x509
@@ -138,6 +143,54 @@ class TcpConnection(threading.Thread, util.PrintError):
 
         return context
 
+    def save_temporary_cert(self, dercert, cert_path):
+        '''Writes the DER-encoded server certificate as PEM next to cert_path
+        and returns the path of the temporary file.  It gets renamed into
+        place once a connection pinned to it succeeds.'''
+        cert = ssl.DER_cert_to_PEM_cert(dercert)
+        # workaround android bug
+        cert = re.sub("([^\n])-----END CERTIFICATE-----","\\1\n-----END CERTIFICATE-----",cert)
+        temporary_path = cert_path + '.temp'
+        util.assert_datadir_available(self.config_path)
+        with open(temporary_path, "w", encoding='utf-8') as f:
+            f.write(cert)
+            f.flush()
+            os.fsync(f.fileno())
+        return temporary_path
+
+    def handle_ssl_error(self, e, is_new, cert_path, temporary_path):
+        '''Bookkeeping for an SSL error raised while connecting with a pinned
+        certificate: rejects a freshly fetched certificate, or deletes an
+        expired one so that it is fetched again next time.'''
+        self.print_error("SSL error:", e)
+        if e.errno != 1:
+            return
+        if is_new:
+            rej = cert_path + '.rej'
+            if os.path.exists(rej):
+                os.unlink(rej)
+            os.rename(temporary_path, rej)
+        else:
+            util.assert_datadir_available(self.config_path)
+            with open(cert_path, encoding='utf-8') as f:
+                cert = f.read()
+            try:
+                b = pem.dePem(cert, 'CERTIFICATE')
+                x = x509.X509(b)
+            except:
+                if util.is_verbose:
+                    self.print_error("Error checking certificate, traceback follows")
+                    traceback.print_exc(file=sys.stderr)
+                self.print_error("wrong certificate")
+                return
+            try:
+                x.check_date()
+            except:
+                self.print_error("certificate has expired:", cert_path)
+                os.unlink(cert_path)
+                return
+            self.print_error("wrong certificate")
+
     def get_socket(self):
         if self.use_ssl:
             cert_path = os.path.join(self.config_path, 'certs', self.host)
@@ -148,7 +201,7 @@ class TcpConnection(threading.Thread, util.PrintError):
                     return
                 # try with CA first
                 try:
-                    context = self.get_ssl_context(cert_reqs=ssl.CERT_REQUIRED, ca_certs=ca_path)
+                    context = self.get_ssl_context(cert_reqs=ssl.CERT_REQUIRED, ca_certs=get_ca_path())
                     s = context.wrap_socket(s, do_handshake_on_connect=True)
                 except ssl.SSLError as e:
                     self.print_error(e)
@@ -175,17 +228,10 @@ class TcpConnection(threading.Thread, util.PrintError):
 
                 dercert = s.getpeercert(True)
                 s.close()
-                cert = ssl.DER_cert_to_PEM_cert(dercert)
-                # workaround android bug
-                cert = re.sub("([^\n])-----END CERTIFICATE-----","\\1\n-----END CERTIFICATE-----",cert)
-                temporary_path = cert_path + '.temp'
-                util.assert_datadir_available(self.config_path)
-                with open(temporary_path, "w", encoding='utf-8') as f:
-                    f.write(cert)
-                    f.flush()
-                    os.fsync(f.fileno())
+                temporary_path = self.save_temporary_cert(dercert, cert_path)
             else:
                 is_new = False
+                temporary_path = None
 
         s = self.get_simple_socket()
         if s is None:
@@ -200,36 +246,7 @@ class TcpConnection(threading.Thread, util.PrintError):
                 self.print_error('timeout')
                 return
             except ssl.SSLError as e:
-                self.print_error("SSL error:", e)
-                if e.errno != 1:
-                    return
-                if is_new:
-                    rej = cert_path + '.rej'
-                    if os.path.exists(rej):
-                        os.unlink(rej)
-                    os.rename(temporary_path, rej)
-                else:
-                    util.assert_datadir_available(self.config_path)
-                    with open(cert_path, encoding='utf-8') as f:
-                        cert = f.read()
-                    try:
-                        b = pem.dePem(cert, 'CERTIFICATE')
-                        x = x509.X509(b)
-                    except:
-                        if util.is_verbose:
-                            self.print_error("Error checking certificate, traceback follows")
-                            traceback.print_exc(file=sys.stderr)
-                        self.print_error("wrong certificate")
-                        return
-                    try:
-                        x.check_date()
-                    except:
-                        self.print_error("certificate has expired:", cert_path)
-                        os.unlink(cert_path)
-                        return
-                    self.print_error("wrong certificate")
-                if e.errno == 104:
-                    return
+                self.handle_ssl_error(e, is_new, cert_path, temporary_path)
                 return
 
             if is_new:
@@ -252,6 +269,132 @@ class TcpConnection(threading.Thread, util.PrintError):
         self.queue.put((self.server, socket))
 
 
+class AsyncConnection(util.PrintError):
+    '''The asyncio counterpart of TcpConnection, used by the 'asyncio' network
+    engine.  Instead of a thread per connection attempt, the connection is
+    made by a task on the network's event loop using asyncio streams.
+
+    Once the task finishes, it places a tuple on the queue of the form
+    (server, (reader, writer)), or (server, None) if the connection failed.
+    Certificate pinning follows the exact same rules as TcpConnection.'''
+
+    CONNECT_TIMEOUT = 10.0
+
+    check_host_name = TcpConnection.check_host_name
+    get_ssl_context = staticmethod(TcpConnection.get_ssl_context)
+    save_temporary_cert = TcpConnection.save_temporary_cert
+    handle_ssl_error = TcpConnection.handle_ssl_error
+
+    def __init__(self, server, queue, config_path, *, proxy=None, max_message_bytes=0):
+        self.config_path = config_path
+        self.queue = queue
+        self.server = server
+        self.host, self.port, self.protocol = self.server.rsplit(':', 2)
+        self.host = str(self.host)
+        self.port = int(self.port)
+        self.use_ssl = (self.protocol == 's')
+        self.proxy = proxy
+        # asyncio's StreamReader default limit of 64KiB is far too small for
+        # our JSON lines, so we use the Network's message size limit instead.
+        self.limit = max_message_bytes if max_message_bytes > 0 else 1024*1024*32
+        self.task = None
+
+    def diagnostic_name(self):
+        return self.host
+
+    def start(self, loop):
+        ''' Must be called from the thread running `loop`. '''
+        self.task = loop.create_task(self.run())
+        return self.task
+
+    async def run(self):
+        try:
+            streams = await self.get_streams()
+        except (OSError, asyncio.TimeoutError, ssl.SSLError) as e:
+            if util.is_verbose:
+                self.print_error("Error getting streams:", repr(e))
+            streams = None
+
+        if streams:
+            self.print_error("connected")
+        self.queue.put((self.server, streams))
+
+    def _get_proxied_socket(self):
+        ''' When a proxy is set, Network.set_proxy() has monkey-patched the
+        socket module, so we let TcpConnection's blocking code do the SOCKS
+        handshake in an executor and then hand the socket to asyncio. '''
+        s = TcpConnection.get_simple_socket(self)
+        if s is not None:
+            s.settimeout(None)
+        return s
+
+    async def _open(self, context=None):
+        loop = asyncio.get_event_loop()
+        kwargs = dict(ssl=context, limit=self.limit)
+        if context:
+            kwargs['server_hostname'] = self.host
+        if self.proxy:
+            sock = await loop.run_in_executor(None, self._get_proxied_socket)
+            if sock is None:
+                return None
+            coro = asyncio.open_connection(sock=sock, **kwargs)
+        else:
+            coro = asyncio.open_connection(self.host, self.port, **kwargs)
+        reader, writer = await asyncio.wait_for(coro, self.CONNECT_TIMEOUT)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return reader, writer
+
+    async def get_streams(self):
+        if not self.use_ssl:
+            return await self._open()
+
+        cert_path = os.path.join(self.config_path, 'certs', self.host)
+        temporary_path = None
+        is_new = not os.path.exists(cert_path)
+        if is_new:
+            # try with CA first
+            try:
+                streams = await self._open(self.get_ssl_context(cert_reqs=ssl.CERT_REQUIRED, ca_certs=get_ca_path()))
+            except ssl.SSLError as e:
+                self.print_error(e)
+                streams = None
+            if streams:
+                if self.check_host_name(streams[1].get_extra_info('peercert'), self.host):
+                    self.print_error("SSL certificate signed by CA")
+                    return streams
+                streams[1].close()
+            # get server certificate.
+            try:
+                streams = await self._open(self.get_ssl_context(cert_reqs=ssl.CERT_NONE, ca_certs=None))
+            except ssl.SSLError as e:
+                self.print_error("SSL error retrieving SSL certificate:", e)
+                return
+            if not streams:
+                return
+            dercert = streams[1].get_extra_info('ssl_object').getpeercert(True)
+            streams[1].close()
+            temporary_path = self.save_temporary_cert(dercert, cert_path)
+
+        try:
+            context = self.get_ssl_context(cert_reqs=ssl.CERT_REQUIRED,
+                                           ca_certs=(temporary_path if is_new else cert_path))
+            streams = await self._open(context)
+        except asyncio.TimeoutError:
+            self.print_error('timeout')
+            return
+        except ssl.SSLError as e:
+            self.handle_ssl_error(e, is_new, cert_path, temporary_path)
+            return
+
+        if streams and is_new:
+            self.print_error("saving certificate")
+            os.rename(temporary_path, cert_path)
+
+        return streams
+
+
 class Interface(util.PrintError):
     """The Interface class handles a socket connected to a single remote
     electrum server.  It's exposed API is:
@@ -339,6 +482,10 @@ class Interface(util.PrintError):
             self.unanswered_requests[request[2]] = request
         return True
 
+    def idle_time(self):
+        '''Seconds since data was last received from the server.'''
+        return self.pipe.idle_time()
+
     def ping_required(self):
         '''Returns True if a ping should be sent.'''
         return time.time() - self.last_send > 300
@@ -346,12 +493,18 @@ class Interface(util.PrintError):
     def has_timed_out(self):
         '''Returns True if the interface has timed out.'''
         if (self.unanswered_requests and time.time() - self.request_time > 10
-            and self.pipe.idle_time() > 10):
+            and self.idle_time() > 10):
             self.print_error("timeout", len(self.unanswered_requests))
             return True
 
         return False
 
+    def get_message(self):
+        '''Returns the next decoded message, or None if the connection was
+        closed remotely.  Raises util.timeout if no complete message is
+        available yet.'''
+        return self.pipe.get()
+
     def get_responses(self):
         '''Call if there is data available on the socket.  Returns a list of
         (request, response) pairs.  Notifications are singleton
@@ -364,10 +517,10 @@ class Interface(util.PrintError):
         responses = []
         while True:
             try:
-                response = self.pipe.get()
+                response = self.get_message()
             except util.timeout:
                 break
-            except self.pipe.MessageSizeExceeded as e:
+            except util.SocketPipe.MessageSizeExceeded as e:
                 self.print_error(repr(e))
                 responses.append((None, None))  # signals Network class to close this connection
                 break
@@ -414,6 +567,114 @@ class Interface(util.PrintError):
         return responses
 
 
+class AsyncInterface(Interface):
+    '''An Interface backed by asyncio streams rather than a blocking socket
+    polled with select().  A reader task on the event loop decodes incoming
+    lines as they arrive and calls `wakeup` so that the Network can process
+    them immediately.  All methods except close() must be called from the
+    thread running the event loop.'''
+
+    _SIZE_EXCEEDED = object()  # sentinel placed in the inbox by the reader task
+
+    def __init__(self, server, streams, *, loop, wakeup, max_message_bytes=0):
+        self.server = server
+        self.host, self.port, _ = server.rsplit(':', 2)
+        self.reader, self.writer = streams
+        self.socket = self.writer.get_extra_info('socket')
+        self.loop = loop
+        self.loop_thread = threading.current_thread()
+        self.wakeup = wakeup
+        self.max_message_bytes = max_message_bytes
+        # Dump network messages.  Set at runtime from the console.
+        self.debug = False
+        self.unsent_requests = []
+        self.unanswered_requests = {}
+        self.last_send = time.time()
+        self.recv_time = time.time()
+        self.closed_remotely = False
+        self.closed = False
+        self.inbox = deque()
+
+        self.mode = None
+        self.read_task = loop.create_task(self.read_loop())
+
+    def fileno(self):
+        return self.socket.fileno() if self.socket is not None and not self.closed else -1
+
+    def close(self):
+        ''' Thread-safe. '''
+        if self.loop.is_closed():
+            return
+        if threading.current_thread() is self.loop_thread:
+            self._close()
+        else:
+            self.loop.call_soon_threadsafe(self._close)
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.read_task.cancel()
+        self.writer.close()
+        self.inbox.clear()
+
+    def idle_time(self):
+        return time.time() - self.recv_time
+
+    def send_requests(self):
+        '''Writes queued requests to the transport.  Returns False on failure.'''
+        self.last_send = time.time()
+        make_dict = lambda m, p, i: {'method': m, 'params': p, 'id': i}
+        n = self.num_requests()
+        wire_requests = self.unsent_requests[0:n]
+        if self.closed or self.writer.is_closing():
+            self.print_error("send_requests: transport closed")
+            return False
+        self.writer.write(b''.join((json.dumps(make_dict(*r)) + '\n').encode('utf8')
+                                   for r in wire_requests))
+        self.unsent_requests = self.unsent_requests[n:]
+        for request in wire_requests:
+            if self.debug:
+                self.print_error("-->", request)
+            self.unanswered_requests[request[2]] = request
+        return True
+
+    async def read_loop(self):
+        while True:
+            try:
+                line = await self.reader.readuntil(b'\n')
+            except asyncio.LimitOverrunError:
+                line = self._SIZE_EXCEEDED
+            except asyncio.IncompleteReadError:
+                line = None  # Connection closed remotely
+            except (OSError, ssl.SSLError) as e:
+                self.print_error("read error:", repr(e))
+                line = None
+            else:
+                self.recv_time = time.time()
+            self.inbox.append(line)
+            self.wakeup()
+            if line is None or line is self._SIZE_EXCEEDED:
+                break
+
+    def has_messages(self):
+        return bool(self.inbox)
+
+    def get_message(self):
+        while self.inbox:
+            line = self.inbox.popleft()
+            if line is None:
+                return None
+            if line is self._SIZE_EXCEEDED:
+                raise util.SocketPipe.MessageSizeExceeded(f"Message limit is: {self.max_message_bytes}; message buffer exceeded this limit!")
+            try:
+                return json.loads(line.decode('utf8'))
+            except (ValueError, UnicodeDecodeError):
+                # Same as SocketPipe: garbage lines are silently skipped
+                continue
+        raise util.timeout
+
+
 def check_cert(host, cert):
     try:
         b = pem.dePem(cert, 'CERTIFICATE')
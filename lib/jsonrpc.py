@@ -24,7 +24,13 @@
 # SOFTWARE.
 
 from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer, SimpleJSONRPCRequestHandler
+from jsonrpclib.jsonrpc import Fault
 from base64 import b64decode
+from collections import deque
+import queue
+import selectors
+import socket
+import threading
 import time
 
 from . import util
@@ -45,15 +51,80 @@ class RPCAuthUnsupportedType(Exception):
         return 'Authentication failed (only basic auth is supported)'
 
 
+class RPCMethodStats:
+    ''' Call count, error count and latency of one RPC method. The
+    percentiles are over the most recent calls only. '''
+
+    RECENT = 256
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.recent = deque(maxlen=self.RECENT)
+
+    def add(self, elapsed, failed):
+        self.count += 1
+        self.errors += bool(failed)
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.recent.append(elapsed)
+
+    def to_dict(self):
+        recent = sorted(self.recent)
+        def pct(p):
+            return recent[min(len(recent) - 1, int(len(recent) * p))] if recent else 0.0
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': round(1e3 * self.total_time / self.count, 3) if self.count else 0.0,
+            'p50_ms': round(1e3 * pct(0.50), 3),
+            'p95_ms': round(1e3 * pct(0.95), 3),
+            'max_ms': round(1e3 * self.max_time, 3),
+        }
+
+
 # based on http://acooke.org/cute/BasicHTTPA0.html by andrew cooke
 class VerifyingJSONRPCServer(SimpleJSONRPCServer):
+    ''' JSON-RPC server with HTTP basic auth.
 
-    def __init__(self, *args, rpc_user, rpc_password, **kargs):
+    Requests are served by a fixed pool of `num_threads` worker threads, so
+    a slow call only holds up its own connection. Connections are kept
+    alive (HTTP/1.1) until the client closes them or they have been idle
+    for `idle_timeout` seconds, but a worker is only taken up for the time
+    it serves one request: in between, the connection waits in the
+    selector of the thread calling handle_request(), along with the
+    listening socket, and goes back to the workers once its next request
+    arrives. JSON-RPC batches are handled by jsonrpclib; each call in them
+    is timed like any other (see get_stats). '''
+
+    def __init__(self, *args, rpc_user, rpc_password, num_threads=8, idle_timeout=10.0, **kargs):
 
         self.rpc_user = rpc_user
         self.rpc_password = rpc_password
+        self.idle_timeout = idle_timeout
+        self.stats_lock = threading.Lock()
+        self.method_stats = {}
 
         class VerifyingRequestHandler(SimpleJSONRPCRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            timeout = idle_timeout
+
+            def __init__(myself, request, client_address, server):
+                # Unlike the base class, doesn't serve the connection here:
+                # the server calls serve_one() for each of its requests.
+                myself.request = request
+                myself.client_address = client_address
+                myself.server = server
+                myself.setup()
+
+            def serve_one(myself):
+                ''' Serves the next request. Returns whether the connection
+                can be kept open. '''
+                myself.handle_one_request()
+                return not myself.close_connection
+
             def parse_request(myself):
                 # first, call the original implementation which returns
                 # True if all OK so far
@@ -73,6 +144,161 @@ class VerifyingJSONRPCServer(SimpleJSONRPCServer):
         SimpleJSONRPCServer.__init__(
             self, requestHandler=VerifyingRequestHandler, *args, **kargs)
 
+        # Only the thread calling handle_request() touches the selector. The
+        # workers hand it the connections to wait on through `parked`, and
+        # wake it up with a byte on the socket pair.
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.wakeup_w.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ)
+        self.parked = queue.Queue()
+        self.idle = {}  # handler -> time it went idle, for the connections in the selector
+
+        self.request_queue = queue.Queue()
+        self.workers = []
+        for i in range(max(1, num_threads)):
+            t = threading.Thread(target=self.worker_loop, name='RPC worker {}'.format(i), daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def handle_request(self):
+        ''' Waits up to self.timeout for a new connection, or for the next
+        request on an idle one, and hands what is ready to the workers. Also
+        closes the connections idle for longer than idle_timeout. '''
+        self._take_parked()
+        timeout = self.timeout
+        if self.idle and (timeout is None or timeout > self.idle_timeout):
+            timeout = self.idle_timeout
+        ready = self.selector.select(timeout)
+        for key, events in ready:
+            if key.fileobj is self.socket:
+                self._handle_request_noblock()  # accepts, then process_request
+            elif key.fileobj is self.wakeup_r:
+                try:
+                    while self.wakeup_r.recv(512):
+                        pass
+                except OSError:
+                    pass
+            else:
+                self.selector.unregister(key.fileobj)
+                self.idle.pop(key.data, None)
+                self.request_queue.put(key.data)
+        self._close_idle()
+        if not ready:
+            self.handle_timeout()
+
+    def _take_parked(self):
+        while True:
+            try:
+                handler = self.parked.get_nowait()
+            except queue.Empty:
+                return
+            self.idle[handler] = time.monotonic()
+            self.selector.register(handler.request, selectors.EVENT_READ, handler)
+
+    def _close_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for handler in [h for h, t in self.idle.items() if t < cutoff]:
+            del self.idle[handler]
+            self.selector.unregister(handler.request)
+            self.close_handler(handler)
+
+    def process_request(self, request, client_address):
+        # Called from the thread calling handle_request(); the connection's
+        # requests are served by the workers.
+        self.request_queue.put((request, client_address))
+
+    def worker_loop(self):
+        while True:
+            item = self.request_queue.get()
+            if item is None:
+                return
+            if isinstance(item, tuple):
+                request, client_address = item
+                try:
+                    handler = self.RequestHandlerClass(request, client_address, self)
+                except Exception:
+                    self.handle_error(request, client_address)
+                    self.shutdown_request(request)
+                    continue
+            else:
+                handler = item
+            try:
+                keep = handler.serve_one()
+            except Exception:
+                self.handle_error(handler.request, handler.client_address)
+                keep = False
+            if not keep:
+                self.close_handler(handler)
+            elif self.has_pending_data(handler):
+                # the client already sent its next request (pipelining)
+                self.request_queue.put(handler)
+            else:
+                self.parked.put(handler)
+                try:
+                    self.wakeup_w.send(b'\0')
+                except OSError:
+                    pass  # the pipe is full, so it's getting woken up anyway
+
+    @staticmethod
+    def has_pending_data(handler):
+        ''' Whether the next request is already in the handler's read
+        buffer, where the selector wouldn't see it. '''
+        sock = handler.request
+        sock.setblocking(False)
+        try:
+            return bool(handler.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            sock.settimeout(handler.timeout)
+
+    def close_handler(self, handler):
+        try:
+            handler.finish()
+        except Exception:
+            pass  # eg the client went away before the response was flushed
+        self.shutdown_request(handler.request)
+
+    def server_close(self):
+        super().server_close()
+        self._take_parked()
+        for handler in list(self.idle):
+            self.close_handler(handler)
+        self.idle.clear()
+        self.selector.close()
+        self.wakeup_r.close()
+        self.wakeup_w.close()
+        # Workers busy with a request pick this up once they are done.
+        for t in self.workers:
+            self.request_queue.put(None)
+
+    def _dispatch(self, method, params, config=None):
+        t0 = time.time()
+        failed = True
+        try:
+            result = super()._dispatch(method, params, config)
+            failed = isinstance(result, Fault)
+            return result
+        finally:
+            elapsed = time.time() - t0
+            with self.stats_lock:
+                st = self.method_stats.get(method)
+                if st is None:
+                    if method not in self.funcs:
+                        # don't let clients grow the table with made up names
+                        method = '<unknown>'
+                    st = self.method_stats.setdefault(method, RPCMethodStats())
+                st.add(elapsed, failed)
+
+    def get_stats(self):
+        ''' Returns a dict of method name -> call count, error count and
+        latency (in ms) of the calls served so far. '''
+        with self.stats_lock:
+            return {method: st.to_dict() for method, st in sorted(self.method_stats.items())}
+
     def authenticate(self, headers):
         if self.rpc_password == '':
             # RPC authentication is disabled
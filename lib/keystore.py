@@ -24,6 +24,8 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
+from functools import lru_cache
 from unicodedata import normalize
 
 from . import bitcoin
@@ -258,38 +260,62 @@ class Deterministic_KeyStore(Software_KeyStore):
         return pw_decode(self.passphrase, password) if self.passphrase else ''
 
 
+# Ranges of at least this many keys are derived on several threads, when
+# libsecp256k1 is available (the pure python EC math is GIL bound).
+DERIVE_THREADS = min(8, os.cpu_count() or 1)
+DERIVE_PARALLEL_MIN = 64
+
+
+@lru_cache(maxsize=64)
+def _xpub_node(xpub, net):
+    ''' Returns the (chain code, compressed pubkey) of `xpub`. Memoized, since
+    base58 decoding is slow and the same few xpubs get decoded over and over
+    when resolving x_pubkeys. '''
+    _, _, _, _, c, cK = deserialize_xpub(xpub, net=net)
+    return c, cK
+
+
 class Xpub:
 
     def __init__(self):
         self.xpub = None
-        self.xpub_receive = None
-        self.xpub_change = None
+        # for_change -> decoded (c, cK) of the xpub/for_change branch
+        self._branch_nodes = {}
 
     def get_master_public_key(self):
         return self.xpub
 
+    def _get_branch_node(self, for_change):
+        for_change = int(bool(for_change))
+        node = self._branch_nodes.get(for_change)
+        if node is None:
+            c, cK = _xpub_node(self.xpub, networks.net)
+            cK, c = CKD_pub(cK, c, for_change)
+            node = self._branch_nodes[for_change] = (c, cK)
+        return node
+
     def derive_pubkey(self, for_change, n):
-        xpub = self.xpub_change if for_change else self.xpub_receive
-        if xpub is None:
-            xpub = bip32_public_derivation(self.xpub, "", "/%d"%for_change)
-            if for_change:
-                self.xpub_change = xpub
-            else:
-                self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+        return self.derive_pubkey_range(for_change, n, 1)[0]
+
+    def derive_pubkey_range(self, for_change, start, count):
+        ''' Returns the hex pubkeys for indices [start, start + count) of the
+        receiving (for_change=0) or change branch, decoding the branch xpub
+        only once. '''
+        c, cK = self._get_branch_node(for_change)
+        max_workers = DERIVE_THREADS if count >= DERIVE_PARALLEL_MIN else 1
+        children = CKD_pub_batch(cK, c, range(start, start + count), max_workers=max_workers)
+        return [bh2u(child_cK) for child_cK, _ in children]
 
     def scan_for_pubkey_index(self, pubkey, depth=100):
-        for i in range(depth):
-            if self.derive_pubkey(0, i) == pubkey:
-                return (0, i)
-        for i in range(depth):
-            if self.derive_pubkey(1, i) == pubkey:
-                return (1, i)
+        for for_change in (0, 1):
+            pubkeys = self.derive_pubkey_range(for_change, 0, depth)
+            if pubkey in pubkeys:
+                return (for_change, pubkeys.index(pubkey))
         return (None, None)
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub, sequence):
-        _, _, _, _, c, cK = deserialize_xpub(xpub)
+        c, cK = _xpub_node(xpub, networks.net)
         for i in sequence:
             cK, c = CKD_pub(cK, c, i)
         return bh2u(cK)
@@ -488,6 +514,16 @@ class Old_KeyStore(Deterministic_KeyStore):
     def derive_pubkey(self, for_change, n):
         return self.get_pubkey_from_mpk(self.mpk, for_change, n)
 
+    def derive_pubkey_range(self, for_change, start, count):
+        mpk_point = ecdsa.VerifyingKey.from_string(bfh(self.mpk), curve = SECP256k1).pubkey.point
+        pubkeys = []
+        for n in range(start, start + count):
+            z = self.get_sequence(self.mpk, for_change, n)
+            pubkey_point = mpk_point + z*SECP256k1.generator
+            public_key2 = ecdsa.VerifyingKey.from_public_point(pubkey_point, curve = SECP256k1)
+            pubkeys.append('04' + bh2u(public_key2.to_string()))
+        return pubkeys
+
     def get_private_key_from_stretched_exponent(self, for_change, n, secexp):
         order = generator_secp256k1.order()
         secexp = (secexp + self.get_sequence(self.mpk, for_change, n)) % order
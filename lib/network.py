@@ -21,6 +21,7 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import asyncio
 import time
 import queue
 import os
@@ -40,14 +41,23 @@ from . import bitcoin
 from .bitcoin import *
 from . import networks
 from .i18n import _
-from .interface import Connection, Interface
+from .interface import AsyncConnection, AsyncInterface, Connection, Interface
 from . import blockchain
 from . import version
+from .tx_store import get_tx_store
 
 
 DEFAULT_AUTO_CONNECT = True
 DEFAULT_WHITELIST_SERVERS_ONLY = True
 
+# The network engine drives all server I/O. 'select' is the classic polling
+# loop with a thread per connection attempt, 'asyncio' runs the same logic on
+# an event loop using asyncio streams. Set with the 'network_engine' config key.
+ENGINE_SELECT = 'select'
+ENGINE_ASYNCIO = 'asyncio'
+NETWORK_ENGINES = (ENGINE_SELECT, ENGINE_ASYNCIO)
+DEFAULT_NETWORK_ENGINE = ENGINE_SELECT
+
 def parse_servers(result):
     """ parse servers list into dict format"""
     servers = {}
@@ -190,7 +200,9 @@ class Network(util.DaemonThread):
     """The Network class manages a set of connections to remote electrum
     servers, each connected socket is handled by an Interface() object.
     Connections are initiated by a Connection() thread which stops once
-    the connection succeeds or fails.
+    the connection succeeds or fails.  With the 'asyncio' engine, the same
+    work is done by AsyncConnection() tasks on an event loop which runs in
+    this thread, and each connection is handled by an AsyncInterface().
 
     Our external API:
 
@@ -213,8 +225,18 @@ class Network(util.DaemonThread):
         util.DaemonThread.__init__(self)
         self.config = SimpleConfig(config) if isinstance(config, dict) else config
         self.num_server = 10 if not self.config.get('oneserver') else 0
+        self.engine = self.config.get('network_engine', DEFAULT_NETWORK_ENGINE)
+        if self.engine not in NETWORK_ENGINES:
+            self.print_error("unknown network_engine '{}', falling back to '{}'".format(self.engine, DEFAULT_NETWORK_ENGINE))
+            self.engine = DEFAULT_NETWORK_ENGINE
+        self.loop = None  # the asyncio event loop, only set while run() is executing with ENGINE_ASYNCIO
+        self.wakeup_event = None  # an asyncio.Event, set to wake the loop early
+        self.deferred_connections = []  # AsyncConnections created before the loop was started
         self.blockchains = blockchain.read_blockchains(self.config)
         self.print_error("blockchains", self.blockchains.keys())
+        if self.config.get('tx_store_disk', True):
+            # Keep fetched foreign txs around across restarts
+            get_tx_store().enable_disk(os.path.join(self.config.path, 'cache'))
         self.blockchain_index = config.get('blockchain_index', 0)
         if self.blockchain_index not in self.blockchains.keys():
             self.blockchain_index = 0
@@ -554,7 +576,42 @@ class Network(util.DaemonThread):
                 self.print_error("connecting to %s as new interface" % server_key)
                 self.set_status('connecting')
             self.connecting.add(server_key)
-            c = Connection(server_key, self.socket_queue, self.config.path)
+            if self.engine == ENGINE_ASYNCIO:
+                self.start_async_connection(server_key)
+            else:
+                c = Connection(server_key, self.socket_queue, self.config.path)
+
+    def start_async_connection(self, server_key):
+        c = AsyncConnection(server_key, self.socket_queue, self.config.path,
+                            proxy=self.proxy, max_message_bytes=self.MAX_MESSAGE_BYTES)
+        loop = self.loop
+        if loop is None:
+            # start_network() is called from __init__, before run() has
+            # created the event loop.
+            self.deferred_connections.append(c)
+            return
+
+        def start():
+            c.start(loop).add_done_callback(lambda task: self.wakeup())
+        if threading.current_thread() is self:
+            start()
+        else:
+            loop.call_soon_threadsafe(start)
+
+    def wakeup(self):
+        '''Wakes up the asyncio engine's loop so that pending work (sends,
+        responses, connections) is handled right away rather than on the next
+        tick.  Thread-safe. A no-op with the select engine.'''
+        loop, event = self.loop, self.wakeup_event
+        if loop is None or event is None or loop.is_closed():
+            return
+        if threading.current_thread() is self:
+            event.set()
+        else:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # loop was closed from underneath us
 
     def get_unavailable_servers(self):
         exclude_set = set(self.interfaces)
@@ -876,6 +933,7 @@ class Network(util.DaemonThread):
         if messages: # Guard against empty message-list which is a no-op and just wastes CPU to enque/dequeue (not even callback is called). I've seen the code send empty message lists before in synchronizer.py
             with self.pending_sends_lock:
                 self.pending_sends.append((messages, callback))
+            self.wakeup()
 
     def process_pending_sends(self):
         # Requests needs connectivity.  If we don't have an interface,
@@ -954,6 +1012,12 @@ class Network(util.DaemonThread):
             qname = getattr(callback, '__qualname__', repr(callback))
             self.print_error("Removed {} unanswered client requests and {} pending sends for callback: {}".format(ct, ct2, qname))
 
+    def cancel_request_id(self, message_id):
+        '''Forget about the client request with the given message id (as
+        returned by queue_request). A response to it, should one still
+        arrive, will be ignored. Returns True if the request was pending.'''
+        return self.unanswered_requests.pop(message_id, None) is not None
+
     def connection_down(self, server, blacklist=False):
         '''A connection to server either went down, or was never made.
         We distinguish by whether it is in self.interfaces.'''
@@ -973,7 +1037,11 @@ class Network(util.DaemonThread):
     def new_interface(self, server_key, socket):
         self.add_recent_server(server_key)
 
-        interface = Interface(server_key, socket, max_message_bytes=self.MAX_MESSAGE_BYTES)
+        if self.engine == ENGINE_ASYNCIO:
+            interface = AsyncInterface(server_key, socket, loop=self.loop, wakeup=self.wakeup,
+                                       max_message_bytes=self.MAX_MESSAGE_BYTES)
+        else:
+            interface = Interface(server_key, socket, max_message_bytes=self.MAX_MESSAGE_BYTES)
         interface.blockchain = None
         interface.tip_header = None
         interface.tip = 0
@@ -1460,6 +1528,11 @@ class Network(util.DaemonThread):
         if header is not None:
             self.verified_checkpoint = True
 
+        if self.engine == ENGINE_ASYNCIO:
+            self.run_asyncio()
+            self.on_stop()
+            return
+
         while self.is_running():
             self.maintain_sockets()
             self.wait_on_sockets()
@@ -1470,6 +1543,61 @@ class Network(util.DaemonThread):
         self.stop_network()
         self.on_stop()
 
+    # How long the asyncio engine sleeps when there is nothing to do. Jobs
+    # (Synchronizer, Verifier, Fx) still get to run at least this often.
+    ASYNCIO_IDLE_TIMEOUT = 0.1
+
+    def run_asyncio(self):
+        self.print_error("using asyncio network engine")
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._run_asyncio_loop(loop))
+            # Let closed transports and cancelled tasks finish up
+            all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks  # Python 3.6 compat.
+            pending = [t for t in all_tasks(loop) if not t.done()]
+            for t in pending:
+                t.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        finally:
+            self.loop = None
+            self.wakeup_event = None
+            loop.close()
+
+    async def _run_asyncio_loop(self, loop):
+        self.wakeup_event = asyncio.Event()
+        self.loop = loop
+        deferred, self.deferred_connections = self.deferred_connections, []
+        for c in deferred:
+            c.start(loop).add_done_callback(lambda task: self.wakeup())
+
+        while self.is_running():
+            self.wakeup_event.clear()
+            self.maintain_sockets()
+            with self.interface_lock:
+                interfaces = list(self.interfaces.values())
+            for interface in interfaces:
+                if interface.has_messages():
+                    self.process_responses(interface)
+            self.maintain_requests()
+            if self.verified_checkpoint:
+                self.run_jobs()    # Synchronizer and Verifier and Fx
+            self.process_pending_sends()
+            # Unlike the select engine which waits for writability first,
+            # requests are flushed to the transport as soon as they are queued.
+            with self.interface_lock:
+                interfaces = list(self.interfaces.values())
+            for interface in interfaces:
+                if interface.num_requests() and not interface.send_requests():
+                    self.connection_down(interface.server)
+            try:
+                await asyncio.wait_for(self.wakeup_event.wait(), self.ASYNCIO_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        self.stop_network()
+        # give the transports a chance to close cleanly
+        await asyncio.sleep(0)
+
     def on_server_version(self, interface, version_data):
         interface.server_version = version_data
 
@@ -1694,8 +1822,20 @@ class Network(util.DaemonThread):
                  replied with (with a generic fallback message is used
                  if the server message is not recognized). '''
         txid = str(txid).strip()
+        try:
+            txid_bytes = bfh(txid)
+        except ValueError:
+            txid_bytes = None
+        if txid_bytes and len(txid_bytes) == 32:
+            raw = get_tx_store().get(txid_bytes.hex())
+            if raw is not None:
+                return True, raw.hex()
         try:
             r = self.synchronous_get(('blockchain.transaction.get',[txid]), timeout=timeout)
+            raw = bfh(r)
+            # only keep the tx if it really is the one we asked for
+            if Hash(raw)[::-1] == txid_bytes:
+                get_tx_store().put(txid_bytes.hex(), raw)
             return True, r
         except BaseException as e:
             self.print_error("Exception retrieving transaction for '{}': {}".format(txid, repr(e)))
@@ -1845,14 +1985,16 @@ class Network(util.DaemonThread):
         return _("An error occurred broadcasting the transaction")
 
     # Used by the verifier job.
-    def get_merkle_for_transaction(self, tx_hash, tx_height, callback, max_qlen=10):
+    def get_merkle_for_transaction(self, tx_hash, tx_height, callback, max_qlen=10, *, interface=None):
         ''' Asynchronously enqueue a request for a merkle proof for a tx.
             Note that the callback param is required.
             May return None if too many requests were enqueued (max_qlen) or
             if there is no interface.
-            Client code should handle the None return case appropriately. '''
+            Client code should handle the None return case appropriately.
+            The request goes to the main interface unless `interface` is
+            specified. '''
         return self.queue_request('blockchain.transaction.get_merkle',
-                                  [tx_hash, tx_height],
+                                  [tx_hash, tx_height], interface,
                                   callback=callback, max_qlen=max_qlen)
 
     def get_proxies(self):
@@ -28,18 +28,11 @@ import sys
 import time
 import traceback
 import json
-import requests
 import urllib.parse
-import dateutil.parser
 import threading
 import zlib
 from collections import namedtuple
 
-try:
-    from . import paymentrequest_pb2 as pb2
-except ImportError:
-    sys.exit("Error: could not find paymentrequest_pb2.py. Create it with 'protoc --proto_path=lib/ --python_out=lib/ lib/paymentrequest.proto'")
-
 from . import bitcoin
 from . import version
 from . import util
@@ -57,14 +50,28 @@ from .transaction import Transaction
 REQUEST_HEADERS = {'Accept': 'application/bitcoincash-paymentrequest', 'User-Agent': 'Electron-Cash'}
 ACK_HEADERS = {'Content-Type':'application/bitcoincash-payment','Accept':'application/bitcoincash-paymentack','User-Agent':'Electron-Cash'}
 
-ca_path = requests.certs.where()
 ca_list = None
 ca_keyID = None
 
+# requests, protobuf and dateutil are only needed once a payment request is
+# actually fetched, parsed or paid, so they are imported on first use rather
+# than on every `import electroncash` (see startup_profile.py).
+
+def _pb2():
+    try:
+        from . import paymentrequest_pb2 as pb2
+    except ImportError:
+        sys.exit("Error: could not find paymentrequest_pb2.py. Create it with 'protoc --proto_path=lib/ --python_out=lib/ lib/paymentrequest.proto'")
+    return pb2
+
+def get_ca_path():
+    import requests
+    return requests.certs.where()
+
 def load_ca_list():
     global ca_list, ca_keyID
     if ca_list is None:
-        ca_list, ca_keyID = x509.load_certificates(ca_path)
+        ca_list, ca_keyID = x509.load_certificates(get_ca_path())
 
 
 
@@ -77,6 +84,7 @@ PR_PAID    = 3     # send and propagated
 
 
 def get_payment_request(url):
+    import requests
     data = error = None
     try:
         u = urllib.parse.urlparse(url)
@@ -130,12 +138,12 @@ class PaymentRequest:
             return
         self.id = bh2u(bitcoin.sha256(r)[0:16])
         try:
-            self.data = pb2.PaymentRequest()
+            self.data = _pb2().PaymentRequest()
             self.data.ParseFromString(r)
         except:
             self.error = "cannot parse payment request"
             return
-        self.details = pb2.PaymentDetails()
+        self.details = _pb2().PaymentDetails()
         self.details.ParseFromString(self.data.serialized_payment_details)
         self.outputs = []
         for o in self.details.outputs:
@@ -153,7 +161,7 @@ class PaymentRequest:
         if not self.raw:
             self.error = "Empty request"
             return False
-        pr = pb2.PaymentRequest()
+        pr = _pb2().PaymentRequest()
         try:
             pr.ParseFromString(self.raw)
         except:
@@ -176,7 +184,7 @@ class PaymentRequest:
         if not ca_list:
             self.error = "Trusted certificate authorities list not found"
             return False
-        cert = pb2.X509Certificates()
+        cert = _pb2().X509Certificates()
         cert.ParseFromString(paymntreq.pki_data)
         # verify the chain of certificates
         try:
@@ -278,7 +286,8 @@ class PaymentRequest:
         pay_det = self.details
         if not self.details.payment_url:
             return False, "no url"  # note caller is expecting this exact string in the "no payment url specified" case. see main_window.py and/or ios_native/gui.py
-        paymnt = pb2.Payment()
+        import requests
+        paymnt = _pb2().Payment()
         paymnt.merchant_data = pay_det.merchant_data
         paymnt.transactions.append(bfh(raw_tx))
         ref_out = paymnt.refund_to.add()
@@ -287,7 +296,7 @@ class PaymentRequest:
         pm = paymnt.SerializeToString()
         payurl = urllib.parse.urlparse(pay_det.payment_url)
         try:
-            r = requests.post(payurl.geturl(), data=pm, headers=ACK_HEADERS, verify=ca_path)
+            r = requests.post(payurl.geturl(), data=pm, headers=ACK_HEADERS, verify=get_ca_path())
         except requests.exceptions.RequestException as e:
             return False, str(e)
         if r.status_code != 200:
@@ -299,7 +308,7 @@ class PaymentRequest:
             # Hide those and just display the name of the error code.
             return False, r.reason
         try:
-            paymntack = pb2.PaymentACK()
+            paymntack = _pb2().PaymentACK()
             paymntack.ParseFromString(r.content)
         except Exception:
             return False, "PaymentACK could not be processed. Payment was sent; please manually verify that payment was received."
@@ -339,7 +348,7 @@ def make_unsigned_request(req):
     memo = req['memo']
     script = bfh(Transaction.pay_script(addr))
     outputs = [(script, amount)]
-    pd = pb2.PaymentDetails()
+    pd = _pb2().PaymentDetails()
     for script, amount in outputs:
         pd.outputs.add(amount=amount, script=script)
     pd.time = time
@@ -347,7 +356,7 @@ def make_unsigned_request(req):
     pd.memo = memo
     if payment_url:
         pd.payment_url = payment_url
-    pr = pb2.PaymentRequest()
+    pr = _pb2().PaymentRequest()
     
     # Note: We explicitly set this again here to 1 (default was already 1).
     # The reason we need to do this is because __setattr__ for this class
@@ -461,7 +470,7 @@ def sign_request_with_x509(pr, key_path, cert_path):
     with open(cert_path, 'r', encoding='utf-8') as f:
         s = f.read()
         bList = pem.dePemList(s, "CERTIFICATE")
-    certificates = pb2.X509Certificates()
+    certificates = _pb2().X509Certificates()
     certificates.certificate.extend(map(bytes, bList))
     pr.pki_type = 'x509+sha256'
     pr.pki_data = certificates.SerializeToString()
@@ -614,6 +623,7 @@ class PaymentRequest_BitPay20(PaymentRequest, PrintError):
         __slots__ = ('status_code', 'headers', 'text', 'url')
         ser_prefix = b'BITPAY2.0_ZCOMPRESSED_'
         def __init__(self, **kwargs):
+            import requests
             resp = kwargs.get('response')
             if resp:
                 if not isinstance(resp, requests.Response):
@@ -642,6 +652,7 @@ class PaymentRequest_BitPay20(PaymentRequest, PrintError):
                 raise ValueError('Missing required keys in deserialized data')
             return cls(**d)
         def get_dict(self):
+            import requests
             d = {}
             for s in self.__slots__:
                 val = getattr(self, s, '')
@@ -671,6 +682,7 @@ class PaymentRequest_BitPay20(PaymentRequest, PrintError):
 
     def parse(self, r):
         ''' Overrides super. r is a self.Raw object. '''
+        import dateutil.parser
         if self.error:
             return
         if not isinstance(r, self.Raw):  # BitPay2.0 requires 'raw' be a Raw instance
@@ -746,6 +758,8 @@ class PaymentRequest_BitPay20(PaymentRequest, PrintError):
         # come from the web *anyway*.  What's more -- we need to depend
         # on Python PGP libs now, which is a rather heavy dependency. :/
 
+        import dateutil.parser
+        import requests
         if not self._pgp_key_data:
             try:
                 pgp_key_data = requests.get('https://bitpay.com/pgp-keys.json', timeout=timeout, verify=True).json()['pgpKeys']
@@ -861,6 +875,7 @@ class PaymentRequest_BitPay20(PaymentRequest, PrintError):
         raise NotImplementedError()
 
     def send_payment(self, raw_tx, refund_addr, *, timeout=10.0):
+        import requests
         self.print_error("Send payment")
         # NB: refund_addr is ignored
         self.tx = None
@@ -922,6 +937,7 @@ def get_payment_request_bitpay20(url, timeout=10.0):
     ''' Synchronously contacts BitPay and gets the payment request.
     Returns the PaymentRequest object. Returned PaymentRequest
     has .error != None on error. '''
+    import requests
     headers = PaymentRequest_BitPay20.HEADERS.copy()
     headers.update({'accept' : 'application/payment-request'})
     try:
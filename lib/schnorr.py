@@ -170,29 +170,85 @@ def verify(pubkey, signature, message_hash):
         raise ValueError('signature must be a bytes object of length 64')
     if not isinstance(message_hash, bytes) or len(message_hash) != 32:
         raise ValueError('message_hash must be a bytes object of length 32')
+    parsed = _parse_pubkey(pubkey)
+    if parsed is None:
+        if _secp256k1_schnorr_verify:
+            raise ValueError('pubkey could not be parsed by the secp256k1 library')
+        # off-curve points, failed decompression, bad format,
+        # point at infinity:
+        raise ValueError('pubkey could not be parsed')
+    return _verify_parsed(parsed, signature, message_hash)
+
+
+def verify_batch(items, *, max_workers=1):
+    '''Verify many Schnorr signatures, returning a list of bools (one for
+    each item, in order).
+
+    `items` is a sequence of (pubkey, signature, message_hash) tuples, each
+    the same as the arguments to `verify` above. Unlike `verify` this never
+    raises for a bad item -- it is simply reported as False, so the caller
+    can tell exactly which ones failed.
+
+    Each distinct pubkey is parsed only once. With libsecp256k1 (which
+    releases the GIL) `max_workers` > 1 spreads the checks over that many
+    threads.'''
+    items = list(items)
+    parsed = {}
+    for pubkey, _, _ in items:
+        if pubkey not in parsed:
+            ok = isinstance(pubkey, bytes) and len(pubkey) in (33, 65)
+            parsed[pubkey] = _parse_pubkey(pubkey) if ok else None
+
+    def check(item):
+        pubkey, signature, message_hash = item
+        p = parsed[pubkey]
+        if (p is None or not isinstance(signature, bytes) or len(signature) != 64
+                or not isinstance(message_hash, bytes) or len(message_hash) != 32):
+            return False
+        try:
+            return _verify_parsed(p, signature, message_hash)
+        except Exception:
+            return False
+
+    if max_workers > 1 and _secp256k1_schnorr_verify and len(items) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        chunksize = -(-len(items) // max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='SchnorrVerify') as executor:
+            return list(executor.map(check, items, chunksize=chunksize))
+    return [check(item) for item in items]
+
+
+def _parse_pubkey(pubkey):
+    ''' Returns `pubkey` in the form _verify_parsed() wants it, or None if it
+    can't be parsed. '''
     if _secp256k1_schnorr_verify:
         pubkey_parsed = create_string_buffer(64)
         res = secp256k1.secp256k1.secp256k1_ec_pubkey_parse(
             secp256k1.secp256k1.ctx, pubkey_parsed, pubkey, c_size_t(len(pubkey))
         )
-        if not res:
-            raise ValueError('pubkey could not be parsed by the secp256k1 library')
+        return pubkey_parsed if res else None
+    try:
+        pubpoint = ser_to_point(pubkey)
+    except:
+        return None
+    if not ecdsa.ecdsa.curve_secp256k1.contains_point(pubpoint.x(), pubpoint.y()):
+        return None
+    # compressed format, regardless of whether pubkey was compressed or not:
+    return pubpoint, point_to_ser(pubpoint, comp=True)
+
+
+def _verify_parsed(parsed, signature, message_hash):
+    if _secp256k1_schnorr_verify:
         res = _secp256k1_schnorr_verify(
-            secp256k1.secp256k1.ctx, signature, message_hash, pubkey_parsed
+            secp256k1.secp256k1.ctx, signature, message_hash, parsed
         )
         return bool(res)
     else:
+        pubpoint, pubbytes = parsed
         G = ecdsa.SECP256k1.generator
         order = G.order()
         fieldsize = G.curve().p()
 
-        try:
-            pubpoint = ser_to_point(pubkey)
-        except:
-            # off-curve points, failed decompression, bad format,
-            # point at infinity:
-            raise ValueError('pubkey could not be parsed')
-
         rbytes = signature[:32]
         ## these unnecessary since below we do bytes comparison and
         ## R.x() is always < fieldsize.
@@ -205,9 +261,6 @@ def verify(pubkey, signature, message_hash):
         if s >= order:
             return False
 
-        # compressed format, regardless of whether pubkey was compressed or not:
-        pubbytes = point_to_ser(pubpoint, comp=True)
-
         ebytes = hashlib.sha256(rbytes + pubbytes + message_hash).digest()
         e = int.from_bytes(ebytes, 'big')
 
@@ -220,4 +273,3 @@ def verify(pubkey, signature, message_hash):
             return False
 
         return (R.x().to_bytes(32, 'big') == rbytes)
-
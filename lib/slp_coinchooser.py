@@ -1,5 +1,70 @@
-from electroncash.util import NotEnoughFundsSlp, NotEnoughUnfrozenFundsSlp
-from electroncash import slp
+from .util import NotEnoughFundsSlp, NotEnoughUnfrozenFundsSlp
+from . import slp
+
+
+def find_exact_match(values, target, max_count, max_tries=20000):
+    ''' Looks for at most `max_count` of `values` (sorted largest first) that
+    add up to exactly `target`. Returns their indices, or None if there is
+    no such set or max_tries steps weren't enough to find it. Equal values
+    are interchangeable, so only the first of a run of them is ever skipped,
+    which keeps wallets holding many same-sized coins from blowing up the
+    search. '''
+    n = len(values)
+    prefix = [0]
+    for v in values:
+        prefix.append(prefix[-1] + v)
+    included = []  # the include/skip decision taken at each depth
+    total = count = 0
+    for _ in range(max_tries):
+        if total == target:
+            return [i for i, inc in enumerate(included) if inc]
+        d = len(included)
+        # the most the remaining picks could still add
+        reachable = prefix[min(n, d + max_count - count)] - prefix[d]
+        if total < target <= total + reachable:
+            included.append(True)
+            total += values[d]
+            count += 1
+            continue
+        # Unwind the trailing skips, then turn the last include into a skip
+        while included and not included[-1]:
+            included.pop()
+        if not included:
+            return None
+        included[-1] = False
+        total -= values[len(included) - 1]
+        count -= 1
+        while len(included) < n and values[len(included)] == values[len(included) - 1]:
+            included.append(False)
+    return None
+
+
+def choose_token_coins(coins, amount):
+    ''' Picks the fewest of `coins` whose 'token_value' covers `amount`,
+    preferring a set that matches it exactly so no token change output is
+    needed. Among equally good picks the coins carrying more BCH win, since
+    that BCH counts towards the fee. Returns (coins, token_change). '''
+    coins = sorted(coins, key=lambda c: (-c['token_value'], -c['value']))
+    total = 0
+    for k, coin in enumerate(coins, 1):
+        total += coin['token_value']
+        if total >= amount:
+            break
+    else:
+        raise NotEnoughFundsSlp("Not enough token funds.")
+
+    exact = find_exact_match([c['token_value'] for c in coins], amount, k)
+    if exact is not None:
+        return [coins[i] for i in exact], 0
+
+    # k - 1 largest coins plus the smallest one that tops them up
+    selected = coins[:k - 1]
+    need = amount - sum(c['token_value'] for c in selected)
+    last = min((c for c in coins[k - 1:] if c['token_value'] >= need),
+               key=lambda c: (c['token_value'], -c['value']))
+    selected.append(last)
+    return selected, sum(c['token_value'] for c in selected) - amount
+
 
 class SlpCoinChooser:
 
@@ -13,28 +78,23 @@ class SlpCoinChooser:
             amt = amount or 0
             token_outputs_amts.append(amt)
 
-        valid_bal, _, _, unfrozen_bal, _ = wallet.get_slp_token_balance(token_id, config)
+        # One pass over the token's coins serves both the balance checks and
+        # the selection (get_slp_coins only returns valid ones).
+        slp_coins = wallet.get_slp_coins(token_id, domain, config, isInvoice)
+        valid_bal = sum(c['token_value'] for c in slp_coins)
+        slp_coins = [c for c in slp_coins
+                     if not c['is_frozen_coin'] and c['address'] not in wallet.frozen_addresses]
+        unfrozen_bal = sum(c['token_value'] for c in slp_coins)
 
         if amt > valid_bal:
             raise NotEnoughFundsSlp("Not enough token funds.")
         if valid_bal >= amt > unfrozen_bal:
             raise NotEnoughUnfrozenFundsSlp("Not enough unfrozen token funds.")
 
-        slp_coins = wallet.get_slp_spendable_coins(token_id, domain, config, isInvoice)
-        slp_coins = sorted(slp_coins, key=lambda k: -k['token_value'])
-
         selected_slp_coins = []
-        total_amt_added = 0
-        for coin in slp_coins:
-            if total_amt_added < amt:
-                selected_slp_coins.append(coin)
-                total_amt_added += coin['token_value']
-            else:
-                break
-
         slp_op_return_msg = None
-        if total_amt_added > 0:
-            token_change = total_amt_added - amt
+        if amt > 0:
+            selected_slp_coins, token_change = choose_token_coins(slp_coins, amt)
             if token_change > 0:
                 token_outputs_amts.append(token_change)
             token_type = wallet.token_types[token_id]['class']
@@ -551,6 +551,7 @@ class ValidationJob:
                 else:
                     raise ValueError(errors)
             else:
+                Transaction.tx_cache_put(tx, txid)
                 dl_callback(tx)
 
         return txid_set
@@ -1034,16 +1035,14 @@ class Node:
 
         # at this point we have exhausted options for inactivation.
         # build connections to parents
-        txinputs = tx.inputs()
+        txinputs = tx.prevouts()
         if len(vin_mask) != len(txinputs):
             raise ValueError("input length mismatch")
 
         conn_parents = []
-        for vin, (mask, inp) in enumerate(zip(vin_mask, txinputs)):
+        for vin, (mask, (txid, vout)) in enumerate(zip(vin_mask, txinputs)):
             if not mask:
                 continue
-            txid = inp['prevout_hash']
-            vout = inp['prevout_n']
 
             p = self.graph.get_node(txid)
             c = Connection(p,self,vout,vin)
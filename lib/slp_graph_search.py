@@ -18,10 +18,8 @@ import weakref
 import collections
 import json
 import base64
-import requests
 import codecs
 from .transaction import Transaction
-from .caches import ExpiringCache
 
 class SlpdbErrorNoSearchData(Exception):
     pass
@@ -155,6 +153,7 @@ class SlpGraphSearchManager:
             print("[SLP Graph Search] Error: mainloop exited.", file=sys.stderr)
 
     def search_query(self, job):
+        import requests
         if job.waiting_to_cancel:
             job._cancel()
             return
@@ -198,37 +197,17 @@ class SlpGraphSearchManager:
         job.set_success()
         print("[SLP Graph Search] job success.")
 
-    # This cache stores foreign (non-wallet) tx's we fetched from the network
-    # for the purposes of the "fetch_input_data" mechanism. Its max size has
-    # been thoughtfully calibrated to provide a decent tradeoff between
-    # memory consumption and UX.
-    #
-    # In even aggressive/pathological cases this cache won't ever exceed
-    # 100MB even when full. [see ExpiringCache.size_bytes() to test it].
-    # This is acceptable considering this is Python + Qt and it eats memory
-    # anyway.. and also this is 2019 ;). Note that all tx's in this cache
-    # are in the non-deserialized state (hex encoded bytes only) as a memory
-    # savings optimization.  Please maintain that invariant if you modify this
-    # code, otherwise the cache may grow to 10x memory consumption if you
-    # put deserialized tx's in here.
-    _fetched_tx_cache = ExpiringCache(maxlen=100000, name="GraphSearchTxnFetchCache")
+    # Graph search results go into the process-wide tx store (see
+    # tx_store.py) shared with fetch_input_data and the rest, so a tx fetched
+    # by any of them needn't be downloaded again by the others.
 
     @classmethod
     def tx_cache_get(cls, txid: str) -> object:
-        ''' Attempts to retrieve txid from the tx cache that this class
-        keeps in-memory.  Returns None on failure. The returned tx is
-        not deserialized, and is a copy of the one in the cache. '''
-        tx = cls._fetched_tx_cache.get(txid)
-        if tx is not None and tx.raw:
-            # make sure to return a copy of the transaction from the cache
-            # so that if caller does .deserialize(), *his* instance will
-            # use up 10x memory consumption, and not the cached instance which
-            # should just be an undeserialized raw tx.
-            return Transaction(tx.raw)
-        return None
+        ''' Attempts to retrieve txid from the tx store. Returns None on
+        failure. The returned tx is not deserialized. '''
+        return Transaction.tx_cache_get(txid)
 
     @classmethod
-    def tx_cache_put(cls, tx: bytes, txid: str = None):
-        ''' Puts a non-deserialized copy of tx into the tx_cache. '''
-        txid = txid or Transaction._txid(tx.raw)  # optionally, caller can pass-in txid to save CPU time for hashing
-        cls._fetched_tx_cache.put(txid, tx)
+    def tx_cache_put(cls, tx: object, txid: str = None):
+        ''' Puts the raw bytes of tx into the tx store. '''
+        Transaction.tx_cache_put(tx, txid)
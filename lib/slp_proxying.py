@@ -15,7 +15,6 @@ import queue
 import traceback
 import weakref
 import collections
-import requests
 
 from .slp_dagging import INF_DEPTH
 
@@ -85,6 +84,7 @@ class ProxyQuerier:
         return txids
 
     def query(self,txids):
+        import requests
         requrl = 'https://tokengraph.network/verify/' + ','.join(sorted(txids))
 #        print(requrl, file=sys.stderr)
         reqresult = requests.get(requrl, timeout=3)
@@ -357,7 +357,7 @@ class Validator_SLP1(ValidatorGeneric):
             token_id_hex = slpMsg.op_return_fields['token_id_hex']
 
             # need to examine all inputs
-            vin_mask = (True,)*len(tx.inputs())
+            vin_mask = (True,)*len(tx.prevouts())
 
             # myinfo is the output sum
             # Note: according to consensus rules, we compute sum before truncating extra outputs.
@@ -369,7 +369,7 @@ class Validator_SLP1(ValidatorGeneric):
         elif slpMsg.transaction_type == 'GENESIS':
             token_id_hex = tx.txid_fast()
 
-            vin_mask = (False,)*len(tx.inputs()) # don't need to examine any inputs.
+            vin_mask = (False,)*len(tx.prevouts()) # don't need to examine any inputs.
 
             myinfo = 'GENESIS'
 
@@ -383,7 +383,7 @@ class Validator_SLP1(ValidatorGeneric):
         elif slpMsg.transaction_type == 'MINT':
             token_id_hex = slpMsg.op_return_fields['token_id_hex']
 
-            vin_mask = (True,)*len(tx.inputs()) # need to examine all vins, even for baton.
+            vin_mask = (True,)*len(tx.prevouts()) # need to examine all vins, even for baton.
 
             myinfo = 'MINT'
 
@@ -245,7 +245,7 @@ class Validator_NFT1(ValidatorGeneric):
             token_id_hex = slpMsg.op_return_fields['token_id_hex']
 
             # need to examine all inputs
-            vin_mask = (True,)*len(tx.inputs())
+            vin_mask = (True,)*len(tx.prevouts())
 
             # myinfo is the output sum
             # Note: according to consensus rules, we compute sum before truncating extra outputs.
@@ -265,7 +265,7 @@ class Validator_NFT1(ValidatorGeneric):
         elif slpMsg.transaction_type == 'GENESIS':
             token_id_hex = tx.txid_fast()
 
-            vin_mask = (False,)*len(tx.inputs()) # don't need to examine any inputs. #NOTE: may want to utilize this
+            vin_mask = (False,)*len(tx.prevouts()) # don't need to examine any inputs. #NOTE: may want to utilize this
 
             myinfo = 'GENESIS'
 
@@ -370,7 +370,7 @@ class Validator_NFT1(ValidatorGeneric):
                 nft_child_job.nft_parent_tx = tx
                 if done_callback:
                     done_callback(True)
-        nft_parent_txid = nft_child_job.genesis_tx.inputs()[0]['prevout_hash']
+        nft_parent_txid = nft_child_job.genesis_tx.prevouts()[0][0]
         requests = [('blockchain.transaction.get', [nft_parent_txid]), ]
         nft_child_job.network.send(requests, dl_cb)
 
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+# Electron Cash - A Bitcoin Cash SPV Wallet
+#
+# License: MIT License
+#
+''' Startup timing, enabled with `electron-cash --profile-startup`.
+
+The electron-cash script loads this module straight from its file and calls
+start() before anything else is imported (so it must only use the standard
+library). From then on every import made by the main thread is timed, and
+the various startup phases can be marked with mark(). finish() writes the
+report -- phases, the slowest modules by self time, and the full import
+tree -- to the file given to set_report_path() (startup_profile.txt in the
+Electron Cash data directory).
+
+All the module level functions are no-ops unless start() was called. '''
+import builtins
+import os
+import sys
+import threading
+import time
+from importlib.util import resolve_name
+
+
+class StartupProfiler:
+    ''' Wraps builtins.__import__ to time the imports of the main thread.
+    Only calls that actually load something are recorded; those that find
+    everything already in sys.modules only add to their caller's time. '''
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.thread_id = threading.get_ident()
+        self.imports = []  # (name, depth, self seconds, cumulative seconds), in completion order
+        self.marks = []  # (label, seconds since start)
+        self.stack = [0.0]  # time spent in nested imports, per active import call
+        self.orig_import = None
+
+    def install(self):
+        self.orig_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self.orig_import is not None and builtins.__import__ == self._import:
+            builtins.__import__ = self.orig_import
+
+    def elapsed(self):
+        return time.perf_counter() - self.t0
+
+    def mark(self, label):
+        self.marks.append((label, self.elapsed()))
+
+    @staticmethod
+    def _module_name(name, globals, fromlist, level):
+        if level:
+            package = (globals or {}).get('__package__') or ''
+            try:
+                name = resolve_name('.' * level + name, package) if name else package
+            except (ImportError, ValueError):
+                return name
+        # `from pkg import a, b` may load the submodules pkg.a and pkg.b
+        subs = [n for n in fromlist or () if isinstance(n, str) and (name + '.' + n) in sys.modules]
+        if len(subs) == 1:
+            return name + '.' + subs[0]
+        if subs:
+            return name + '.{' + ','.join(subs) + '}'
+        return name
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if threading.get_ident() != self.thread_id:
+            return self.orig_import(name, globals, locals, fromlist, level)
+        n_modules = len(sys.modules)
+        self.stack.append(0.0)
+        t = time.perf_counter()
+        try:
+            return self.orig_import(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.perf_counter() - t
+            nested = self.stack.pop()
+            self.stack[-1] += cumulative
+            if len(sys.modules) > n_modules:
+                self.imports.append((self._module_name(name, globals, fromlist, level),
+                                     len(self.stack) - 1, cumulative - nested, cumulative))
+
+    def report(self, top=40):
+        ''' The report, as a list of lines. '''
+        total = self.elapsed()
+        import_time = sum(t for name, depth, t, cum in self.imports)
+        lines = ["Electron Cash startup profile",
+                 "total {:.1f} ms, of which {:.1f} ms importing ({} import statements loaded modules)"
+                 .format(total * 1e3, import_time * 1e3, len(self.imports)),
+                 "", "Phases (ms since start, ms since previous):"]
+        prev = 0.0
+        for label, t in self.marks:
+            lines.append("{:10.1f} {:10.1f}  {}".format(t * 1e3, (t - prev) * 1e3, label))
+            prev = t
+        lines += ["", "Slowest imports (self ms, cumulative ms):"]
+        for name, depth, t, cum in sorted(self.imports, key=lambda x: -x[2])[:top]:
+            lines.append("{:10.1f} {:10.1f}  {}".format(t * 1e3, cum * 1e3, name))
+        # Imports complete innermost first; reverse to print each one before
+        # the nested imports it caused.
+        lines += ["", "Import tree (self ms, cumulative ms):"]
+        for name, depth, t, cum in reversed(self.imports):
+            lines.append("{:10.1f} {:10.1f}  {}{}".format(t * 1e3, cum * 1e3, '  ' * depth, name))
+        return lines
+
+
+_profiler = None
+_report_path = None
+
+
+def start():
+    ''' Starts profiling, if not already started. '''
+    global _profiler
+    if _profiler is None:
+        _profiler = StartupProfiler()
+        _profiler.install()
+    return _profiler
+
+
+def is_active():
+    return _profiler is not None
+
+
+def mark(label):
+    ''' Records that the startup phase `label` has been reached. '''
+    if _profiler is not None:
+        _profiler.mark(label)
+
+
+def set_report_path(path):
+    global _report_path
+    _report_path = path
+
+
+def finish(label='startup finished'):
+    ''' Stops profiling and writes the report. Returns the path written to,
+    or None if profiling was not active. '''
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    profiler.uninstall()
+    profiler.mark(label)
+    lines = profiler.report()
+    path = _report_path or os.path.join(os.getcwd(), 'startup_profile.txt')
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+    except OSError as e:
+        sys.stderr.write("Could not write startup profile to {}: {}\n".format(path, e))
+        path = None
+    sys.stderr.write("{} (profile: {})\n".format(lines[1], path))
+    return path
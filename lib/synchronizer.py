@@ -23,6 +23,7 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import deque
 from threading import Lock
 import hashlib
 import traceback
@@ -44,6 +45,13 @@ class Synchronizer(ThreadJob):
     External interface: __init__() and add() member functions.
     '''
 
+    # Address subscriptions are sent in batches of at most this many, and no
+    # new batch is sent while more than MAX_OUTSTANDING_SUBSCRIPTIONS are
+    # still unanswered. This keeps wallets with tens of thousands of
+    # addresses from flooding the network queues all at once.
+    SUBSCRIBE_BATCH_SIZE = 500
+    MAX_OUTSTANDING_SUBSCRIPTIONS = 2000
+
     def __init__(self, wallet, network):
         self.wallet = wallet
         self.network = network
@@ -54,6 +62,20 @@ class Synchronizer(ThreadJob):
         self.requested_tx = {}
         self.requested_histories = {}
         self.requested_hashes = set()
+        # Addresses waiting to be subscribed to, see send_subscriptions()
+        self.pending_subscriptions = deque()
+        # "Warm" addresses are those whose status the server confirmed last
+        # session (see Abstract_Wallet.load_address_statuses). They are
+        # subscribed to after all others, and until they are answered they
+        # don't keep us from being up to date: the wallet already has their
+        # histories.  Only those whose status changed get their history
+        # fetched.
+        self.pending_warm_subscriptions = deque()
+        self.requested_warm_hashes = set()
+        self.warm_stats = {'total': 0, 'unchanged': 0, 'changed': 0}
+        # Number of subscriptions in the current sync (for progress
+        # reporting).  Reset to 0 once all of them have been answered.
+        self.subscriptions_total = 0
         self.h2addr = {}
         self.lock = Lock()
         self.initialize()
@@ -70,7 +92,19 @@ class Synchronizer(ThreadJob):
 
     def is_up_to_date(self):
         return (not self.requested_tx and not self.requested_histories
-                and not self.requested_hashes)
+                and not self.requested_hashes and not self.pending_subscriptions)
+
+    def get_subscription_progress(self):
+        '''Returns a (done, total) tuple for the address subscriptions of the
+        sync currently in progress, or (0, 0) if there is none.'''
+        total = self.subscriptions_total
+        if not total:
+            return 0, 0
+        return total - self._num_unanswered_subscriptions(), total
+
+    def _num_unanswered_subscriptions(self):
+        return (len(self.pending_subscriptions) + len(self.requested_hashes)
+                + len(self.pending_warm_subscriptions) + len(self.requested_warm_hashes))
 
     def _release(self):
         ''' Called from the Network (DaemonThread) -- to prevent race conditions
@@ -94,19 +128,46 @@ class Synchronizer(ThreadJob):
         with self.lock:
             self.new_addresses.add(address)
 
-    def subscribe_to_addresses(self, addresses):
-        hashes = [addr.to_scripthash_hex() for addr in addresses]
-        # Keep a hash -> address mapping
-        self.h2addr.update({h:addr for h, addr in zip(hashes, addresses)})
-        self.network.subscribe_to_scripthashes(hashes, self.on_address_status)
-        self.requested_hashes |= set(hashes)
+    def subscribe_to_addresses(self, addresses, *, warm=False):
+        '''Queues the addresses for subscription. They are actually sent in
+        batches by send_subscriptions().'''
+        if warm:
+            self.pending_warm_subscriptions.extend(addresses)
+            self.warm_stats['total'] += len(addresses)
+        else:
+            self.pending_subscriptions.extend(addresses)
+        self.subscriptions_total += len(addresses)
+        self.send_subscriptions()
 
-    def get_status(self, h):
+    def send_subscriptions(self):
+        sent = 0
+        while len(self.requested_hashes) + len(self.requested_warm_hashes) < self.MAX_OUTSTANDING_SUBSCRIPTIONS:
+            if self.pending_subscriptions:
+                pending, requested = self.pending_subscriptions, self.requested_hashes
+            elif self.pending_warm_subscriptions:
+                pending, requested = self.pending_warm_subscriptions, self.requested_warm_hashes
+            else:
+                break
+            n = min(self.SUBSCRIBE_BATCH_SIZE, len(pending))
+            addresses = [pending.popleft() for _ in range(n)]
+            hashes = [addr.to_scripthash_hex() for addr in addresses]
+            # Keep a hash -> address mapping
+            self.h2addr.update({h:addr for h, addr in zip(hashes, addresses)})
+            self.network.subscribe_to_scripthashes(hashes, self.on_address_status)
+            requested |= set(hashes)
+            sent += n
+        if sent and self.subscriptions_total > self.SUBSCRIBE_BATCH_SIZE:
+            done, total = self.get_subscription_progress()
+            self.print_error("subscribing to addresses: {}/{} done, {} more sent".format(done, total, sent))
+
+    @staticmethod
+    def get_status(h):
+        '''Returns the status hash for history h, computed from scratch.
+        The synchronizer itself uses the wallet's cached
+        get_address_status() instead.'''
         if not h:
             return None
-        status = ''
-        for tx_hash, height in h:
-            status += tx_hash + ':%d:' % height
+        status = ''.join('%s:%d:' % (tx_hash, height) for tx_hash, height in h)
         return bh2u(hashlib.sha256(status.encode('ascii')).digest())
 
     def on_address_status(self, response):
@@ -121,12 +182,19 @@ class Synchronizer(ThreadJob):
         addr = self.h2addr.get(scripthash, None)
         if not addr:
             return  # Bad server response?
-        history = self.wallet.get_address_history(addr)
-        if self.get_status(history) != result:
+        changed = self.wallet.get_address_status(addr) != result
+        if changed:
             if self.requested_histories.get(scripthash) is None:
                 self.requested_histories[scripthash] = result
                 self.network.request_scripthash_history(scripthash,
                                                         self.on_address_history)
+        else:
+            self.wallet.set_address_server_status(addr, result)
+        if scripthash in self.requested_warm_hashes:
+            self.requested_warm_hashes.discard(scripthash)
+            self.warm_stats['changed' if changed else 'unchanged'] += 1
+            if not self.pending_warm_subscriptions and not self.requested_warm_hashes:
+                self.print_error("warm start: {unchanged} of {total} previously synchronized addresses unchanged, {changed} needed their history fetched".format(**self.warm_stats))
         # remove addr from list only after it is added to requested_histories
         self.requested_hashes.discard(scripthash)  # Notifications won't be in
 
@@ -156,11 +224,12 @@ class Synchronizer(ThreadJob):
             self.print_error("error: server history has non-unique txids: {}"
                              .format(addr))
         # Check that the status corresponds to what was announced
-        elif self.get_status(hist) != server_status:
+        elif self.wallet.get_address_status(addr, hist) != server_status:
             self.print_error("error: status mismatch: {}".format(addr))
         else:
             # Store received history
             self.wallet.receive_history_callback(addr, hist, tx_fees)
+            self.wallet.set_address_server_status(addr, server_status)
             # Request transactions we don't have
             self.request_missing_txs(hist)
 
@@ -228,7 +297,15 @@ class Synchronizer(ThreadJob):
 
         if self.requested_tx:
             self.print_error("missing tx", self.requested_tx)
-        self.subscribe_to_addresses(self.wallet.get_addresses())
+        known_statuses = self.wallet.get_address_server_statuses()
+        addresses, warm_addresses = [], []
+        for addr in self.wallet.get_addresses():
+            (warm_addresses if addr in known_statuses else addresses).append(addr)
+        if warm_addresses:
+            self.print_error("warm start: {} of {} addresses have a known status from last session"
+                             .format(len(warm_addresses), len(warm_addresses) + len(addresses)))
+        self.subscribe_to_addresses(addresses)
+        self.subscribe_to_addresses(warm_addresses, warm=True)
 
     def run(self):
         '''Called from the network proxy thread main loop.'''
@@ -246,6 +323,9 @@ class Synchronizer(ThreadJob):
                 self.new_addresses = set()
             if addresses:
                 self.subscribe_to_addresses(addresses)
+            self.send_subscriptions()
+            if self.subscriptions_total and not self._num_unanswered_subscriptions():
+                self.subscriptions_total = 0  # all answered, progress is complete
 
             # 3. Detect if situation has changed
             up_to_date = self.is_up_to_date()
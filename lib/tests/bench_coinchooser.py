@@ -0,0 +1,61 @@
+'''
+Benchmark for the coin choosers over synthetic UTXO sets.
+
+Run with:  python3 -m electroncash.tests.bench_coinchooser [num_coins ...]
+
+For each UTXO set size, times make_tx() for every chooser in
+coinchooser.COIN_CHOOSERS paying a few different amounts, and reports the
+number of inputs, whether change was needed and the fee paid.
+'''
+import sys
+import time
+
+from .. import coinchooser
+from ..address import Address
+from ..bitcoin import TYPE_ADDRESS, sha256
+from ..util import bh2u
+
+PUBKEY = '02' + '11' * 32
+DUST_THRESHOLD = 546
+SIZES = (100, 1000, 10000)
+
+
+def fee_estimator(size):
+    return size  # 1 sat/byte
+
+
+def make_coins(count, seed=b'bench'):
+    '''Deterministic pseudo-random p2pkh coins, some addresses holding
+    several of them.'''
+    coins = []
+    for i in range(count):
+        h = sha256(seed + i.to_bytes(4, 'little'))
+        value = 546 + int.from_bytes(h[:4], 'little') % 5000000
+        addr = Address.from_P2PKH_hash(sha256(h[4:8] + bytes([i % 7]))[:20])
+        coins.append({'prevout_hash': bh2u(h), 'prevout_n': i % 4, 'value': value,
+                      'address': addr, 'type': 'p2pkh', 'x_pubkeys': [PUBKEY],
+                      'pubkeys': [PUBKEY], 'num_sig': 1, 'signatures': [None]})
+    return coins
+
+
+def bench(sizes=SIZES, amounts=(10000, 1234567, 25000000)):
+    dest = Address.from_P2PKH_hash(b'\x01' * 20)
+    change = Address.from_P2PKH_hash(b'\x02' * 20)
+    results = []
+    for size in sizes:
+        coins = make_coins(size)
+        for name, klass in sorted(coinchooser.COIN_CHOOSERS.items()):
+            for amount in amounts:
+                outputs = [(TYPE_ADDRESS, dest, amount)]
+                start = time.time()
+                tx = klass().make_tx(list(coins), outputs, [change], fee_estimator, DUST_THRESHOLD)
+                secs = time.time() - start
+                results.append((size, name, amount, secs))
+                print("{:>6} coins  {:<15} {:>9} sat  {:8.1f} ms  {:>3} inputs  {:<9} fee {}".format(
+                    size, name, amount, secs * 1e3, len(tx.inputs()),
+                    'change' if len(tx.outputs()) > 1 else 'no change', tx.get_fee()))
+    return results
+
+
+if __name__ == '__main__':
+    bench([int(x) for x in sys.argv[1:]] or SIZES)
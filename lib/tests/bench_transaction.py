@@ -0,0 +1,55 @@
+'''
+Microbenchmark for transaction deserialization.
+
+Run with:  python3 -m electroncash.tests.bench_transaction [iterations]
+
+Compares the full `transaction.deserialize()` against the lazy `TxView`
+decoding just the outputs or just the input outpoints, over a small corpus of
+real mainnet transactions of different shapes.
+'''
+import sys
+import timeit
+
+from .. import transaction
+from .test_transaction import signed_blob, v2_blob, nonmin_blob
+
+CORPUS = [
+    signed_blob,
+    v2_blob,
+    nonmin_blob,
+    # coinbase to p2pk
+    '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff4103400d0302ef02062f503253482f522cfabe6d6dd90d39663d10f8fd25ec88338295d4c6ce1c90d4aeb368d8bdbadcc1da3b635801000000000000000474073e03ffffffff013c25cf2d01000000434104b0bd634234abbb1ba1e986e884185c61cf43e001f9137f23c2c409273eb16e6537a576782eba668a7ef8bd3b3cfb1edb7117ab65129b8a2e681f3c1e0908ef7bac00000000',
+    # p2pk to p2pkh
+    '010000000118231a31d2df84f884ced6af11dc24306319577d4d7c340124a7e2dd9c314077000000004847304402200b6c45891aed48937241907bc3e3868ee4c792819821fcde33311e5a3da4789a02205021b59692b652a01f5f009bd481acac2f647a7d9c076d71d85869763337882e01fdffffff016c95052a010000001976a9149c4891e7791da9e622532c97f43863768264faaf88ac00000000',
+    # p2pkh to p2sh + p2pkh
+    '010000000195232c30f6611b9f2f82ec63f5b443b132219c425e1824584411f3d16a7a54bc000000006b4830450221009f39ac457dc8ff316e5cc03161c9eff6212d8694ccb88d801dbb32e85d8ed100022074230bb05e99b85a6a50d2b71e7bf04d80be3f1d014ea038f93943abd79421d101210317be0f7e5478e087453b9b5111bdad586038720f16ac9658fd16217ffd7e5785fdffffff0200e40b540200000017a914d81df3751b9e7dca920678cc19cac8d7ec9010b08718dfd63c2c0000001976a914303c42b63569ff5b390a2016ff44651cd84c7c8988acc7010000',
+    # 2-of-3 p2sh to 2x p2sh
+    '01000000018695eef2250b3a3b6ef45fe065e601610e69dd7a56de742092d40e6276e6c9ec00000000fdfd000047304402203199bf8e49f7203e8bcbfd754aa356c6ba61643a3490f8aef3888e0aaa7c048c02201e7180bfd670f4404e513359b4020fbc85d6625e3e265e0c357e8611f11b83e401483045022100e60f897db114679f9a310a032a22e9a7c2b8080affe2036c480ff87bf6f45ada02202dbd27af38dd97d418e24d89c3bb7a97e359dd927c1094d8c9e5cac57df704fb014c69522103adc563b9f5e506f485978f4e913c10da208eac6d96d49df4beae469e81a4dd982102c52bc9643a021464a31a3bfa99cfa46afaa4b3acda31e025da204b4ee44cc07a2103a1c8edcc3310b3d7937e9e4179e7bd9cdf31c276f985f4eb356f21b874225eb153aeffffffff02b8ce05000000000017a9145c9c158430b7b79c3ad7ef9bdf981601eda2412d87b82400000000000017a9146bf3ff89019ecc5971a39cdd4f1cabd3b647ad5d8700000000',
+]
+
+
+def bench(iterations=2000):
+    def full():
+        for raw in CORPUS:
+            transaction.deserialize(raw)
+
+    def view_outputs():
+        for raw in CORPUS:
+            transaction.TxView(raw).outputs()
+
+    def view_prevouts():
+        for raw in CORPUS:
+            transaction.TxView(raw).prevouts()
+
+    results = []
+    for name, func in (('deserialize', full),
+                       ('TxView.outputs', view_outputs),
+                       ('TxView.prevouts', view_prevouts)):
+        secs = timeit.timeit(func, number=iterations)
+        results.append((name, secs))
+        print("{:<16} {:8.1f} us/tx".format(name, secs * 1e6 / (iterations * len(CORPUS))))
+    return results
+
+
+if __name__ == '__main__':
+    bench(*(int(x) for x in sys.argv[1:2]))
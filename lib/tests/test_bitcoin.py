@@ -11,7 +11,7 @@ from ..bitcoin import (
     is_private_key, xpub_from_xprv, is_new_seed, is_old_seed,
     var_int, op_push, regenerate_key,
     verify_message, deserialize_privkey, serialize_privkey,
-    is_minikey, is_compressed, is_xpub,
+    is_minikey, is_compressed, is_xpub, deserialize_xpub, CKD_pub, CKD_pub_batch,
     xpub_type, is_xprv, is_bip32_derivation, seed_type, Bip38Key)
 from ..networks import set_mainnet, set_testnet
 from ..util import bfh
@@ -197,6 +197,16 @@ class Test_xprv_xpub(unittest.TestCase):
         self.assertEqual("xpub6FnCn6nSzZAw5Tw7cgR9bi15UV96gLZhjDstkXXxvCLsUXBGXPdSnLFbdpq8p9HmGsApME5hQTZ3emM2rnY5agb9rXpVGyy3bdW6EEgAtqt", xpub)
         self.assertEqual("xprvA2nrNbFZABcdryreWet9Ea4LvTJcGsqrMzxHx98MMrotbir7yrKCEXw7nadnHM8Dq38EGfSh6dqA9QWTyefMLEcBYJUuekgW4BYPJcr9E7j", xprv)
 
+    def test_ckd_pub_batch(self):
+        _, _, _, _, c, cK = deserialize_xpub(self.xprv_xpub[0]['xpub'])
+        indices = [0, 1, 2, 1000, 0x7fffffff]
+        expected = [CKD_pub(cK, c, n) for n in indices]
+        self.assertEqual(expected, CKD_pub_batch(cK, c, indices))
+        self.assertEqual(expected, CKD_pub_batch(cK, c, indices, max_workers=4))
+        self.assertEqual([], CKD_pub_batch(cK, c, []))
+        with self.assertRaises(ValueError):
+            CKD_pub_batch(cK, c, [0x80000000])
+
     def test_xpub_from_xprv(self):
         """We can derive the xpub key from a xprv."""
         for xprv_details in self.xprv_xpub:
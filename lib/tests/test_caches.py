@@ -0,0 +1,68 @@
+import time
+import unittest
+
+from ..caches import ExpiringCache, cache_stats
+from ..commands import Commands
+
+
+class TestExpiringCache(unittest.TestCase):
+
+    def test_lru_evicts_on_put(self):
+        c = ExpiringCache(maxlen=3, name="test lru")
+        for i in range(3):
+            c.put(i, str(i))
+        self.assertEqual(c.get(0), '0')  # 1 is now the least recently used
+        c.put(3, '3')
+        self.assertEqual(len(c), 3)
+        self.assertIsNone(c.get(1))
+        self.assertEqual(c.get(2, 'x'), '2')
+        self.assertEqual(list(c.copy_dict()), [0, 3, 2])
+        # re-putting an existing key doesn't evict anything
+        c.put(0, 'zero')
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c.get(0), 'zero')
+
+    def test_byte_budget(self):
+        c = ExpiringCache(maxlen=100, maxbytes=10, sizeof=len, name="test bytes")
+        c.put('a', b'1234')
+        c.put('b', b'1234')
+        self.assertEqual(c.size_bytes(), 8)
+        c.put('c', b'1234')
+        self.assertEqual(c.size_bytes(), 8)
+        self.assertIsNone(c.get('a'))
+        c.put('b', b'12')
+        self.assertEqual(c.size_bytes(), 6)
+        # a single oversized item is kept, but pushes out everything else
+        c.put('d', b'x' * 20)
+        self.assertEqual(list(c.copy_dict()), ['d'])
+        self.assertEqual(c.size_bytes(), 20)
+
+    def test_timeout(self):
+        c = ExpiringCache(maxlen=100, timeout=0.25, name="test timeout")
+        c.put('a', 1)
+        self.assertEqual(c.get('a'), 1)
+        time.sleep(0.3)
+        c.put('b', 2)  # expires 'a' from the LRU end
+        self.assertEqual(len(c), 1)
+        self.assertIsNone(c.get('a'))
+        time.sleep(0.3)
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(len(c), 0)
+
+    def test_stats(self):
+        c = ExpiringCache(maxlen=1, name="test stats")
+        c.put(1, 1)
+        c.get(1)
+        c.get(2)
+        c.put(2, 2)
+        st = c.stats()
+        self.assertEqual((st['hits'], st['misses'], st['evictions']), (1, 1, 1))
+        self.assertEqual(st['hit_rate'], 0.5)
+        self.assertIn(st, cache_stats())
+        c.reset_stats()
+        self.assertEqual(c.stats()['hits'], 0)
+        names = [s['name'] for s in Commands(None, None, None).cachestats()]
+        self.assertIn("test stats", names)
+        self.assertIn("TxStore", names)
+        ExpiringCache(name="test unregistered", register=False)
+        self.assertNotIn("test unregistered", [s['name'] for s in cache_stats()])
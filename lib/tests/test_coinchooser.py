@@ -0,0 +1,91 @@
+import unittest
+
+from .. import coinchooser
+from ..address import Address
+from ..bitcoin import TYPE_ADDRESS
+from ..util import NotEnoughFunds
+from .bench_coinchooser import make_coins, fee_estimator, DUST_THRESHOLD
+
+
+class TestCoinChooserBnB(unittest.TestCase):
+
+    dest = Address.from_P2PKH_hash(b'\x01' * 20)
+    change = Address.from_P2PKH_hash(b'\x02' * 20)
+
+    def _make_tx(self, coins, amount, **kwargs):
+        outputs = [(TYPE_ADDRESS, self.dest, amount)]
+        return coinchooser.CoinChooserBnB().make_tx(list(coins), outputs, [self.change],
+                                                   fee_estimator, DUST_THRESHOLD, **kwargs)
+
+    def test_change_free_match(self):
+        coins = make_coins(8)
+        # two coins, less the fee of a 2-in 1-out tx, pays exactly
+        a, b = coins[2], coins[5]
+        amount = a['value'] + b['value'] - 374
+        tx = self._make_tx(coins, amount)
+        self.assertEqual(1, len(tx.outputs()))
+        self.assertEqual({a['prevout_hash'], b['prevout_hash']},
+                         {txin['prevout_hash'] for txin in tx.inputs()})
+        self.assertGreaterEqual(tx.get_fee(), fee_estimator(tx.estimated_size()))
+
+    def test_fallback_with_change(self):
+        coins = make_coins(200)
+        for amount in (1000, 3000000, 50000000):
+            tx = self._make_tx(coins, amount)
+            self.assertEqual(amount, tx.outputs()[0][2])
+            self.assertGreaterEqual(tx.get_fee(), fee_estimator(tx.estimated_size()))
+            self.assertLessEqual(tx.get_fee(), fee_estimator(tx.estimated_size()) + 34 + DUST_THRESHOLD)
+
+    def test_same_address_spent_together(self):
+        coins = make_coins(50)
+        addr = coins[0]['address']
+        tx = self._make_tx(coins, 1000000)
+        spent = [txin for txin in tx.inputs() if txin['address'] == addr]
+        if spent:
+            self.assertEqual(len(spent), sum(1 for c in coins if c['address'] == addr))
+
+    def test_mandatory_coins(self):
+        coins = make_coins(20)
+        mandatory = coins[:2]
+        tx = self._make_tx(coins, 1000, mandatory_coins=mandatory)
+        outpoints = [(txin['prevout_hash'], txin['prevout_n']) for txin in tx.inputs()]
+        self.assertEqual(len(outpoints), len(set(outpoints)))
+        for c in mandatory:
+            self.assertIn((c['prevout_hash'], c['prevout_n']), outpoints)
+
+    def test_not_enough_funds(self):
+        coins = make_coins(5)
+        with self.assertRaises(NotEnoughFunds):
+            self._make_tx(coins, sum(c['value'] for c in coins))
+
+    def test_deterministic(self):
+        coins = make_coins(300)
+        first = self._make_tx(coins, 4000000)
+        second = self._make_tx(list(reversed(coins)), 4000000)
+        self.assertEqual(sorted(i['prevout_hash'] for i in first.inputs()),
+                         sorted(i['prevout_hash'] for i in second.inputs()))
+
+    def test_get_coin_chooser(self):
+        self.assertIsInstance(coinchooser.get_coin_chooser({}), coinchooser.CoinChooserPrivacy)
+        self.assertIsInstance(coinchooser.get_coin_chooser({'coin_chooser': 'bogus'}),
+                              coinchooser.CoinChooserPrivacy)
+        self.assertIsInstance(coinchooser.get_coin_chooser({'coin_chooser': 'BranchAndBound'}),
+                              coinchooser.CoinChooserBnB)
+
+    def test_reuse_selection(self):
+        coins = make_coins(100)
+        outputs = [(TYPE_ADDRESS, self.dest, 3000000)]
+        chooser = coinchooser.CoinChooserBnB()
+        tx = chooser.make_tx(list(coins), outputs, [self.change], fee_estimator, DUST_THRESHOLD)
+        selected, seed = chooser.selected, chooser.seed
+        self.assertEqual(len(selected), len(tx.inputs()))
+
+        higher_fee = lambda size: size + 10
+        tx2 = coinchooser.CoinChooserBnB().reuse_selection(selected, seed, outputs, [self.change],
+                                                           higher_fee, DUST_THRESHOLD)
+        self.assertEqual([i['prevout_hash'] for i in tx.inputs()], [i['prevout_hash'] for i in tx2.inputs()])
+        self.assertGreaterEqual(tx2.get_fee(), higher_fee(tx2.estimated_size()))
+
+        huge_fee = lambda size: 10 ** 12
+        self.assertIsNone(coinchooser.CoinChooserBnB().reuse_selection(selected, seed, outputs, [self.change],
+                                                                        huge_fee, DUST_THRESHOLD))
@@ -2,6 +2,12 @@ import unittest
 from decimal import Decimal as PyDecimal
 
 from ..commands import Commands
+from ..simple_config import SimpleConfig
+from ..storage import WalletStorage
+from ..transaction import Transaction
+from .. import wallet
+from .test_transaction import signed_blob, v2_blob
+from .test_wallet import WalletTestCase
 
 
 class TestCommands(unittest.TestCase):
@@ -31,3 +37,58 @@ class TestCommands(unittest.TestCase):
         self.assertEqual("2asd", Commands._setconfig_normalize_value('rpcpassword', '2asd'))
         self.assertEqual("['file:///var/www/','https://electrum.org']",
             Commands._setconfig_normalize_value('rpcpassword', "['file:///var/www/','https://electrum.org']"))
+
+
+class TestPagination(WalletTestCase):
+
+    def setUp(self):
+        super().setUp()
+        txs = [Transaction(signed_blob), Transaction(v2_blob)]
+        addrs = [addr for tx in txs for _type, addr, v in tx.outputs()]
+        w = wallet.ImportedAddressWallet.from_text(WalletStorage(self.wallet_path),
+                                                   ' '.join(a.to_ui_string() for a in addrs))
+        for height, tx in enumerate(txs, 100):
+            w.add_transaction(tx.txid(), tx)
+            for _type, addr, v in tx.outputs():
+                w._history.setdefault(addr, []).append((tx.txid(), height))
+        self.commands = Commands(SimpleConfig({'electron_cash_path': self.user_dir}), w, None)
+        Commands._open_pages.clear()
+
+    def assertPagesMatch(self, method, **kwargs):
+        func = getattr(self.commands, method)
+        full = func(**kwargs)
+        items, after = [], None
+        while True:
+            page = func(limit=2, after=after, **kwargs)
+            self.assertLessEqual(len(page['items']), 2)
+            items += page['items']
+            after = page['next']
+            if after is None:
+                break
+        self.assertEqual(full, items)
+        return full
+
+    def test_pages_add_up_to_full_listing(self):
+        self.assertEqual(len(self.assertPagesMatch('listunspent')), 3)
+        self.assertEqual(len(self.assertPagesMatch('listaddresses', balance=True)), 3)
+        self.assertEqual(len(self.assertPagesMatch('history')), 2)
+        self.assertEqual(self.commands.history(limit=5)['next'], None)
+
+    def test_pages_resume_one_listing(self):
+        w = self.commands.wallet
+        calls = []
+        get_history = w.get_history
+        w.get_history = lambda *args, **kwargs: calls.append(1) or get_history(*args, **kwargs)
+        page = self.commands.history(limit=1)
+        self.assertEqual(self.commands.history(limit=1, after=page['next'])['next'], None)
+        self.assertEqual(len(calls), 1)
+        # a cursor this process didn't hand out still works, from scratch
+        Commands._open_pages.clear()
+        self.assertEqual(len(self.commands.history(limit=1, after=page['next'])['items']), 1)
+        self.assertEqual(len(calls), 2)
+
+    def test_unknown_cursor(self):
+        with self.assertRaises(ValueError):
+            self.commands.history(limit=1, after='00' * 32)
+        with self.assertRaises(ValueError):
+            self.commands.listunspent(limit=1, after='00' * 32 + ':0')
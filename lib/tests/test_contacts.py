@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+
+from dns.exception import DNSException
+
+from .. import dnssec
+from ..contacts import Contacts
+
+
+class FakeStorage(dict):
+
+    def put(self, key, value):
+        self[key] = value
+
+
+class FakeTXT:
+
+    def __init__(self, string):
+        self.strings = [string.encode('utf-8')]
+
+
+class TestOpenAliasCache(unittest.TestCase):
+
+    def setUp(self):
+        Contacts._openalias_cache.clear()
+        self.contacts = Contacts(FakeStorage())
+
+    def tearDown(self):
+        Contacts._openalias_cache.clear()
+
+    def test_resolved_aliases_are_cached(self):
+        record = FakeTXT('oa1:bch recipient_address=1BoatSLRHtKNngkdXEeobR76b53LETtpyT; recipient_name=Satoshi;')
+        with mock.patch.object(dnssec, 'query', return_value=([record], True)) as query:
+            for _ in range(2):
+                address, name, validated = self.contacts.resolve_openalias('satoshi@example.com')
+                self.assertEqual(address.to_storage_string(), '1BoatSLRHtKNngkdXEeobR76b53LETtpyT')
+                self.assertEqual((name, validated), ('Satoshi', True))
+            self.assertEqual(query.call_count, 1)
+            self.assertEqual(self.contacts.resolve('satoshi.example.com')['name'], 'Satoshi')
+            self.assertEqual(query.call_count, 1)
+
+    def test_failures_are_not_cached(self):
+        with mock.patch.object(dnssec, 'query', side_effect=DNSException) as query:
+            self.assertIsNone(self.contacts.resolve_openalias('nobody.example.com'))
+            self.assertIsNone(self.contacts.resolve_openalias('nobody.example.com'))
+            self.assertEqual(query.call_count, 2)
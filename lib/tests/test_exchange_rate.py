@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime
+
+from ..exchange_rate import ExchangeBase, HistoricalRates
+
+
+class FakeExchange(ExchangeBase):
+
+    def __init__(self, responses):
+        super().__init__(lambda: None, lambda: None)
+        self.responses = responses
+        self.requests = []
+
+    def history_ccys(self):
+        return ['USD']
+
+    def request_history(self, ccy, since=None):
+        self.requests.append(since)
+        return self.responses.pop(0)
+
+
+class TestHistoricalRates(unittest.TestCase):
+
+    def test_lookups(self):
+        t = HistoricalRates({'2019-01-02': 150.5, '2019-01-01': '140', '2019-01-05': None})
+        self.assertEqual(len(t), 2)
+        day = HistoricalRates.day_of('2019-01-01')
+        self.assertEqual(day, date(2019, 1, 1).toordinal())
+        self.assertEqual(t.get(day), 140.0)
+        self.assertIsNone(t.get(day + 3))
+        self.assertEqual(t.get_many([day + 1, day - 1, day, day + 1, day + 30]),
+                         [150.5, None, 140.0, 150.5, None])
+        t.update({'2019-01-02': 151, '2019-01-03': 160})
+        self.assertEqual(t.last_day(), day + 2)
+        self.assertEqual(t.to_dict(), {'2019-01-01': 140.0, '2019-01-02': 151.0, '2019-01-03': 160.0})
+
+    def test_incremental_refresh(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        ex = FakeExchange([{'2019-01-01': 140, '2019-01-02': 150},
+                           {'2019-01-02': 155, '2019-01-03': 160}])
+        ex.get_historical_rates_safe('USD', cache_dir)
+        self.assertEqual(ex.requests, [None])
+        # the cache file is fresh: no request
+        ex.get_historical_rates_safe('USD', cache_dir)
+        self.assertEqual(ex.requests, [None])
+        # once it's old, only the days from the last one on are asked for
+        filename = ex._get_cache_filename('USD', cache_dir)
+        os.utime(filename, (0, 0))
+        ex.get_historical_rates_safe('USD', cache_dir)
+        self.assertEqual(ex.requests, [None, HistoricalRates.day_of('2019-01-02')])
+        self.assertEqual(ex.historical_rate('USD', datetime(2019, 1, 2, 15)), 155.0)
+        self.assertEqual(ex.historical_rates('USD', [HistoricalRates.day_of('2019-01-0%d' % i) for i in (1, 3)]),
+                         [140.0, 160.0])
+        self.assertEqual(ex.read_historical_rates('USD', cache_dir)[0],
+                         {'2019-01-01': 140.0, '2019-01-02': 155.0, '2019-01-03': 160.0})
@@ -1,3 +1,6 @@
+import asyncio
+import json
+import queue
 import unittest
 
 from .. import interface
@@ -24,3 +27,52 @@ class TestInterface(unittest.TestCase):
         self.assertTrue(i.check_host_name(
             peercert={'subject': [('commonName', 'foo.bar.com')]},
             name='foo.bar.com'))
+
+
+class TestAsyncInterface(unittest.TestCase):
+
+    @staticmethod
+    async def _echo_server(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            req = json.loads(line.decode('utf8'))
+            writer.write((json.dumps({'id': req['id'], 'result': req['params']}) + '\n').encode('utf8'))
+            writer.write(b'garbage\n')
+            writer.write((json.dumps({'method': 'blockchain.headers.subscribe', 'params': [{'height': 1}]}) + '\n').encode('utf8'))
+        writer.close()
+
+    def test_roundtrip(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._test_roundtrip(loop))
+        finally:
+            loop.close()
+
+    async def _test_roundtrip(self, loop):
+        srv = await asyncio.start_server(self._echo_server, '127.0.0.1', 0)
+        port = srv.sockets[0].getsockname()[1]
+        q = queue.Queue()
+        conn = interface.AsyncConnection('127.0.0.1:{}:t'.format(port), q, None)
+        await conn.start(loop)
+        server, streams = q.get_nowait()
+        self.assertIsNotNone(streams)
+
+        wakeup = asyncio.Event()
+        i = interface.AsyncInterface(server, streams, loop=loop, wakeup=wakeup.set)
+        i.queue_request('server.version', ['x', '1.4'], 1)
+        self.assertTrue(i.send_requests())
+        responses = []
+        while len(responses) < 2:
+            await asyncio.wait_for(wakeup.wait(), 5)
+            wakeup.clear()
+            responses += i.get_responses()
+        self.assertEqual((('server.version', ['x', '1.4'], 1), {'id': 1, 'result': ['x', '1.4']}), responses[0])
+        self.assertEqual((None, {'method': 'blockchain.headers.subscribe', 'params': [{'height': 1}]}), responses[1])
+        self.assertEqual({}, i.unanswered_requests)
+
+        i.close()
+        await asyncio.sleep(0.05)  # let the server see the EOF
+        srv.close()
+        await srv.wait_closed()
@@ -0,0 +1,116 @@
+import base64
+import http.client
+import json
+import threading
+import time
+import unittest
+
+from ..jsonrpc import VerifyingJSONRPCServer
+
+
+class TestVerifyingJSONRPCServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = VerifyingJSONRPCServer(('127.0.0.1', 0), logRequests=False,
+                                             rpc_user='user', rpc_password='pass',
+                                             num_threads=4, idle_timeout=2.0)
+        self.server.timeout = 0.1
+        self.server.register_function(lambda x: x * 2, 'double')
+        self.server.register_function(lambda secs: time.sleep(secs) or secs, 'sleep')
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.running = False
+        self.thread.join()
+        self.server.server_close()
+
+    def serve(self):
+        while self.running:
+            self.server.handle_request()
+
+    def connect(self):
+        return http.client.HTTPConnection(*self.server.socket.getsockname(), timeout=5)
+
+    def post(self, conn, payload, auth=('user', 'pass')):
+        headers = {'Content-Type': 'application/json'}
+        if auth:
+            token = base64.b64encode('{}:{}'.format(*auth).encode('utf8')).decode('ascii')
+            headers['Authorization'] = 'Basic ' + token
+        conn.request('POST', '/', json.dumps(payload), headers)
+        resp = conn.getresponse()
+        body = resp.read()
+        return resp.status, json.loads(body.decode('utf8')) if body and resp.status == 200 else None
+
+    def call(self, method, params, id=1):
+        return {'jsonrpc': '2.0', 'method': method, 'params': params, 'id': id}
+
+    def test_auth(self):
+        conn = self.connect()
+        self.assertEqual(self.post(conn, self.call('double', [2]), auth=None)[0], 401)
+        conn = self.connect()
+        self.assertEqual(self.post(conn, self.call('double', [2]), auth=('user', 'wrong'))[0], 401)
+        conn = self.connect()
+        self.assertEqual(self.post(conn, self.call('double', [2])), (200, {'jsonrpc': '2.0', 'id': 1, 'result': 4}))
+
+    def test_keep_alive_and_batch(self):
+        conn = self.connect()
+        for i in range(3):
+            status, resp = self.post(conn, self.call('double', [i], id=i))
+            self.assertEqual(resp['result'], 2 * i)
+        sock = conn.sock
+        status, resp = self.post(conn, [self.call('double', [1], id=1), self.call('double', [5], id=2),
+                                         self.call('nonexistent', [], id=3)])
+        self.assertIs(conn.sock, sock)  # same connection throughout
+        self.assertEqual([r['id'] for r in resp], [1, 2, 3])
+        self.assertEqual([r.get('result') for r in resp[:2]], [2, 10])
+        self.assertEqual(resp[2]['error']['code'], -32601)
+        stats = self.server.get_stats()
+        self.assertEqual(stats['double']['count'], 5)
+        self.assertEqual(stats['double']['errors'], 0)
+        self.assertEqual(stats['<unknown>']['errors'], 1)
+
+    def test_slow_call_does_not_block_others(self):
+        def slow():
+            self.post(self.connect(), self.call('sleep', [1.0]))
+        t = threading.Thread(target=slow)
+        t.start()
+        time.sleep(0.2)
+        t0 = time.time()
+        status, resp = self.post(self.connect(), self.call('double', [21]))
+        self.assertEqual(resp['result'], 42)
+        self.assertLess(time.time() - t0, 0.5)
+        t.join()
+        self.assertGreaterEqual(self.server.get_stats()['sleep']['max_ms'], 1000)
+
+    def test_idle_connections_do_not_hold_workers(self):
+        # more open keep-alive connections than workers, all idle
+        conns = [self.connect() for i in range(len(self.server.workers) + 2)]
+        for i, conn in enumerate(conns):
+            self.assertEqual(self.post(conn, self.call('double', [i]))[1]['result'], 2 * i)
+        t0 = time.time()
+        status, resp = self.post(self.connect(), self.call('double', [21]))
+        self.assertEqual(resp['result'], 42)
+        self.assertLess(time.time() - t0, 1.0)
+        # and the idle ones are still usable
+        for i, conn in enumerate(conns):
+            self.assertEqual(self.post(conn, self.call('double', [i]))[1]['result'], 2 * i)
+
+    def test_pipelined_requests(self):
+        conn = self.connect()
+        conn.connect()
+        token = base64.b64encode(b'user:pass').decode('ascii')
+        data = b''
+        for i in range(3):
+            body = json.dumps(self.call('double', [i], id=i)).encode('utf8')
+            data += ('POST / HTTP/1.1\r\nHost: x\r\nContent-Type: application/json\r\n'
+                     'Authorization: Basic {}\r\nContent-Length: {}\r\n\r\n'.format(token, len(body))).encode('ascii') + body
+        conn.sock.sendall(data)
+        received = b''
+        while received.count(b'"result"') < 3:
+            chunk = conn.sock.recv(4096)
+            self.assertTrue(chunk, 'connection closed early')
+            received += chunk
+        bodies = [part.split(b'\r\n\r\n', 1)[1] for part in received.split(b'HTTP/1.1 ')[1:]]
+        self.assertEqual([json.loads(body.decode('utf8'))['result'] for body in bodies], [0, 2, 4])
@@ -49,3 +49,31 @@ class TestSchnorr(unittest.TestCase):
             schnorr._secp256k1_schnorr_sign, schnorr._secp256k1_schnorr_verify = saved
             self.do_it()
 
+
+    def do_batch(self):
+        private_key = bytes.fromhex(
+            "12b004fff7f4b69ef8650e767f18f11ede158148b425660723b9f9a66e61f747")
+        pubkey = bytes.fromhex(
+            "030b4c866585dd868a9d62348a9cd008d6a312937048fff31670e7e920cfc7a744")
+        msghashes = [hashlib.sha256(bytes((i,))).digest() for i in range(4)]
+        sigs = [schnorr.sign(private_key, h) for h in msghashes]
+        items = [(pubkey, sig, h) for sig, h in zip(sigs, msghashes)]
+        # a sig for the wrong message, a garbage pubkey, a short sig
+        items += [(pubkey, sigs[0], msghashes[1]),
+                  (b'\x02' + b'\xff' * 32, sigs[0], msghashes[0]),
+                  (pubkey, sigs[0][:63], msghashes[0])]
+        expected = [True] * 4 + [False] * 3
+        self.assertEqual(schnorr.verify_batch(items), expected)
+        self.assertEqual(schnorr.verify_batch(items, max_workers=3), expected)
+        self.assertEqual(schnorr.verify_batch([]), [])
+
+    def test_verify_batch(self):
+        saved = (schnorr._secp256k1_schnorr_sign, schnorr._secp256k1_schnorr_verify)
+        slow = (None, None)
+        schnorr._secp256k1_schnorr_sign, schnorr._secp256k1_schnorr_verify = slow
+        try:
+            self.do_batch()
+        finally:
+            schnorr._secp256k1_schnorr_sign, schnorr._secp256k1_schnorr_verify = saved
+        if slow != saved:
+            self.do_batch()
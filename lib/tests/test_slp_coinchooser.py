@@ -0,0 +1,52 @@
+import unittest
+
+from ..slp_coinchooser import find_exact_match, choose_token_coins
+from ..util import NotEnoughFundsSlp
+
+
+def make_coins(token_values, bch_value=546):
+    return [{'prevout_hash': '%064x' % i, 'prevout_n': 0, 'value': bch_value,
+             'token_value': tv} for i, tv in enumerate(token_values)]
+
+
+class TestSlpCoinChooser(unittest.TestCase):
+
+    def test_find_exact_match(self):
+        values = [50, 30, 20, 20, 7, 3]
+        self.assertEqual([0], find_exact_match(values, 50, 1))
+        match = find_exact_match(values, 60, 3)
+        self.assertEqual(60, sum(values[i] for i in match))
+        self.assertLessEqual(len(match), 3)
+        self.assertIsNone(find_exact_match(values, 60, 1))
+        self.assertIsNone(find_exact_match(values, 131, 6))
+        # many equal values must not make the search explode
+        self.assertIsNone(find_exact_match([2] * 5000, 3, 5000))
+
+    def test_exact_match_has_no_change(self):
+        coins = make_coins([1000, 700, 300, 5, 5, 5])
+        selected, change = choose_token_coins(coins, 1300)
+        self.assertEqual(0, change)
+        self.assertEqual([1000, 300], [c['token_value'] for c in selected])
+
+    def test_fewest_inputs_smallest_change(self):
+        coins = make_coins([1000, 700, 300, 5, 5, 5])
+        selected, change = choose_token_coins(coins, 1200)
+        # two inputs are needed; the second is the smallest that covers the rest
+        self.assertEqual([1000, 300], [c['token_value'] for c in selected])
+        self.assertEqual(100, change)
+
+    def test_prefers_coins_carrying_more_bch(self):
+        coins = make_coins([10, 10]) + make_coins([10], bch_value=10000)
+        selected, change = choose_token_coins(coins, 10)
+        self.assertEqual(0, change)
+        self.assertEqual(10000, selected[0]['value'])
+
+    def test_many_small_coins(self):
+        coins = make_coins([1] * 3000 + [2500])
+        selected, change = choose_token_coins(coins, 2600)
+        self.assertEqual(101, len(selected))
+        self.assertEqual(0, change)
+
+    def test_not_enough(self):
+        with self.assertRaises(NotEnoughFundsSlp):
+            choose_token_coins(make_coins([1, 2, 3]), 7)
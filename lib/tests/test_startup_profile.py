@@ -0,0 +1,57 @@
+import builtins
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from .. import startup_profile
+from ..startup_profile import StartupProfiler
+
+
+class TestStartupProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_import = builtins.__import__
+        self.tmpdir = tempfile.mkdtemp()
+        sys.modules.pop('colorsys', None)
+
+    def tearDown(self):
+        builtins.__import__ = self.orig_import
+        startup_profile._profiler = None
+        startup_profile.set_report_path(None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_records_only_imports_that_load_modules(self):
+        profiler = StartupProfiler()
+        profiler.install()
+        try:
+            import colorsys
+            import tempfile as already_loaded
+            profiler.mark('imported')
+        finally:
+            profiler.uninstall()
+        self.assertIs(builtins.__import__, self.orig_import)
+        self.assertIs(already_loaded, tempfile)
+        self.assertEqual([name for name, depth, t, cum in profiler.imports], ['colorsys'])
+        name, depth, self_time, cumulative = profiler.imports[0]
+        self.assertEqual(depth, 0)
+        self.assertLessEqual(self_time, cumulative)
+        self.assertEqual([label for label, t in profiler.marks], ['imported'])
+
+    def test_finish_writes_report(self):
+        self.assertIsNone(startup_profile.finish())  # not started
+        path = os.path.join(self.tmpdir, 'startup_profile.txt')
+        startup_profile.set_report_path(path)
+        startup_profile.start()
+        self.assertTrue(startup_profile.is_active())
+        import colorsys
+        startup_profile.mark('phase one')
+        self.assertEqual(startup_profile.finish('done'), path)
+        self.assertFalse(startup_profile.is_active())
+        self.assertIs(builtins.__import__, self.orig_import)
+        with open(path, encoding='utf-8') as f:
+            report = f.read()
+        self.assertIn('phase one', report)
+        self.assertIn('done', report)
+        self.assertIn('colorsys', report)
@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 from pprint import pprint
 
 from .. import transaction
@@ -7,7 +8,7 @@ from ..bitcoin import TYPE_ADDRESS, TYPE_PUBKEY, TYPE_SCRIPT
 
 from ..keystore import xpubkey_to_address
 
-from ..util import bh2u
+from ..util import bh2u, bfh
 
 unsigned_blob = '010000000149f35e43fefd22d8bb9e4b3ff294c6286154c25712baf6ab77b646e5074d6aed010000005701ff4c53ff0488b21e0000000000000000004f130d773e678a58366711837ec2e33ea601858262f8eaef246a7ebd19909c9a03c3b30e38ca7d797fee1223df1c9827b2a9f3379768f520910260220e0560014600002300feffffffd8e43201000000000118e43201000000001976a914e158fb15c888037fdc40fb9133b4c1c3c688706488ac5fbd0700'
 signed_blob = '010000000149f35e43fefd22d8bb9e4b3ff294c6286154c25712baf6ab77b646e5074d6aed010000006a473044022025bdc804c6fe30966f6822dc25086bc6bb0366016e68e880cf6efd2468921f3202200e665db0404f6d6d9f86f73838306ac55bb0d0f6040ac6047d4e820f24f46885412103b5bbebceeb33c1b61f649596b9c3611c6b2853a1f6b48bce05dd54f667fa2166feffffff0118e43201000000001976a914e158fb15c888037fdc40fb9133b4c1c3c688706488ac5fbd0700'
@@ -296,6 +297,165 @@ class TestTransaction(unittest.TestCase):
         self.assertEqual("", tx.outputs()[0][1].to_ui_string())
         self.assertEqual('50fa7bd4e5e2d3220fd2e84effec495b9845aba379d853408779d59a4b0b4f59', tx.txid())
 
+
+class TestTxView(unittest.TestCase):
+
+    def test_matches_deserialize(self):
+        from .bench_transaction import CORPUS
+        for raw in CORPUS:
+            d = transaction.deserialize(raw)
+            view = transaction.TxView(raw)
+            self.assertEqual(view.version, d['version'])
+            self.assertEqual(view.locktime, d['lockTime'])
+            self.assertEqual(view.outputs(), [(o['type'], o['address'], o['value']) for o in d['outputs']])
+            self.assertEqual([(bh2u(h), n) for h, n in view.prevouts()],
+                             [(i['prevout_hash'], i['prevout_n']) for i in d['inputs']])
+            self.assertEqual([bh2u(view.output_script(n)) for n in range(view.num_outputs())],
+                             [o['scriptPubKey'] for o in d['outputs']])
+
+    def test_lazy_outputs(self):
+        tx = transaction.Transaction(v2_blob)
+        self.assertEqual(tx.prevouts(), [('b5b9f4db712f34c996ef0853afe6d1f6cea1eac6fb7b2b5061e0814aa4011619', 0)])
+        self.assertEqual(len(tx.outputs()), 2)
+        self.assertEqual(tx.version, 2)
+        # the inputs were not parsed
+        self.assertIsNone(tx._inputs)
+        self.assertEqual(tx.txid(), "b97f9180173ab141b61b9f944d841e60feec691d6daab4d4d932b24dd36606fe")
+        self.assertEqual(tx.prevouts(), [('b5b9f4db712f34c996ef0853afe6d1f6cea1eac6fb7b2b5061e0814aa4011619', 0)])
+
+    def test_partial_and_bad(self):
+        # partially signed txs carry extra data and must use the full parser
+        with self.assertRaises(transaction.SerializationError):
+            transaction.TxView(unsigned_blob)
+        tx = transaction.Transaction(unsigned_blob)
+        self.assertEqual(tx.get_outputs(), [(Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK'), 20112408)])
+        self.assertEqual(tx.inputs()[0]['value'], 20112600)
+
+        for raw in (signed_blob[:-2], signed_blob + '00', signed_blob[:100]):
+            with self.assertRaises(transaction.SerializationError):
+                transaction.TxView(raw)
+
+
+class TestSighashContext(unittest.TestCase):
+
+    def test_preimage(self):
+        expected = ('010000001182991bddc02690e8dce25d7b06f54a6d170bdf24db577544acb3ff8ab80d8b18606b350cd8bf565266bc352f0caddcf01e8fa789dd8a15386327cf8cabe198'
+                    '49f35e43fefd22d8bb9e4b3ff294c6286154c25712baf6ab77b646e5074d6aed01000000'
+                    '1976a9141b633d96290b55e85ee1a708c8cf99981db6df3c88ac'
+                    'd8e4320100000000feffffff'
+                    '6937481c56c17c4bada2459f5e69fe2852f1d218cef12dfe3e6a2300ad843f43'
+                    '5fbd0700' '41000000')
+        tx = transaction.Transaction(unsigned_blob)
+        ctx = transaction.SighashContext(tx)
+        self.assertEqual(bh2u(ctx.preimage(0)), expected)
+        self.assertEqual(tx.serialize_preimage(0), expected)
+        self.assertEqual(tx.serialize_preimage(0, use_cache=True), expected)
+        self.assertEqual(bh2u(ctx.sighash(0)), bh2u(transaction.Hash(bytes.fromhex(expected))))
+        with self.assertRaises(ValueError):
+            ctx.preimage(0, 0x01)
+        del tx.inputs()[0]['value']
+        with self.assertRaises(transaction.InputValueMissing):
+            ctx.preimage(0)
+
+    def test_serialize_bytes(self):
+        for blob in (unsigned_blob, signed_blob, v2_blob, nonmin_blob):
+            tx = transaction.Transaction(blob)
+            self.assertEqual(tx.serialize_bytes(), bytes.fromhex(blob))
+            self.assertEqual(tx.serialize(), blob)
+
+
+class TestSignTransaction(unittest.TestCase):
+
+    def _make_tx(self, n_inputs, sign_schnorr):
+        keypairs = {}
+        inputs = []
+        for i in range(n_inputs):
+            sec = transaction.Hash(bytes((i,)))
+            pubkey = transaction.public_key_from_private_key(sec, True)
+            keypairs[pubkey] = (sec, True)
+            inputs.append({'type': 'p2pkh', 'address': Address.from_pubkey(pubkey),
+                           'prevout_hash': bh2u(transaction.Hash(bytes((i, i)))), 'prevout_n': i,
+                           'x_pubkeys': [pubkey], 'pubkeys': [pubkey], 'signatures': [None],
+                           'num_sig': 1, 'value': 10000 + i, 'sequence': 0xfffffffe})
+        outputs = [(TYPE_ADDRESS, Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK'), 10000 * n_inputs)]
+        return transaction.Transaction.from_io(inputs, outputs, locktime=507231, sign_schnorr=sign_schnorr), keypairs
+
+    def test_parallel_signing_is_deterministic(self):
+        for sign_schnorr in (False, True):
+            tx, keypairs = self._make_tx(transaction.SIGN_PARALLEL_MIN + 1, sign_schnorr)
+            tx.sign(keypairs)
+            self.assertTrue(tx.is_complete())
+            tx2, _ = self._make_tx(transaction.SIGN_PARALLEL_MIN + 1, sign_schnorr)
+            with mock.patch.object(transaction, 'SIGN_THREADS', 4), \
+                    mock.patch.object(transaction.Transaction, '_can_sign_in_parallel', return_value=True):
+                tx2.sign(keypairs)
+            self.assertEqual(tx.raw, tx2.raw)
+            self.assertEqual(tx.is_schnorr_signed(0), sign_schnorr)
+
+    def test_verify_signatures(self):
+        tx, keypairs = self._make_tx(2, False)
+        tx.sign(keypairs)
+        tx_s, _ = self._make_tx(2, True)
+        tx_s.sign(keypairs)
+        items = []
+        for t in (tx, tx_s):
+            ctx = transaction.SighashContext(t)
+            for i, txin in enumerate(t.inputs()):
+                items.append((bytes.fromhex(txin['pubkeys'][0]), bytes.fromhex(txin['signatures'][0][:-2]), ctx.sighash(i)))
+        self.assertEqual(transaction.Transaction.verify_signatures(items), [True] * 4)
+        # swap the pubkeys around so that every signature is bad
+        bad = [(items[n ^ 1][0], sig, h) for n, (_, sig, h) in enumerate(items)]
+        bad.append((b'', b'', b''))
+        self.assertEqual(transaction.Transaction.verify_signatures(bad), [False] * 5)
+        self.assertEqual(transaction.Transaction.verify_signatures(items + bad, max_workers=2), [True] * 4 + [False] * 5)
+
+    def test_sign_skips_complete_and_unknown(self):
+        tx, keypairs = self._make_tx(2, False)
+        first = dict([next(iter(keypairs.items()))])
+        tx.sign(first)
+        self.assertFalse(tx.is_complete())
+        self.assertEqual(tx._get_signing_jobs(first), [])
+        self.assertEqual([j[:2] for j in tx._get_signing_jobs(keypairs)], [(1, 0)])
+        tx.sign(keypairs)
+        self.assertTrue(tx.is_complete())
+
+
+class TestEstimatedSize(unittest.TestCase):
+
+    def _inputs(self):
+        cpub, upub = '02' + '11' * 32, '04' + '22' * 64
+        xpub = 'ff' + '33' * 82
+        base = {'prevout_hash': '44' * 32, 'prevout_n': 1, 'value': 1000, 'sequence': 0xfffffffe}
+        inputs = [
+            dict(base, type='p2pkh', x_pubkeys=[cpub], pubkeys=[cpub], signatures=[None], num_sig=1),
+            dict(base, type='p2pkh', x_pubkeys=[upub], pubkeys=[upub], signatures=[None], num_sig=1),
+            dict(base, type='p2pkh', x_pubkeys=[xpub], signatures=[None], num_sig=1),
+            dict(base, type='p2pk', x_pubkeys=[cpub], pubkeys=[cpub], signatures=[None], num_sig=1),
+            dict(base, type='p2pkh', scriptSig='00' * 300),
+        ]
+        for m, n in ((1, 1), (2, 3), (3, 5), (11, 15)):
+            inputs.append(dict(base, type='p2sh', x_pubkeys=[xpub] * n, signatures=[None] * n, num_sig=m))
+            inputs.append(dict(base, type='p2sh', x_pubkeys=[upub] * n, pubkeys=[upub] * n,
+                               signatures=[None] * n, num_sig=m))
+        return inputs
+
+    def test_matches_serialization(self):
+        outputs = [(TYPE_ADDRESS, Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK'), 1000),
+                   (TYPE_ADDRESS, Address.from_P2SH_hash(b'\x05' * 20), 2000),
+                   (TYPE_SCRIPT, ScriptOutput(bytes.fromhex('6a') + b'\x4c\xc8' + b'x' * 200), 0)]
+        for sign_schnorr in (False, True):
+            for txin in self._inputs():
+                script = transaction.Transaction.input_script(txin, True, sign_schnorr=sign_schnorr)
+                expected = len(transaction.Transaction.serialize_input_bytes(txin, bfh(script), True))
+                self.assertEqual(expected, transaction.Transaction.estimated_input_size(txin, sign_schnorr), txin)
+            tx = transaction.Transaction.from_io(self._inputs() * 20, outputs, sign_schnorr=sign_schnorr)
+            self.assertEqual(len(tx.serialize_bytes(True)), tx.estimated_size())
+
+    def test_complete_tx_uses_raw(self):
+        tx = transaction.Transaction(signed_blob)
+        self.assertEqual(len(signed_blob) // 2, tx.estimated_size())
+
+
 class NetworkMock(object):
 
     def __init__(self, unspent):
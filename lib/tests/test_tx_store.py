@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..bitcoin import Hash
+from ..transaction import Transaction
+from ..tx_store import TxStore, get_tx_store
+from .test_transaction import signed_blob, v2_blob
+
+
+def fake_tx(n, size=100):
+    raw = n.to_bytes(4, 'little') * (size // 4)
+    return Hash(raw)[::-1].hex(), raw
+
+
+class TestTxStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_memory_lru_is_byte_bounded(self):
+        store = TxStore(max_bytes=1000, num_shards=1)
+        txs = [fake_tx(i) for i in range(20)]
+        for txid, raw in txs[:10]:
+            store.put(txid, raw)
+        self.assertEqual(store.size_bytes(), 1000)
+        # touch the oldest so that the second oldest is evicted instead
+        self.assertEqual(store.get(txs[0][0]), txs[0][1])
+        store.put(*txs[10])
+        self.assertIn(txs[0][0], store)
+        self.assertNotIn(txs[1][0], store)
+        self.assertLessEqual(store.size_bytes(), 1000)
+        with self.assertRaises(TypeError):
+            store.put(txs[11][0], txs[11][1].hex())
+
+    def test_disk_tier_survives_reopen(self):
+        store = TxStore(max_bytes=1000, num_shards=1)
+        self.assertTrue(store.enable_disk(self.tmpdir))
+        txs = [fake_tx(i) for i in range(30)]
+        for txid, raw in txs:
+            store.put(txid, raw)
+        store.disable_disk()
+
+        store = TxStore(max_bytes=1000, num_shards=1)
+        store.enable_disk(self.tmpdir)
+        self.assertEqual(len(store.disk), 30)
+        for txid, raw in txs:
+            self.assertEqual(store.get(txid), raw)
+        store.disable_disk()
+
+    def test_disk_tier_drops_partial_and_corrupt_records(self):
+        store = TxStore()
+        store.enable_disk(self.tmpdir)
+        txs = [fake_tx(i) for i in range(3)]
+        for txid, raw in txs:
+            store.put(txid, raw)
+        path = store.disk.path
+        store.disable_disk()
+        with open(path, 'r+b') as f:
+            # flip a byte in the first payload and chop the last record short
+            f.seek(36)
+            f.write(b'\xff')
+            f.truncate(os.path.getsize(path) - 10)
+
+        store = TxStore()
+        store.enable_disk(self.tmpdir)
+        self.assertEqual(len(store.disk), 2)
+        self.assertIsNone(store.get(txs[0][0]))
+        self.assertEqual(store.get(txs[1][0]), txs[1][1])
+        self.assertIsNone(store.get(txs[2][0]))
+        # appending after the truncation point still gives readable records
+        store.put(*txs[2])
+        store.clear()
+        self.assertEqual(store.get(txs[2][0]), txs[2][1])
+        store.disable_disk()
+
+    def test_disk_tier_compacts(self):
+        store = TxStore()
+        store.enable_disk(self.tmpdir, max_bytes=1360)
+        txs = [fake_tx(i) for i in range(11)]
+        for txid, raw in txs:
+            store.put(txid, raw)
+        # 11 records of 136 bytes overflowed the budget; the newest 5 were kept
+        self.assertEqual(len(store.disk), 5)
+        self.assertLessEqual(os.path.getsize(store.disk.path), 1360 // 2)
+        store.clear()
+        self.assertIsNone(store.get(txs[5][0]))
+        self.assertEqual(store.get(txs[10][0]), txs[10][1])
+        store.disable_disk()
+
+    def test_transaction_cache_uses_global_store(self):
+        for blob in (signed_blob, v2_blob):
+            tx = Transaction(blob)
+            txid = tx.txid()
+            Transaction.tx_cache_put(tx)
+            self.assertIsNotNone(get_tx_store().get(txid))
+            cached = Transaction.tx_cache_get(txid)
+            self.assertEqual(cached.raw, blob)
+            self.assertIsNot(cached, Transaction.tx_cache_get(txid))
@@ -68,3 +68,177 @@ class TestWalletStorage(WalletTestCase):
         with open(self.wallet_path, "r") as f:
             contents = f.read()
         self.assertEqual(some_dict, json.loads(contents))
+
+
+class TestSlpTxDeltas(unittest.TestCase):
+
+    def make_wallet(self):
+        ''' Just enough wallet state for the SLP history methods: a token
+        received at addr1 in tx 'a', half of it sent on from addr1 in tx 'b'
+        to addr2, and tx 'c' burning another token that addr2 got in 'd'. '''
+        from collections import defaultdict
+        import threading
+        from ..address import Address
+        w = object.__new__(wallet.Abstract_Wallet)
+        w.lock = threading.RLock()
+        addr1 = Address.from_P2PKH_hash(b'\x01' * 20)
+        addr2 = Address.from_P2PKH_hash(b'\x02' * 20)
+        tok1, tok2 = '11' * 32, '22' * 32
+        w._history = {addr1: [('a', 1), ('b', 2)], addr2: [('b', 2), ('d', 3), ('c', 4)]}
+        w.tx_addr_hist = defaultdict(set)
+        for addr, hist in w._history.items():
+            for tx_hash, h in hist:
+                w.tx_addr_hist[tx_hash].add(addr)
+        w.pruned_txo = {}
+        w.pruned_txo_values = set()
+        w.tx_tokinfo = {h: {'validity': 1} for h in 'abd'}
+        w.tx_tokinfo['c'] = {'validity': None}
+        w._slp_txo = defaultdict(lambda: defaultdict(dict))
+        w._slp_txo[addr1]['a'][1] = {'qty': 100, 'token_id': tok1}
+        w._slp_txo[addr2]['b'][1] = {'qty': 50, 'token_id': tok1}
+        w._slp_txo[addr2]['d'][1] = {'qty': 7, 'token_id': tok2}
+        w.txi = {'b': {addr1: [('a:1', 546)]}, 'c': {addr2: [('d:1', 546)]}}
+        w.get_tx_height = lambda tx_hash: (0, 0, 0)
+        return w, tok1, tok2
+
+    def test_matches_full_history(self):
+        w, tok1, tok2 = self.make_wallet()
+        validities = (None, 0, 1, 2, 3, 4)
+        expected = {}
+        for token_id, hist in w.get_slp_histories(list(w._history), validities).items():
+            for tx_hash, height, conf, timestamp, delta in hist:
+                expected.setdefault(tx_hash, {})[token_id] = delta
+        got = {h: w.get_slp_tx_deltas(h, validities) for h in 'abcd'}
+        self.assertEqual(expected, {h: d for h, d in got.items() if d})
+        self.assertEqual({tok1: 100}, got['a'])
+        self.assertEqual({tok1: -50}, got['b'])  # 100 spent, 50 back to addr2
+        self.assertEqual({tok2: -7}, got['c'])
+        # a tx still waiting on its inputs is left out, like get_slp_histories does
+        w.pruned_txo_values.add('b')
+        self.assertEqual({}, w.get_slp_tx_deltas('b', validities))
+
+
+class TestWalletEvents(WalletTestCase):
+
+    def test_batches_are_coalesced(self):
+        from ..wallet_events import WalletEvents
+        events = WalletEvents('test')
+        events.tx_added('a')  # not recorded, nobody's listening yet
+        batches = []
+        events.subscribe(batches.append)
+        self.assertIsNone(events.flush())
+        events.tx_added('b')
+        events.tx_removed('b')
+        events.tx_added('c')
+        events.utxos_changed(added=['c:0', 'c:1'], spent=['x:0'])
+        events.utxos_changed(spent=['c:1'])
+        events.label_changed('c', 'hello')
+        changes = events.flush()
+        self.assertEqual(batches, [changes])
+        self.assertEqual(changes.tx_added, {'c'})
+        self.assertEqual(changes.tx_removed, {'b'})
+        self.assertEqual(changes.utxo_added, {'c:0'})
+        self.assertEqual(changes.utxo_spent, {'x:0'})
+        self.assertEqual(changes.to_dict()['label_changed'], {'c': 'hello'})
+        self.assertIsNone(events.flush())
+
+    def test_wallet_publishes_changes(self):
+        from ..address import Address
+        from ..transaction import Transaction
+        from .test_transaction import signed_blob
+        addr = Address.from_P2PKH_hash(bytes.fromhex('e158fb15c888037fdc40fb9133b4c1c3c6887064'))
+        w = wallet.ImportedAddressWallet.from_text(WalletStorage(self.wallet_path), addr.to_ui_string())
+        batches = []
+        w.events.subscribe(batches.append)
+        tx = Transaction(signed_blob)
+        tx_hash = tx.txid()
+        w.add_transaction(tx_hash, tx)
+        w.set_label(tx_hash, 'payment')
+        changes = w.events.flush()
+        self.assertEqual(changes.tx_added, {tx_hash})
+        self.assertEqual(changes.utxo_added, {tx_hash + ':0'})
+        self.assertEqual(changes.label_changed, {tx_hash: 'payment'})
+        w.remove_transaction(tx_hash)
+        changes = w.events.flush()
+        self.assertEqual(changes.tx_removed, {tx_hash})
+        self.assertEqual(changes.utxo_spent, {tx_hash + ':0'})
+        self.assertEqual(len(batches), 2)
+
+    def test_history_entry_matches_history(self):
+        from ..address import Address
+        from ..transaction import Transaction
+        from .test_transaction import signed_blob
+        addr = Address.from_P2PKH_hash(bytes.fromhex('e158fb15c888037fdc40fb9133b4c1c3c6887064'))
+        w = wallet.ImportedAddressWallet.from_text(WalletStorage(self.wallet_path), addr.to_ui_string())
+        tx = Transaction(signed_blob)
+        tx_hash = tx.txid()
+        self.assertIsNone(w.get_history_entry(tx_hash))
+        w.receive_history_callback(addr, [(tx_hash, 0)], {})
+        w.receive_tx_callback(tx_hash, tx, 0)
+        (h, height, conf, timestamp, delta, balance), = w.get_history()
+        self.assertEqual(w.get_history_entry(tx_hash), (height, conf, timestamp, delta, w.get_txpos(tx_hash)))
+        self.assertGreater(delta, 0)
+
+
+class TestResolveFees(WalletTestCase):
+
+    class FakeNetwork:
+        ''' Answers every transaction.get with an error, right away. '''
+        def __init__(self):
+            self.requested = []
+
+        def queue_request(self, method, params, interface=None, *, callback=None):
+            self.requested.append(params[0])
+            callback({'method': method, 'params': params, 'error': 'not found'})
+
+        def cancel_requests(self, callback):
+            pass
+
+    def setUp(self):
+        super().setUp()
+        from ..address import Address
+        from ..transaction import Transaction
+        from .test_transaction import signed_blob, v2_blob
+        self.txs = [Transaction(signed_blob), Transaction(v2_blob)]
+        addrs = [addr for tx in self.txs for _type, addr, v in tx.outputs()]
+        self.wallet = wallet.ImportedAddressWallet.from_text(WalletStorage(self.wallet_path),
+                                                             ' '.join(a.to_ui_string() for a in addrs))
+        for tx in self.txs:
+            self.wallet.add_transaction(tx.txid(), tx)
+
+    def test_fee_from_wallet_coins(self):
+        w, tx = self.wallet, self.txs[0]
+        # pretend the inputs of tx spent coins of the wallet, 1000 sats each
+        for inp in tx.inputs():
+            w.txo[inp['prevout_hash']] = {inp['address']: [(inp['prevout_n'], 1000, False)]}
+        fee = 1000 * len(tx.inputs()) - tx.output_value()
+        self.assertEqual(w.resolve_fees([tx.txid()]), {tx.txid(): fee})
+        self.assertEqual(w.tx_fees[tx.txid()], fee)
+
+    def test_missing_prevouts_fetched_once(self):
+        w = self.wallet
+        w.network = network = self.FakeNetwork()
+        tx_hashes = [tx.txid() for tx in self.txs]
+        self.assertEqual(w.resolve_fees(tx_hashes, use_network=True, timeout=5.0), {})
+        prevouts = {inp['prevout_hash'] for tx in self.txs for inp in tx.inputs()}
+        self.assertEqual(sorted(network.requested), sorted(prevouts))
+        # without use_network, nothing is requested
+        network.requested.clear()
+        w.resolve_fees(tx_hashes)
+        self.assertEqual(network.requested, [])
+
+    def test_export_fetches_prevouts_of_whole_range_once(self):
+        w = self.wallet
+        w.network = network = self.FakeNetwork()
+        w.EXPORT_FEE_CHUNK = 1
+        for height, tx in enumerate(self.txs, 100):
+            for _type, addr, v in tx.outputs():
+                w._history.setdefault(addr, []).append((tx.txid(), height))
+        rows = w.export_history(download_inputs=True, fee_calc_timeout=5.0)
+        self.assertEqual(len(rows), 2)
+        prevouts = {inp['prevout_hash'] for tx in self.txs for inp in tx.inputs()}
+        self.assertEqual(sorted(network.requested), sorted(prevouts))
+        # no time budget, no requests
+        network.requested.clear()
+        w.export_history(download_inputs=True, fee_calc_timeout=0)
+        self.assertEqual(network.requested, [])
@@ -80,6 +80,9 @@ class TestWalletKeystoreAddressIntegrity(unittest.TestCase):
                          Address.from_string('1FJEEB8ihPMbzs2SkLmr37dHyRFzakqUmo'))
         self.assertEqual(w.get_change_addresses()[0],
                          Address.from_string('1KRW8pH6HFHZh889VDq6fEKvmrsmApwNfe'))
+        addresses = w.get_addresses()
+        self.assertEqual([w.get_address_position(a) for a in addresses], list(range(len(addresses))))
+        self.assertIsNone(w.get_address_position(Address.from_string('1BoatSLRHtKNngkdXEeobR76b53LETtpyT')))
 
     @mock.patch.object(storage.WalletStorage, '_write')
     def test_bip39_seed_bip44_standard(self, mock_write):
@@ -137,3 +140,185 @@ class TestWalletKeystoreAddressIntegrity(unittest.TestCase):
                          Address.from_string('3H3iyACDTLJGD2RMjwKZcCwpdYZLwEZzKb'))
         self.assertEqual(w.get_change_addresses()[0],
                          Address.from_string('31hyfHrkhNjiPZp1t7oky5CGNYqSqDAVM9'))
+
+
+class TestWalletAddressDerivation(unittest.TestCase):
+
+    xpub = 'xpub661MyMwAqRbcFWohJWt7PHsFEJfZAvw9ZxwQoDa4SoMgsDDM1T7WK3u9E4edkC4ugRnZ8E4xDZRpk8Rnts3Nbt97dPwT52CwBdDWroaZf8U'
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_synchronize_derives_in_batches(self, mock_write):
+        ks = keystore.from_xpub(self.xpub)
+        store = storage.WalletStorage('if_this_exists_mocking_failed_648151893')
+        store.put('keystore', ks.dump())
+        w = wallet.Standard_Wallet(store)
+        with mock.patch.object(w, 'save_addresses', wraps=w.save_addresses) as save:
+            w.synchronize()
+            # one save per branch, not one per address
+            self.assertEqual(2, save.call_count)
+        self.assertEqual(w.gap_limit, len(w.get_receiving_addresses()))
+        self.assertEqual(w.gap_limit_for_change, len(w.get_change_addresses()))
+
+        for for_change, addresses in ((0, w.get_receiving_addresses()),
+                                      (1, w.get_change_addresses())):
+            for n in (0, 7, len(addresses) - 1):
+                pubkey = keystore.Xpub.get_pubkey_from_xpub(self.xpub, (for_change, n))
+                self.assertEqual(Address.from_pubkey(pubkey), addresses[n])
+        self.assertEqual(Address.from_string('1NNkttn1YvVGdqBW4PR6zvc3Zx3H5owKRf'),
+                         w.get_receiving_addresses()[0])
+
+        more = w.create_new_addresses(False, 3)
+        self.assertEqual(more, w.get_receiving_addresses()[-3:])
+        self.assertEqual(w.derive_pubkeys_range(False, w.gap_limit, 3),
+                         [w.derive_pubkeys(False, n) for n in range(w.gap_limit, w.gap_limit + 3)])
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_address_index(self, mock_write):
+        ks = keystore.from_xpub(self.xpub)
+        store = storage.WalletStorage('if_this_exists_mocking_failed_648151893')
+        store.put('keystore', ks.dump())
+        w = wallet.Standard_Wallet(store)
+        w.synchronize()
+        recv, change = w.get_receiving_addresses(), w.get_change_addresses()
+        for n, addr in enumerate(recv):
+            self.assertEqual((False, n), w.get_address_index(addr))
+        for n, addr in enumerate(change):
+            self.assertEqual((True, n), w.get_address_index(addr))
+
+        new = w.create_new_address(False)
+        self.assertEqual((False, len(recv) - 1), w.get_address_index(new))
+        self.assertFalse(w.is_beyond_limit(recv[0], False))
+        with self.assertRaises(ValueError):
+            w.is_beyond_limit(new, True)
+
+        # a shrunk or replaced list is re-indexed
+        w.receiving_addresses = w.receiving_addresses[:5]
+        with self.assertRaises(Exception):
+            w.get_address_index(new)
+        self.assertEqual((False, 4), w.get_address_index(recv[4]))
+        self.assertEqual((True, 3), w.get_address_index(change[3]))
+
+    def test_derive_pubkey_range(self):
+        ks = keystore.from_xpub(self.xpub)
+        self.assertEqual(ks.derive_pubkey_range(1, 5, 3),
+                         [ks.derive_pubkey(1, n) for n in (5, 6, 7)])
+        self.assertEqual((1, 6), ks.scan_for_pubkey_index(ks.derive_pubkey(1, 6)))
+
+
+class TestWalletAddressStatus(unittest.TestCase):
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_status_cache_matches_full_hash(self, mock_write):
+        from ..synchronizer import Synchronizer
+        ks = keystore.from_xpub('xpub661MyMwAqRbcFWohJWt7PHsFEJfZAvw9ZxwQoDa4SoMgsDDM1T7WK3u9E4edkC4ugRnZ8E4xDZRpk8Rnts3Nbt97dPwT52CwBdDWroaZf8U')
+        store = storage.WalletStorage('if_this_exists_mocking_failed_648151893')
+        store.put('keystore', ks.dump())
+        store.put('gap_limit', 1)
+        w = wallet.Standard_Wallet(store)
+        w.synchronize()
+        addr = w.get_receiving_addresses()[0]
+        full = Synchronizer.get_status
+
+        self.assertIsNone(w.get_address_status(addr))
+        hists = [
+            [('aa' * 32, 100), ('bb' * 32, 101)],
+            [('aa' * 32, 100), ('bb' * 32, 101), ('cc' * 32, 0)],
+            [('aa' * 32, 100), ('bb' * 32, 101), ('cc' * 32, 102), ('dd' * 32, -1)],
+            [('aa' * 32, 100), ('cc' * 32, 102)],  # reorg / removal in the middle
+            [],
+        ]
+        for hist in hists:
+            # candidate histories are hashed relative to the current one
+            self.assertEqual(full(hist), w.get_address_status(addr, hist))
+            w.receive_history_callback(addr, hist, {})
+            self.assertEqual(full(hist), w.get_address_status(addr))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_server_status_persistence(self, mock_write):
+        from ..synchronizer import Synchronizer
+        ks = keystore.from_xpub('xpub661MyMwAqRbcFWohJWt7PHsFEJfZAvw9ZxwQoDa4SoMgsDDM1T7WK3u9E4edkC4ugRnZ8E4xDZRpk8Rnts3Nbt97dPwT52CwBdDWroaZf8U')
+        store = storage.WalletStorage('if_this_exists_mocking_failed_648151893')
+        store.put('keystore', ks.dump())
+        store.put('gap_limit', 1)
+        w = wallet.Standard_Wallet(store)
+        w.synchronize()
+        used, unused = w.get_receiving_addresses()[0], w.get_change_addresses()[0]
+        hist = [('aa' * 32, 100), ('bb' * 32, 0)]
+        w.receive_history_callback(used, hist, {})
+        w.set_address_server_status(used, Synchronizer.get_status(hist))
+        w.set_address_server_status(unused, None)
+        w.save_transactions()
+
+        w2 = wallet.Standard_Wallet(store)
+        self.assertEqual({used: Synchronizer.get_status(hist), unused: None},
+                         w2.get_address_server_statuses())
+        self.assertEqual(Synchronizer.get_status(hist), w2.get_address_status(used))
+
+        # a status that no longer agrees with the stored history is dropped
+        addr_status = store.get('addr_status')
+        addr_status[used.to_storage_string()][1] = 5
+        store.put('addr_status', addr_status)
+        w3 = wallet.Standard_Wallet(store)
+        self.assertEqual({unused: None}, w3.get_address_server_statuses())
+
+
+class TestWalletVerifiedTx(unittest.TestCase):
+
+    class FakeBlockchain:
+        def __init__(self, roots):
+            self.roots = roots
+            self.reads = []
+        def read_header(self, height):
+            self.reads.append(height)
+            if height in self.roots:
+                return {'merkle_root': self.roots[height], 'timestamp': 1}
+
+    class FakeNetwork:
+        def trigger_callback(self, *args):
+            pass
+        def get_local_height(self):
+            return 200
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_undo_verifications_by_block(self, mock_write):
+        ks = keystore.from_xpub('xpub661MyMwAqRbcFWohJWt7PHsFEJfZAvw9ZxwQoDa4SoMgsDDM1T7WK3u9E4edkC4ugRnZ8E4xDZRpk8Rnts3Nbt97dPwT52CwBdDWroaZf8U')
+        store = storage.WalletStorage('if_this_exists_mocking_failed_648151893')
+        store.put('keystore', ks.dump())
+        w = wallet.Standard_Wallet(store)
+        w.network = self.FakeNetwork()
+        w.add_verified_txs([
+            ('aa' * 32, (100, 1, 1), 'r100'),
+            ('bb' * 32, (101, 1, 1), 'r101'),
+            ('cc' * 32, (101, 1, 2), 'r101'),
+            ('dd' * 32, (102, 1, 1), 'r102'),
+        ])
+        w.save_verified_tx()
+
+        w2 = wallet.Standard_Wallet(store)
+        self.assertEqual({100: 'r100', 101: 'r101', 102: 'r102'}, w2.verified_block_roots)
+
+        # block 101 was reorged out, block 102 has the same txs in it
+        blockchain = self.FakeBlockchain({100: 'r100', 101: 'other', 102: 'r102'})
+        undone = w2.undo_verifications(blockchain, 101)
+        self.assertEqual({'bb' * 32, 'cc' * 32}, undone)
+        self.assertEqual([101, 102], blockchain.reads)  # one read per block at/above the fork
+        self.assertEqual({'aa' * 32, 'dd' * 32}, set(w2.verified_tx))
+        self.assertNotIn(101, w2.verified_block_roots)
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_rebuild_history_forgets_verifications(self, mock_write):
+        ks = keystore.from_xpub('xpub661MyMwAqRbcFWohJWt7PHsFEJfZAvw9ZxwQoDa4SoMgsDDM1T7WK3u9E4edkC4ugRnZ8E4xDZRpk8Rnts3Nbt97dPwT52CwBdDWroaZf8U')
+        store = storage.WalletStorage('if_this_exists_mocking_failed_648151893')
+        store.put('keystore', ks.dump())
+        w = wallet.Standard_Wallet(store)
+        w.network = self.FakeNetwork()
+        w.network.is_connected = lambda: True
+        w.add_verified_txs([('aa' * 32, (100, 1, 1), None)])  # no stored root
+        w.synchronizer = w.verifier = object()
+        with mock.patch.object(w, 'stop_threads'), mock.patch.object(w, 'start_threads'):
+            w.rebuild_history()
+        self.assertEqual({}, w.verified_tx)
+        self.assertFalse(w._verified_tx_heights)
+        self.assertEqual({}, w.verified_block_roots)
+        self.assertEqual({}, store.get('verified_block_roots', {}))
+        self.assertEqual(set(), w.undo_verifications(self.FakeBlockchain({}), 0))
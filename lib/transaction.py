@@ -28,14 +28,16 @@
 # Note: The deserialization code originally comes from ABE.
 
 from .util import print_error, profiler
-from .caches import ExpiringCache
 
 from .bitcoin import *
 from .address import (PublicKey, Address, Script, ScriptOutput, hash160,
                       UnknownAddress, OpCodes as opcodes,
                       P2PKH_prefix, P2PKH_suffix, P2SH_prefix, P2SH_suffix)
+from . import ecc_fast
 from . import schnorr
 from . import util
+from concurrent.futures import ThreadPoolExecutor
+import os
 import struct
 import warnings
 
@@ -43,9 +45,19 @@ import warnings
 # Workalike python implementation of Bitcoin's CDataStream class.
 #
 from .keystore import xpubkey_to_address, xpubkey_to_pubkey
+from .tx_store import get_tx_store
 
 NO_SIGNATURE = 'ff'
 
+# Transaction.sign() spreads the signing of many inputs over a thread pool of
+# this size. This only pays off when libsecp256k1 is available, since it
+# releases the GIL; with the pure python fallback we sign in the calling thread.
+SIGN_THREADS = min(8, os.cpu_count() or 1)
+# Below this many signatures a thread pool isn't worth its overhead.
+SIGN_PARALLEL_MIN = 4
+# Likewise for Transaction.verify_signatures(); verifying is a lot cheaper.
+VERIFY_PARALLEL_MIN = 32
+
 
 class SerializationError(Exception):
     """ Thrown when there's a problem deserializing or serializing """
@@ -402,6 +414,112 @@ def deserialize(raw):
     return d
 
 
+class TxView:
+    ''' Zero-copy, read-only view of a serialized transaction.
+
+    Construction makes a single pass over the raw bytes recording where each
+    input and output lives, without decoding any scripts or building any hex
+    strings. Callers then decode only what they need: `prevouts()` for the
+    input outpoints, `outputs()` for the outputs. Returned fields are bytes
+    (or memoryview slices of the underlying buffer); hex conversion is left to
+    the caller.
+
+    Only the plain network serialization is understood. Our partial-tx format
+    (incomplete inputs carrying NO_SIGNATURE placeholders and a trailing input
+    value) is refused with SerializationError, in which case the caller should
+    fall back to the full `deserialize()`. '''
+
+    __slots__ = ('raw', 'buf', 'version', 'locktime', '_inputs', '_outputs')
+
+    _null_hash = bytes(32)
+    _no_sig_push = bytes([1]) + bytes.fromhex(NO_SIGNATURE)
+
+    def __init__(self, raw):
+        if isinstance(raw, str):
+            raw = bfh(raw)
+        self.raw = bytes(raw)
+        self.buf = memoryview(self.raw)
+        self._inputs = []  # (outpoint offset, scriptSig start, scriptSig end)
+        self._outputs = []  # (value, scriptPubKey start, scriptPubKey end)
+        try:
+            self._scan()
+        except (IndexError, struct.error) as e:
+            raise SerializationError("attempt to read past end of buffer") from e
+
+    @staticmethod
+    def _read_compact_size(raw, pos):
+        size = raw[pos]
+        if size == 253:
+            return struct.unpack_from('<H', raw, pos + 1)[0], pos + 3
+        if size == 254:
+            return struct.unpack_from('<I', raw, pos + 1)[0], pos + 5
+        if size == 255:
+            return struct.unpack_from('<Q', raw, pos + 1)[0], pos + 9
+        return size, pos + 1
+
+    def _scan(self):
+        raw, read_size = self.raw, self._read_compact_size
+        end_of_buf = len(raw)
+        self.version = struct.unpack_from('<i', raw, 0)[0]
+        n_vin, pos = read_size(raw, 4)
+        for _ in range(n_vin):
+            start = pos
+            size, pos = read_size(raw, pos + 36)
+            end = pos + size
+            if (raw.find(self._no_sig_push, pos, end) > -1
+                    and not raw.startswith(self._null_hash, start)):
+                # possibly an incomplete input in our partial-tx format
+                raise SerializationError("not a complete transaction")
+            self._inputs.append((start, pos, end))
+            pos = end + 4  # skip sequence
+        n_vout, pos = read_size(raw, pos)
+        for _ in range(n_vout):
+            value = struct.unpack_from('<q', raw, pos)[0]
+            size, pos = read_size(raw, pos + 8)
+            self._outputs.append((value, pos, pos + size))
+            pos += size
+        self.locktime = struct.unpack_from('<I', raw, pos)[0]
+        if pos + 4 != end_of_buf:
+            raise SerializationError('extra junk at the end')
+
+    def num_inputs(self):
+        return len(self._inputs)
+
+    def num_outputs(self):
+        return len(self._outputs)
+
+    def prevouts(self):
+        ''' Returns a list of (prevout_hash, prevout_n) tuples. The hash is
+        bytes in the usual (reversed, txid) byte order. '''
+        raw = self.raw
+        # outpoints always start past the version, so o - 1 >= 0 below
+        return [(raw[o + 31:o - 1:-1], struct.unpack_from('<I', raw, o + 32)[0])
+                for o, _, _ in self._inputs]
+
+    def input_script(self, i):
+        ''' The scriptSig of input i, as a memoryview into the raw bytes. '''
+        _, start, end = self._inputs[i]
+        return self.buf[start:end]
+
+    def output_script(self, n):
+        ''' The scriptPubKey of output n, as a memoryview into the raw bytes. '''
+        _, start, end = self._outputs[n]
+        return self.buf[start:end]
+
+    def output_values(self):
+        return [value for value, _, _ in self._outputs]
+
+    def outputs(self):
+        ''' Returns the outputs as a list of (type, address, value) tuples, the
+        same as Transaction.outputs(). '''
+        raw = self.raw
+        ret = []
+        for value, start, end in self._outputs:
+            typ, addr = get_address_from_output_script(raw[start:end])
+            ret.append((typ, addr, value))
+        return ret
+
+
 # pay & redeem scripts
 
 
@@ -468,6 +586,7 @@ class Transaction:
     def update(self, raw):
         self.raw = raw
         self._inputs = None
+        self._outputs = None
         self.deserialize()
 
     def inputs(self):
@@ -477,9 +596,38 @@ class Transaction:
 
     def outputs(self):
         if self._outputs is None:
-            self.deserialize()
+            # Only decode the outputs if we can; the inputs (with their
+            # expensive scriptSig parsing) are left for when inputs() is called.
+            view = self._view()
+            if view is not None:
+                self._outputs = view.outputs()
+                self.locktime = view.locktime
+                self.version = view.version
+            else:
+                self.deserialize()
         return self._outputs
 
+    def prevouts(self):
+        ''' Returns a list of (prevout_hash, prevout_n) tuples, one for each
+        input. If the tx is not yet deserialized this reads just the outpoints
+        from self.raw and leaves the tx in its non-deserialized state, so it is
+        much cheaper than inputs() for code that only walks the tx graph. '''
+        if self._inputs is None:
+            view = self._view()
+            if view is not None:
+                return [(bh2u(h), n) for h, n in view.prevouts()]
+        return [(x['prevout_hash'], x['prevout_n']) for x in self.inputs()]
+
+    def _view(self):
+        ''' Returns a TxView of self.raw, or None if the tx has no raw bytes or
+        they are not a complete tx in the plain network serialization. '''
+        if not self.raw:
+            return None
+        try:
+            return TxView(self.raw)
+        except (SerializationError, ValueError):
+            return None
+
     @classmethod
     def get_sorted_pubkeys(self, txin):
         # sort pubkeys and x_pubkeys, using the order of pubkeys
@@ -515,6 +663,11 @@ class Transaction:
             raise Exception('API changed: update_signatures expects a list.')
         if len(self.inputs()) != len(signatures):
             raise Exception('expected {} signatures; got {}'.format(len(self.inputs()), len(signatures)))
+        sighash_context = None
+        # First gather every (input, pubkey) pairing to check, then check
+        # them all in one batch.
+        candidates = []  # (i, j, pubkey, sig, pre_hash)
+        pending = {}  # input index -> (pubkeys, pre_hash), for error reporting
         for i, txin in enumerate(self.inputs()):
             pubkeys, x_pubkeys = self.get_sorted_pubkeys(txin)
             sig = signatures[i]
@@ -525,20 +678,23 @@ class Transaction:
             if sig_final in txin.get('signatures'):
                 # skip if we already have this signature
                 continue
-            pre_hash = Hash(bfh(self.serialize_preimage(i)))
-            sig_bytes = bfh(sig)
-            added = False
-            reason = []
-            for j, pubkey in enumerate(pubkeys):
-                # see which pubkey matches this sig (in non-multisig only 1 pubkey, in multisig may be multiple pubkeys)
-                if self.verify_signature(bfh(pubkey), sig_bytes, pre_hash, reason):
-                    print_error("adding sig", i, j, pubkey, sig_final)
-                    self._inputs[i]['signatures'][j] = sig_final
-                    added = True
-            if not added:
-                resn = ', '.join(reversed(reason)) if reason else ''
-                print_error("failed to add signature {} for any pubkey for reason(s): '{}' ; pubkey(s) / sig / pre_hash = ".format(i, resn),
-                            pubkeys, '/', sig, '/', bh2u(pre_hash))
+            if sighash_context is None:
+                sighash_context = SighashContext(self)
+            pre_hash = sighash_context.sighash(i)
+            pending[i] = pubkeys, pre_hash
+            # see which pubkey matches this sig (in non-multisig only 1 pubkey, in multisig may be multiple pubkeys)
+            candidates.extend((i, j, pubkey, sig, pre_hash) for j, pubkey in enumerate(pubkeys))
+        verified = self.verify_signatures((bfh(pubkey), bfh(sig), pre_hash)
+                                          for i, j, pubkey, sig, pre_hash in candidates)
+        for (i, j, pubkey, sig, pre_hash), ok in zip(candidates, verified):
+            if ok:
+                sig_final = sig + '41'
+                print_error("adding sig", i, j, pubkey, sig_final)
+                self._inputs[i]['signatures'][j] = sig_final
+                pending.pop(i, None)
+        for i, (pubkeys, pre_hash) in pending.items():
+            print_error("failed to add signature {} for any pubkey; pubkey(s) / sig / pre_hash = ".format(i),
+                        pubkeys, '/', signatures[i], '/', bh2u(pre_hash))
         # redo raw
         self.raw = self.serialize()
 
@@ -697,22 +853,33 @@ class Transaction:
 
     @classmethod
     def serialize_outpoint(self, txin):
-        return bh2u(bfh(txin['prevout_hash'])[::-1]) + int_to_hex(txin['prevout_n'], 4)
+        return bh2u(self.serialize_outpoint_bytes(txin))
+
+    @staticmethod
+    def serialize_outpoint_bytes(txin):
+        return bfh(txin['prevout_hash'])[::-1] + struct.pack('<I', txin['prevout_n'])
 
     @classmethod
     def serialize_input(self, txin, script, estimate_size=False):
-        # Prev hash and index
-        s = self.serialize_outpoint(txin)
-        # Script length, script, sequence
-        s += var_int(len(script)//2)
-        s += script
-        s += int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
+        return bh2u(self.serialize_input_bytes(txin, bfh(script), estimate_size))
+
+    @classmethod
+    def serialize_input_bytes(self, txin, script, estimate_size=False):
+        ''' Like serialize_input but `script` is bytes and so is the result. '''
+        parts = [
+            # Prev hash and index
+            self.serialize_outpoint_bytes(txin),
+            # Script length, script, sequence
+            var_int_bytes(len(script)),
+            script,
+            struct.pack('<I', txin.get('sequence', 0xffffffff - 1)),
+        ]
         # offline signing needs to know the input value
         if ('value' in txin
             and txin.get('scriptSig') is None
             and not (estimate_size or self.is_txin_complete(txin))):
-            s += int_to_hex(txin['value'], 8)
-        return s
+            parts.append(struct.pack('<Q', txin['value']))
+        return b''.join(parts)
 
     def BIP_LI01_sort(self):
         # See https://github.com/kristovatlas/rfc/blob/master/bips/bip-li01.mediawiki
@@ -720,12 +887,13 @@ class Transaction:
         self._outputs.sort(key = lambda o: (o[2], self.pay_script(o[1])))
 
     def serialize_output(self, output):
+        return bh2u(self.serialize_output_bytes(output))
+
+    @staticmethod
+    def serialize_output_bytes(output):
         output_type, addr, amount = output
-        s = int_to_hex(amount, 8)
-        script = self.pay_script(addr)
-        s += var_int(len(script)//2)
-        s += script
-        return s
+        script = addr.to_script()
+        return struct.pack('<Q', amount) + var_int_bytes(len(script)) + script
 
     @classmethod
     def nHashType(cls):
@@ -775,9 +943,9 @@ class Transaction:
                 else:
                     del cmeta, res, self._cached_sighash_tup
 
-        hashPrevouts = Hash(bfh(''.join(self.serialize_outpoint(txin) for txin in inputs)))
-        hashSequence = Hash(bfh(''.join(int_to_hex(txin.get('sequence', 0xffffffff - 1), 4) for txin in inputs)))
-        hashOutputs = Hash(bfh(''.join(self.serialize_output(o) for o in outputs)))
+        hashPrevouts = Hash(b''.join(self.serialize_outpoint_bytes(txin) for txin in inputs))
+        hashSequence = Hash(b''.join(struct.pack('<I', txin.get('sequence', 0xffffffff - 1)) for txin in inputs))
+        hashOutputs = Hash(b''.join(self.serialize_output_bytes(o) for o in outputs))
 
         res = hashPrevouts, hashSequence, hashOutputs
         # cach resulting value, along with some minimal metadata to defensively
@@ -786,37 +954,27 @@ class Transaction:
         return res
 
     def serialize_preimage(self, i, nHashType=0x00000041, use_cache = False):
-        """ See `.calc_common_sighash` for explanation of use_cache feature """
+        """ See `.calc_common_sighash` for explanation of use_cache feature.
+
+        Returns hex. To compute the preimages of many inputs, use a single
+        SighashContext instead. """
         if (nHashType & 0xff) != 0x41:
             raise ValueError("other hashtypes not supported; submit a PR to fix this!")
-
-        nVersion = int_to_hex(self.version, 4)
-        nHashType = int_to_hex(nHashType, 4)
-        nLocktime = int_to_hex(self.locktime, 4)
-
-        txin = self.inputs()[i]
-        outpoint = self.serialize_outpoint(txin)
-        preimage_script = self.get_preimage_script(txin)
-        scriptCode = var_int(len(preimage_script) // 2) + preimage_script
-        try:
-            amount = int_to_hex(txin['value'], 8)
-        except KeyError:
-            raise InputValueMissing
-        nSequence = int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
-
-        hashPrevouts, hashSequence, hashOutputs = self.calc_common_sighash(use_cache = use_cache)
-
-        preimage = nVersion + bh2u(hashPrevouts) + bh2u(hashSequence) + outpoint + scriptCode + amount + nSequence + bh2u(hashOutputs) + nLocktime + nHashType
-        return preimage
+        return bh2u(SighashContext(self, use_cache=use_cache).preimage(i, nHashType))
 
     def serialize(self, estimate_size=False):
-        nVersion = int_to_hex(self.version, 4)
-        nLocktime = int_to_hex(self.locktime, 4)
+        return bh2u(self.serialize_bytes(estimate_size))
+
+    def serialize_bytes(self, estimate_size=False):
         inputs = self.inputs()
         outputs = self.outputs()
-        txins = var_int(len(inputs)) + ''.join(self.serialize_input(txin, self.input_script(txin, estimate_size, self._sign_schnorr), estimate_size) for txin in inputs)
-        txouts = var_int(len(outputs)) + ''.join(self.serialize_output(o) for o in outputs)
-        return nVersion + txins + txouts + nLocktime
+        parts = [struct.pack('<i', self.version), var_int_bytes(len(inputs))]
+        parts.extend(self.serialize_input_bytes(txin, bfh(self.input_script(txin, estimate_size, self._sign_schnorr)), estimate_size)
+                     for txin in inputs)
+        parts.append(var_int_bytes(len(outputs)))
+        parts.extend(self.serialize_output_bytes(o) for o in outputs)
+        parts.append(struct.pack('<I', self.locktime))
+        return b''.join(parts)
 
     def hash(self):
         warnings.warn("warning: deprecated tx.hash()", FutureWarning, stacklevel=2)
@@ -825,8 +983,7 @@ class Transaction:
     def txid(self):
         if not self.is_complete():
             return None
-        ser = self.serialize()
-        return self._txid(ser)
+        return bh2u(Hash(self.serialize_bytes())[::-1])
 
     def txid_fast(self):
         ''' Returns the txid by immediately calculating it from self.raw,
@@ -880,14 +1037,62 @@ class Transaction:
     @profiler
     def estimated_size(self):
         '''Return an estimated tx size in bytes.'''
-        return (len(self.serialize(True)) // 2 if not self.is_complete() or self.raw is None
-                else len(self.raw) // 2)  # ASCII hex string
+        if self.is_complete() and self.raw is not None:
+            return len(self.raw) // 2  # ASCII hex string
+        inputs = self.inputs()
+        outputs = self.outputs()
+        return (8  # version, locktime
+                + len(var_int_bytes(len(inputs)))
+                + sum(self.estimated_input_size(txin, self._sign_schnorr) for txin in inputs)
+                + len(var_int_bytes(len(outputs)))
+                + sum(self.estimated_output_size(o) for o in outputs))
+
+    @staticmethod
+    def _push_size(n):
+        '''Size of the opcode op_push() emits to push n bytes.'''
+        if n < 0x4c:
+            return 1
+        elif n < 0xff:
+            return 2
+        elif n < 0xffff:
+            return 3
+        return 5
+
+    @classmethod
+    def estimated_input_script_size(self, txin, sign_schnorr=False):
+        '''Size in bytes of input_script(txin, estimate_size=True), worked out
+        from the input type instead of building a dummy script.'''
+        scriptSig = txin.get('scriptSig')
+        if scriptSig is not None:
+            return len(scriptSig) // 2
+        _type = txin['type']
+        siglen = 0x41 if sign_schnorr else 0x48
+        size = txin.get('num_sig', 1) * (1 + siglen)
+        if _type == 'p2pk':
+            return size
+        pubkey_size = self.estimate_pubkey_size_for_txin(txin)
+        if _type == 'p2pkh':
+            return size + 1 + pubkey_size
+        elif _type == 'p2sh':
+            # OP_0 <sigs> <OP_m <pubkeys> OP_n OP_CHECKMULTISIG>
+            num_pubkeys = len(txin.get('x_pubkeys', [None]))
+            redeem_size = 3 + num_pubkeys * (self._push_size(pubkey_size) + pubkey_size)
+            return 1 + size + self._push_size(redeem_size) + redeem_size
+        # coinbase or unknown without a scriptSig: input_script raises
+        return len(self.input_script(txin, True, sign_schnorr=sign_schnorr)) // 2
 
     @classmethod
     def estimated_input_size(self, txin, sign_schnorr=False):
         '''Return an estimated of serialized input size in bytes.'''
-        script = self.input_script(txin, True, sign_schnorr=sign_schnorr)
-        return len(self.serialize_input(txin, script, True)) // 2  # ASCII hex string
+        script_size = self.estimated_input_script_size(txin, sign_schnorr=sign_schnorr)
+        # outpoint, script length and script, sequence
+        return 36 + len(var_int_bytes(script_size)) + script_size + 4
+
+    @staticmethod
+    def estimated_output_size(output):
+        '''Return the serialized size of an output in bytes.'''
+        script_size = len(output[1].to_script())
+        return 8 + len(var_int_bytes(script_size)) + script_size
 
     def signature_count(self):
         r = 0
@@ -940,31 +1145,71 @@ class Transaction:
                     reason.insert(0, repr(e))
             return False
 
+    @staticmethod
+    def verify_signatures(items, *, max_workers=None):
+        ''' Batch version of verify_signature(). `items` is a sequence of
+        (pubkey, sig, msghash) tuples, each as for verify_signature(). Returns
+        a list of bools, one per item in the same order. Bad or garbage items
+        don't raise but are simply False, so that callers can report exactly
+        which ones failed.
+
+        Schnorr (64 byte) and ECDSA signatures may be mixed. Each pubkey is
+        only parsed once per batch and, with libsecp256k1, large batches are
+        checked on up to SIGN_THREADS threads (or `max_workers`, if given). '''
+        items = list(items)
+        if max_workers is None:
+            max_workers = SIGN_THREADS if len(items) >= VERIFY_PARALLEL_MIN else 1
+        schnorr_idxs, ecdsa_idxs = [], []
+        for n, (_, sig, _) in enumerate(items):
+            (schnorr_idxs if isinstance(sig, bytes) and len(sig) == 64 else ecdsa_idxs).append(n)
+        results = [False] * len(items)
+        for idxs, verify_batch in ((schnorr_idxs, schnorr.verify_batch),
+                                   (ecdsa_idxs, ecdsa_verify_batch)):
+            if idxs:
+                for n, ok in zip(idxs, verify_batch([items[n] for n in idxs], max_workers=max_workers)):
+                    results[n] = ok
+        return results
 
     @staticmethod
-    def _ecdsa_sign(sec, pre_hash):
+    def _ecdsa_sign(sec, pre_hash, *, verify=True):
         pkey = regenerate_key(sec)
         secexp = pkey.secret
         private_key = MySigningKey.from_secret_exponent(secexp, curve = SECP256k1)
-        public_key = private_key.get_verifying_key()
         sig = private_key.sign_digest_deterministic(pre_hash, hashfunc=hashlib.sha256, sigencode = ecdsa.util.sigencode_der)
-        assert public_key.verify_digest(sig, pre_hash, sigdecode = ecdsa.util.sigdecode_der)
+        if verify:
+            public_key = private_key.get_verifying_key()
+            assert public_key.verify_digest(sig, pre_hash, sigdecode = ecdsa.util.sigdecode_der)
         return sig
 
     @staticmethod
-    def _schnorr_sign(pubkey, sec, pre_hash):
-        pubkey = bytes.fromhex(pubkey)
+    def _schnorr_sign(pubkey, sec, pre_hash, *, verify=True):
         sig = schnorr.sign(sec, pre_hash)
-        assert schnorr.verify(pubkey, sig, pre_hash)  # verify what we just signed
+        if verify:
+            pubkey = bytes.fromhex(pubkey)
+            assert schnorr.verify(pubkey, sig, pre_hash)  # verify what we just signed
         return sig
 
 
     def sign(self, keypairs):
+        jobs = self._get_signing_jobs(keypairs)
+        if jobs:
+            self._sign_jobs(jobs)
+        print_error("is_complete", self.is_complete())
+        self.raw = self.serialize()
+
+    def _get_signing_jobs(self, keypairs):
+        ''' Returns a list of (i, j, sec, compressed), one for each signature
+        we can add using `keypairs`: signature j of input i. The list is in
+        the order in which the signatures used to be added one at a time. '''
+        jobs = []
         for i, txin in enumerate(self.inputs()):
+            if self.is_txin_complete(txin):
+                continue
             pubkeys, x_pubkeys = self.get_sorted_pubkeys(txin)
+            num_missing = txin.get('num_sig', 1) - len(list(filter(None, txin['signatures'])))
             for j, (pubkey, x_pubkey) in enumerate(zip(pubkeys, x_pubkeys)):
-                if self.is_txin_complete(txin):
-                    # txin is complete
+                if num_missing <= 0:
+                    # txin will be complete
                     break
                 if pubkey in keypairs:
                     _pubkey = pubkey
@@ -976,28 +1221,59 @@ class Transaction:
                     continue
                 print_error(f"adding signature for input#{i} sig#{j}; {kname}: {_pubkey} schnorr: {self._sign_schnorr}")
                 sec, compressed = keypairs.get(_pubkey)
-                self._sign_txin(i, j, sec, compressed)
-        print_error("is_complete", self.is_complete())
-        self.raw = self.serialize()
+                jobs.append((i, j, sec, compressed))
+                if not txin['signatures'][j]:
+                    num_missing -= 1
+        return jobs
 
-    def _sign_txin(self, i, j, sec, compressed):
-        '''Note: precondition is self._inputs is valid (ie: tx is already deserialized)'''
-        pubkey = public_key_from_private_key(sec, compressed)
-        # add signature
-        nHashType = 0x00000041 # hardcoded, perhaps should be taken from unsigned input dict
-        pre_hash = Hash(bfh(self.serialize_preimage(i, nHashType)))
+    def _can_sign_in_parallel(self):
         if self._sign_schnorr:
-            sig = self._schnorr_sign(pubkey, sec, pre_hash)
+            return schnorr.has_fast_sign() and schnorr.has_fast_verify()
+        return ecc_fast.is_using_fast_ecc()
+
+    def _sign_jobs(self, jobs):
+        ''' Signs everything in `jobs` (see _get_signing_jobs) and adds the
+        signatures to the inputs.
+
+        This is done in three steps: all the sighashes are computed up front
+        from one SighashContext, then the signing and afterwards the
+        verification of the new signatures each run as one pass, over a thread
+        pool if that helps (see SIGN_THREADS). Results are applied in job order
+        so the outcome is the same as signing one input at a time.
+
+        Note: precondition is self._inputs is valid (ie: tx is already
+        deserialized) '''
+        nHashType = 0x00000041 # hardcoded, perhaps should be taken from unsigned input dict
+        sign_schnorr = self._sign_schnorr
+        sighash_context = SighashContext(self)
+        pre_hashes = {i: sighash_context.sighash(i, nHashType) for i, *_ in jobs}
+
+        def sign_job(job):
+            i, j, sec, compressed = job
+            pubkey = public_key_from_private_key(sec, compressed)
+            if sign_schnorr:
+                sig = self._schnorr_sign(pubkey, sec, pre_hashes[i], verify=False)
+            else:
+                sig = self._ecdsa_sign(sec, pre_hashes[i], verify=False)
+            return pubkey, sig
+
+        parallel = len(jobs) >= SIGN_PARALLEL_MIN and SIGN_THREADS > 1 and self._can_sign_in_parallel()
+        if parallel:
+            with ThreadPoolExecutor(max_workers=SIGN_THREADS, thread_name_prefix='TxSign') as executor:
+                results = list(executor.map(sign_job, jobs))
         else:
-            sig = self._ecdsa_sign(sec, pre_hash)
-        reason = []
-        if not self.verify_signature(bfh(pubkey), sig, pre_hash, reason=reason):
-            print_error(f"Signature verification failed for input#{i} sig#{j}, reason: {str(reason)}")
-            return None
-        txin = self._inputs[i]
-        txin['signatures'][j] = bh2u(sig + bytes((nHashType & 0xff,)))
-        txin['pubkeys'][j] = pubkey # needed for fd keys
-        return txin
+            results = [sign_job(job) for job in jobs]
+        verified = self.verify_signatures([(bfh(pubkey), sig, pre_hashes[i])
+                                           for (i, *_), (pubkey, sig) in zip(jobs, results)],
+                                          max_workers=SIGN_THREADS if parallel else 1)
+
+        for (i, j, _, _), (pubkey, sig), ok in zip(jobs, results, verified):
+            if not ok:
+                print_error(f"Signature verification failed for input#{i} sig#{j}")
+                continue
+            txin = self._inputs[i]
+            txin['signatures'][j] = bh2u(sig + bytes((nHashType & 0xff,)))
+            txin['pubkeys'][j] = pubkey # needed for fd keys
 
     def get_outputs(self):
         """convert pubkeys to addresses"""
@@ -1029,21 +1305,6 @@ class Transaction:
         }
         return out
 
-    # This cache stores foreign (non-wallet) tx's we fetched from the network
-    # for the purposes of the "fetch_input_data" mechanism. Its max size has
-    # been thoughtfully calibrated to provide a decent tradeoff between
-    # memory consumption and UX.
-    #
-    # In even aggressive/pathological cases this cache won't ever exceed
-    # 100MB even when full. [see ExpiringCache.size_bytes() to test it].
-    # This is acceptable considering this is Python + Qt and it eats memory
-    # anyway.. and also this is 2019 ;). Note that all tx's in this cache
-    # are in the non-deserialized state (hex encoded bytes only) as a memory
-    # savings optimization.  Please maintain that invariant if you modify this
-    # code, otherwise the cache may grow to 10x memory consumption if you
-    # put deserialized tx's in here.
-    _fetched_tx_cache = ExpiringCache(maxlen=1000, name="TransactionFetchCache")
-
     def fetch_input_data(self, wallet, done_callback=None, done_args=tuple(),
                          prog_callback=None, *, force=False, use_network=True):
         '''
@@ -1145,7 +1406,7 @@ class Transaction:
                             # do bear that in mind.
                             tx = Transaction(tx.raw)
                             try:
-                                tx.deserialize()
+                                tx.outputs()  # only the outputs are needed here
                                 # The below txid check is commented-out as
                                 # we trust wallet tx's and the network
                                 # tx's that fail this check are never
@@ -1326,25 +1587,67 @@ class Transaction:
 
     @classmethod
     def tx_cache_get(cls, txid : str) -> object:
-        ''' Attempts to retrieve txid from the tx cache that this class
-        keeps in-memory.  Returns None on failure. The returned tx is
-        not deserialized, and is a copy of the one in the cache. '''
-        tx = cls._fetched_tx_cache.get(txid)
-        if tx is not None and tx.raw:
-            # make sure to return a copy of the transaction from the cache
-            # so that if caller does .deserialize(), *his* instance will
-            # use up 10x memory consumption, and not the cached instance which
-            # should just be an undeserialized raw tx.
-            return Transaction(tx.raw)
+        ''' Attempts to retrieve txid from the process-wide tx store (see
+        tx_store.py). Returns None on failure. The returned tx is not
+        deserialized, and is a fresh instance each call. '''
+        raw = get_tx_store().get(txid)
+        if raw is not None:
+            return Transaction(raw.hex())
         return None
 
     @classmethod
     def tx_cache_put(cls, tx : object, txid : str = None):
-        ''' Puts a non-deserialized copy of tx into the tx_cache. '''
+        ''' Puts the raw bytes of tx into the process-wide tx store. '''
         if not tx or not tx.raw:
             raise ValueError('Please pass a tx which has a valid .raw attribute!')
         txid = txid or cls._txid(tx.raw)  # optionally, caller can pass-in txid to save CPU time for hashing
-        cls._fetched_tx_cache.put(txid, Transaction(tx.raw))
+        get_tx_store().put(txid, bfh(tx.raw))
+
+
+class SighashContext:
+    ''' The sighash state of a transaction, for signing or verifying its inputs.
+
+    On creation the parts of the preimage shared by all inputs (hashPrevouts,
+    hashSequence, hashOutputs, version and locktime) are computed once, after
+    which `preimage(i)` and `sighash(i)` only have to serialize input i's own
+    fields. Signing all N inputs of a tx with M outputs is thus O(N + M)
+    rather than O(N * (N + M)).
+
+    This is a snapshot: if anything but the signatures of the transaction
+    changes afterwards, create a new context. '''
+
+    def __init__(self, tx, *, use_cache=False):
+        self.tx = tx
+        self.inputs = tx.inputs()
+        self.hashPrevouts, self.hashSequence, self.hashOutputs = tx.calc_common_sighash(use_cache=use_cache)
+        self._head = struct.pack('<i', tx.version) + self.hashPrevouts + self.hashSequence
+        self._locktime = struct.pack('<I', tx.locktime)
+
+    def preimage(self, i, nHashType=0x00000041):
+        ''' Returns the preimage of input i as bytes. '''
+        if (nHashType & 0xff) != 0x41:
+            raise ValueError("other hashtypes not supported; submit a PR to fix this!")
+        txin = self.inputs[i]
+        preimage_script = bfh(self.tx.get_preimage_script(txin))
+        try:
+            amount = struct.pack('<Q', txin['value'])
+        except KeyError:
+            raise InputValueMissing
+        return b''.join((
+            self._head,
+            Transaction.serialize_outpoint_bytes(txin),
+            var_int_bytes(len(preimage_script)),
+            preimage_script,
+            amount,
+            struct.pack('<I', txin.get('sequence', 0xffffffff - 1)),
+            self.hashOutputs,
+            self._locktime,
+            struct.pack('<I', nHashType),
+        ))
+
+    def sighash(self, i, nHashType=0x00000041):
+        ''' Returns the hash of input i's preimage, which is what gets signed. '''
+        return Hash(self.preimage(i, nHashType))
 
 
 def tx_from_str(txt):
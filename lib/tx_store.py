@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+#
+# Electron Cash - A Bitcoin Cash SPV Wallet
+#
+# License: MIT License
+#
+''' A process-wide store of raw transactions, keyed by txid.
+
+Several subsystems (fetch_input_data, SLP validation and graph search, the
+"load transaction from the blockchain" tool, history export) all end up
+downloading the same ancestor transactions. They share this one store so
+that a tx fetched by any of them is available to all the others.
+
+The store keeps raw tx bytes (never deserialized Transaction objects) in a
+byte-bounded LRU that is split into shards, each with its own lock, so
+that the network thread, the SLP validator and the GUI don't contend on a
+single lock. Optionally an on-disk tier backs it so that fetched txs
+survive restarts: see `TxStore.enable_disk`. '''
+import os
+import struct
+import sys
+import threading
+
+from .bitcoin import Hash
+from .caches import ExpiringCache
+from .util import PrintError
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_MAX_BYTES = 256 * 1024 * 1024
+NUM_SHARDS = 16
+
+
+class _DiskTier(PrintError):
+    ''' An append-only file of (txid, length, raw tx) records, with an
+    in-memory index of where each record's payload lives. The index is
+    rebuilt on open by walking the record headers; a record cut short by a
+    crash is truncated away. Once the file outgrows `max_bytes` it is
+    compacted down to the newest half of its records. '''
+    FILENAME = 'txs.dat'
+    _header = struct.Struct('<32sI')
+
+    def __init__(self, directory, max_bytes):
+        self.path = os.path.join(directory, self.FILENAME)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def diagnostic_name(self):
+        return 'TxStore'
+
+    def _open(self):
+        self.f = open(self.path, 'a+b')
+        self.index = {}
+        f, hdr = self.f, self._header
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = 0
+        f.seek(0)
+        while pos + hdr.size <= end:
+            key, length = hdr.unpack(f.read(hdr.size))
+            if pos + hdr.size + length > end:
+                break
+            self.index[key] = (pos + hdr.size, length)
+            pos += hdr.size + length
+            f.seek(pos)
+        if pos != end:
+            self.print_error("{}: discarding {} bytes of partial record".format(self.path, end - pos))
+            f.truncate(pos)
+        self.size = pos
+
+    def get(self, key):
+        with self.lock:
+            loc = self.index.get(key)
+            if loc is None:
+                return None
+            self.f.seek(loc[0])
+            raw = self.f.read(loc[1])
+        if len(raw) != loc[1] or Hash(raw)[::-1] != key:
+            # corrupted on disk; forget it so it's fetched again
+            with self.lock:
+                self.index.pop(key, None)
+            return None
+        return raw
+
+    def put(self, key, raw):
+        with self.lock:
+            if key in self.index:
+                return
+            self.f.seek(0, os.SEEK_END)
+            self.f.write(self._header.pack(key, len(raw)) + raw)
+            self.f.flush()
+            self.index[key] = (self.size + self._header.size, len(raw))
+            self.size += self._header.size + len(raw)
+            if self.size > self.max_bytes:
+                self._compact()
+
+    def _compact(self):
+        ''' Rewrites the file keeping only the newest records that fit in
+        half the budget. Called with the lock held. '''
+        keep, total = [], 0
+        for key, (offset, length) in sorted(self.index.items(), key=lambda kv: kv[1][0], reverse=True):
+            total += self._header.size + length
+            if total > self.max_bytes // 2:
+                break
+            keep.append((key, offset, length))
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as out:
+            for key, offset, length in reversed(keep):
+                self.f.seek(offset)
+                out.write(self._header.pack(key, length) + self.f.read(length))
+        self.f.close()
+        os.replace(tmp, self.path)
+        self._open()
+        self.print_error("compacted to {} txs, {} bytes".format(len(self.index), self.size))
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+class TxStore(PrintError):
+    ''' Byte-bounded, sharded LRU of txid (hex str) -> raw tx bytes, with an
+    optional disk tier. Use the module-level `get_tx_store()` singleton
+    rather than creating these directly.
+
+    Callers are responsible for only putting txs whose txid they have
+    checked (i.e. hashed the raw bytes) -- txs read back from the disk tier
+    are verified, but the in-memory tier trusts what it is given. '''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, num_shards=NUM_SHARDS):
+        self.shards = [ExpiringCache(maxlen=sys.maxsize, maxbytes=max_bytes // num_shards, sizeof=len,
+                                     name="TxStore", register=False)
+                       for _ in range(num_shards)]
+        self.disk = None
+
+    def _shard(self, txid):
+        return self.shards[int(txid[-2:], 16) % len(self.shards)]
+
+    def get(self, txid):
+        ''' Returns the raw bytes for txid, or None if it isn't stored. Disk
+        hits are promoted to the memory tier. '''
+        shard = self._shard(txid)
+        raw = shard.get(txid)
+        if raw is None:
+            disk = self.disk
+            if disk is not None:
+                raw = disk.get(bytes.fromhex(txid))
+                if raw is not None:
+                    shard.put(txid, raw)
+        return raw
+
+    def put(self, txid, raw):
+        ''' Stores raw tx bytes under txid, in memory and (if enabled) on disk. '''
+        if not isinstance(raw, bytes):
+            raise TypeError('raw tx must be bytes')
+        self._shard(txid).put(txid, raw)
+        disk = self.disk
+        if disk is not None:
+            try:
+                disk.put(bytes.fromhex(txid), raw)
+            except OSError as e:
+                self.print_error("disk tier write failed, disabling it:", repr(e))
+                self.disable_disk()
+
+    def __contains__(self, txid):
+        return self.get(txid) is not None
+
+    def __len__(self):
+        return sum(len(s) for s in self.shards)
+
+    def size_bytes(self):
+        ''' The number of raw tx bytes held in memory. '''
+        return sum(s.nbytes for s in self.shards)
+
+    def stats(self):
+        ''' Memory tier stats, in the format of ExpiringCache.stats(), summed
+        over the shards, plus the number of txs in the disk tier. '''
+        shard_stats = [s.stats() for s in self.shards]
+        ret = {k: sum(st[k] for st in shard_stats)
+               for k in ('items', 'bytes', 'maxbytes', 'hits', 'misses', 'evictions')}
+        lookups = ret['hits'] + ret['misses']
+        ret['hit_rate'] = round(ret['hits'] / lookups, 4) if lookups else None
+        disk = self.disk
+        ret['disk_items'] = len(disk) if disk is not None else None
+        return dict(name="TxStore", **ret)
+
+    def clear(self):
+        ''' Empties the memory tier. The disk tier, if any, is left alone. '''
+        for s in self.shards:
+            s.clear()
+
+    def enable_disk(self, directory, max_bytes=DEFAULT_DISK_MAX_BYTES):
+        ''' Backs the store with an append-only file in `directory`. Returns
+        True on success; on failure the store just stays memory-only. '''
+        self.disable_disk()
+        try:
+            self.disk = _DiskTier(directory, max_bytes)
+        except OSError as e:
+            self.print_error("could not open disk tier in {}: {}".format(directory, repr(e)))
+            return False
+        self.print_error("disk tier {} has {} txs".format(self.disk.path, len(self.disk)))
+        return True
+
+    def disable_disk(self):
+        disk, self.disk = self.disk, None
+        if disk is not None:
+            disk.close()
+
+
+_tx_store = None
+_tx_store_lock = threading.Lock()
+
+def get_tx_store():
+    ''' Returns the process-wide TxStore, creating it on first use. '''
+    global _tx_store
+    if _tx_store is None:
+        with _tx_store_lock:
+            if _tx_store is None:
+                _tx_store = TxStore()
+    return _tx_store
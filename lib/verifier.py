@@ -20,6 +20,9 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import time
+from collections import defaultdict
+
 from .util import ThreadJob, bh2u
 from .bitcoin import Hash, hash_decode, hash_encode
 from . import networks
@@ -28,15 +31,27 @@ from .transaction import Transaction
 class SPV(ThreadJob):
     """ Simple Payment Verification """
 
+    # Merkle proofs are requested from every interface that follows our
+    # chain, round-robin, with at most this many requests outstanding.
+    MAX_OUTSTANDING = 200
+    # Requests unanswered after this many seconds (eg the interface they were
+    # sent to went away) are cancelled and sent again.
+    REQUEST_TIMEOUT = 60.0
+
     def __init__(self, network, wallet):
         self.wallet = wallet
         self.network = network
         self.blockchain = network.blockchain()
         self.merkle_roots = {}  # txid -> merkle root (once it has been verified)
-        self.requested_merkle = set()  # txid set of pending requests
+        self.requested_merkle = {}  # txid -> (message id, time requested) of pending requests
+        # (tx_hash, tx_height, pos, merkle_root) tuples of proofs received
+        # from the network but not yet checked against our headers. They
+        # are checked in bulk by process_proofs(), grouped by block.
+        self.pending_proofs = []
         self.qbusy = False
         self.cleaned_up = False
         self._need_release = False
+        self._next_interface = 0
 
     def _release(self):
         ''' Called from the Network (DaemonThread) -- to prevent race conditions
@@ -52,6 +67,23 @@ class SPV(ThreadJob):
         Network thread. '''
         self._need_release = True
 
+    def _get_interfaces(self, blockchain):
+        ''' The main interface first, then all others that are on the same
+        chain and done with their header verification. '''
+        main = self.network.interface
+        others = [i for i in self.network.get_interfaces(interfaces=True)
+                  if i is not main and getattr(i, 'blockchain', None) is blockchain
+                  and i.mode == i.MODE_DEFAULT]
+        return [main] + others
+
+    def _expire_requests(self):
+        now = time.time()
+        for tx_hash, (msg_id, t) in list(self.requested_merkle.items()):
+            if now - t > self.REQUEST_TIMEOUT:
+                self.print_error('merkle request timed out, will retry', tx_hash)
+                self.network.cancel_request_id(msg_id)
+                self.requested_merkle.pop(tx_hash, None)
+
     def run(self):
         if self._need_release:
             self._release()
@@ -67,9 +99,17 @@ class SPV(ThreadJob):
             self.spam_error("v.no blockchain", interface.server)
             return
 
+        self.process_proofs()
+        self._expire_requests()
+
         local_height = self.network.get_local_height()
         unverified = self.wallet.get_unverified_txs()
+        interfaces = None
+        self.qbusy = False
         for tx_hash, tx_height in unverified.items():
+            if len(self.requested_merkle) >= self.MAX_OUTSTANDING:
+                self.qbusy = True
+                break
             # do not request merkle branch if we already requested it
             if tx_hash in self.requested_merkle or tx_hash in self.merkle_roots:
                 continue
@@ -88,15 +128,21 @@ class SPV(ThreadJob):
                     if self.network.request_chunk(interface, index):
                         interface.print_error("verifier requesting chunk {} for height {}".format(index, tx_height))
                 continue
-            # enqueue request
+            if interfaces is None:
+                interfaces = self._get_interfaces(blockchain)
+            # enqueue request, spreading them over the interfaces
+            iface = interfaces[self._next_interface % len(interfaces)]
+            self._next_interface += 1
             msg_id = self.network.get_merkle_for_transaction(tx_hash, tx_height,
-                                                             self.verify_merkle)
+                                                             self.verify_merkle,
+                                                             max_qlen=None,
+                                                             interface=iface)
             self.qbusy = msg_id is None
             if self.qbusy:
                 # interface queue busy, will try again later
                 break
             self.print_error('requested merkle', tx_hash)
-            self.requested_merkle.add(tx_hash)
+            self.requested_merkle[tx_hash] = (msg_id, time.time())
 
         if self.network.blockchain() != self.blockchain:
             self.blockchain = self.network.blockchain()
@@ -111,38 +157,59 @@ class SPV(ThreadJob):
             return
         params = response['params']
         merkle = response['result']
-        # Verify the hash of the server-provided merkle branch to a
-        # transaction matches the merkle root of its block
+        # Compute the merkle root from the server-provided merkle branch. It
+        # is checked against the merkle root of the block's header, together
+        # with all other proofs for that block, in process_proofs()
         tx_hash = params[0]
-        tx_height = merkle.get('block_height')
-        pos = merkle.get('pos')
         try:
+            tx_height = int(merkle.get('block_height'))
+            pos = merkle.get('pos')
             merkle_root = self.hash_merkle_root(merkle['merkle'], tx_hash, pos)
         except Exception as e:
             self.print_error(f"exception while verifying tx {tx_hash}: {repr(e)}")
             return
+        self.pending_proofs.append((tx_hash, tx_height, pos, merkle_root))
+        if len(self.pending_proofs) >= self.MAX_OUTSTANDING // 2:
+            self.process_proofs()
 
-        header = self.network.blockchain().read_header(tx_height)
-        # FIXME: if verification fails below,
-        # we should make a fresh connection to a server to
-        # recover from this, as this TX will now never verify
-        if not header:
-            self.print_error(
-                "merkle verification failed for {} (missing header {})"
-                .format(tx_hash, tx_height))
+    def process_proofs(self):
+        ''' Checks the merkle roots of all pending proofs against our headers,
+        reading each block's header only once, and hands the verified txs to
+        the wallet in one go. '''
+        proofs, self.pending_proofs = self.pending_proofs, []
+        if not proofs:
             return
-        if header.get('merkle_root') != merkle_root:
-            self.print_error(
-                "merkle verification failed for {} (merkle root mismatch {} != {})"
-                .format(tx_hash, header.get('merkle_root'), merkle_root))
+        by_height = defaultdict(list)
+        for proof in proofs:
+            by_height[proof[1]].append(proof)
+        blockchain = self.network.blockchain()
+        verified = []
+        for tx_height, height_proofs in by_height.items():
+            header = blockchain.read_header(tx_height)
+            for tx_hash, _, pos, merkle_root in height_proofs:
+                # FIXME: if verification fails below,
+                # we should make a fresh connection to a server to
+                # recover from this, as this TX will now never verify
+                if not header:
+                    self.print_error(
+                        "merkle verification failed for {} (missing header {})"
+                        .format(tx_hash, tx_height))
+                    continue
+                if header.get('merkle_root') != merkle_root:
+                    self.print_error(
+                        "merkle verification failed for {} (merkle root mismatch {} != {})"
+                        .format(tx_hash, header.get('merkle_root'), merkle_root))
+                    continue
+                # we passed all the tests
+                self.merkle_roots[tx_hash] = merkle_root
+                # note: we could pop in the beginning, but then we would request
+                # this proof again in case of verification failure from the same server
+                self.requested_merkle.pop(tx_hash, None)
+                verified.append((tx_hash, (tx_height, header.get('timestamp'), pos), merkle_root))
+        if not verified:
             return
-        # we passed all the tests
-        self.merkle_roots[tx_hash] = merkle_root
-        # note: we could pop in the beginning, but then we would request
-        # this proof again in case of verification failure from the same server
-        self.requested_merkle.discard(tx_hash)
-        self.print_error("verified %s" % tx_hash)
-        self.wallet.add_verified_tx(tx_hash, (tx_height, header.get('timestamp'), pos))
+        self.print_error("verified {} txs in {} blocks".format(len(verified), len(by_height)))
+        self.wallet.add_verified_txs(verified)
         if self.is_up_to_date() and self.wallet.is_up_to_date() and not self.qbusy:
             self.wallet.save_verified_tx(write=True)
             self.network.trigger_callback('wallet_updated', self.wallet)  # This callback will happen very rarely.. mostly right as the last tx is verified. It's to ensure GUI is updated fully.
@@ -185,7 +252,7 @@ class SPV(ThreadJob):
 
     def remove_spv_proof_for_tx(self, tx_hash):
         self.merkle_roots.pop(tx_hash, None)
-        self.requested_merkle.discard(tx_hash)
+        self.requested_merkle.pop(tx_hash, None)
 
     def is_up_to_date(self):
-        return not self.requested_merkle
+        return not self.requested_merkle and not self.pending_proofs
@@ -30,6 +30,8 @@
 
 import copy
 import errno
+import hashlib
+import itertools
 import json
 import os
 import queue
@@ -51,12 +53,13 @@ from . import networks
 from .storage import multisig_type
 
 from . import transaction
-from .transaction import Transaction, InputValueMissing
+from .transaction import Transaction, TxView, SerializationError
 from .plugins import run_hook
 from . import bitcoin
 from . import coinchooser
 from .synchronizer import Synchronizer
 from .verifier import SPV
+from .wallet_events import WalletEvents, WalletEventsJob
 from . import schnorr
 from . import ecc_fast
 
@@ -188,6 +191,10 @@ class Abstract_Wallet(PrintError):
         self.ui_emit_validation_fetch = None
         self.ui_emit_validity_updated = None  # Qt GUI attaches a signal to this attribute -- see slp_check_validation
         self.slp_graph_0x01, self.slp_graph_0x01_nft = None, None
+        # Batched change notifications for whoever subscribes; flushed by
+        # self.events_job on the network thread, see wallet_events.py
+        self.events = WalletEvents(self.diagnostic_name())
+        self.events_job = None
 
         # Removes defunct entries from self.pruned_txo asynchronously
         self.pruned_txo_cleaner_thread = None
@@ -204,6 +211,26 @@ class Abstract_Wallet(PrintError):
         # Python's GIL makes thread-safe implicitly).
         self._addr_bal_cache = {}
 
+        # (selection key, coins, prng seed) of the last coin selection done by
+        # make_unsigned_transaction, see there.
+        self._last_coin_selection = None
+
+        # Cache of Address -> (status, n_confirmed, hasher) where status is the
+        # Electrum protocol status hash of the address history, and hasher is
+        # a sha256 object that has consumed the leading n_confirmed confirmed
+        # history items.  The hasher lets a changed history be re-hashed from
+        # where the common confirmed prefix ends, rather than from scratch.
+        # Entries are replaced whenever the address history changes. Same
+        # threading rules as self._addr_bal_cache above.
+        self._addr_status_cache = {}
+
+        # Address -> the last status hash the server reported for it that
+        # matched our history for it.  Persisted as 'addr_status' so that the
+        # Synchronizer can tell on startup which addresses are known to have
+        # been up to date at the end of the last session (see
+        # Synchronizer.initialize).  Populated in load_transactions.
+        self._addr_server_status = {}
+
         # We keep a set of the wallet and receiving addresses so that is_mine()
         # checks are O(logN) rather than O(N). This creates/resets that cache.
         self.invalidate_address_set_cache()
@@ -223,7 +250,9 @@ class Abstract_Wallet(PrintError):
         self.frozen_coins = set(storage.get('frozen_coins', []))
         # address -> list(txid, height)
         history = storage.get('addr_history',{})
-        self._history = self.to_Address_dict(history)
+        # storage gives us lists; use (tx_hash, height) tuples as the network does
+        self._history = {addr: [tuple(item) for item in hist]
+                         for addr, hist in self.to_Address_dict(history).items()}
 
         # there is a difference between wallet.up_to_date and interface.is_up_to_date()
         # interface.is_up_to_date() returns true when all requests have been answered and processed
@@ -247,6 +276,17 @@ class Abstract_Wallet(PrintError):
 
         # Verified transactions.  Each value is a (height, timestamp, block_pos) tuple.  Access with self.lock.
         self.verified_tx = storage.get('verified_tx3', {})
+        # height -> set of tx hashes in self.verified_tx at that height, so
+        # that a reorg only has to look at the affected blocks. Always modify
+        # self.verified_tx through _set_verified_tx / _pop_verified_tx.
+        self._verified_tx_heights = defaultdict(set)
+        for tx_hash, (tx_height, timestamp, pos) in self.verified_tx.items():
+            self._verified_tx_heights[tx_height].add(tx_hash)
+        # height -> merkle root of the block the verified txs at that height
+        # were proven against.  Lets undo_verifications() tell exactly which
+        # blocks were reorged out.
+        self.verified_block_roots = {int(h): root for h, root in storage.get('verified_block_roots', {}).items()
+                                     if int(h) in self._verified_tx_heights}
 
         # save wallet type the first time
         if self.storage.get('wallet_type') is None:
@@ -319,6 +359,8 @@ class Abstract_Wallet(PrintError):
                 self.print_error("removing unreferenced tx", tx_hash)
                 self.transactions.pop(tx_hash)
 
+        self.load_address_statuses()
+
         self.slpv1_validity = self.storage.get('slpv1_validity', {})
         self.token_types = self.storage.get('token_types', {})
         self.tx_tokinfo = self.storage.get('tx_tokinfo', {})
@@ -329,6 +371,7 @@ class Abstract_Wallet(PrintError):
             for txid, txdict in addrdict.items():
                 # need to do this iteration since json stores int keys as decimal strings.
                 self._slp_txo[addr][txid] = {int(idx):d for idx,d in txdict.items()}
+        self._slp_token_addrs = None  # built on demand, see get_slp_token_addresses()
 
         ok = self.storage.get('slp_data_version', False)
         if ok != 3:
@@ -355,6 +398,9 @@ class Abstract_Wallet(PrintError):
             self.storage.put('pruned_txo', self.pruned_txo)
             history = self.from_Address_dict(self._history)
             self.storage.put('addr_history', history)
+            self.storage.put('addr_status', self.from_Address_dict(
+                {addr: [status, len(self._history.get(addr, ()))]
+                 for addr, status in self._addr_server_status.items()}))
 
             ### SLP stuff
             self.storage.put('slpv1_validity', self.slpv1_validity)
@@ -367,6 +413,43 @@ class Abstract_Wallet(PrintError):
             if write:
                 self.storage.write()
 
+    def load_address_statuses(self):
+        '''Loads the persisted server statuses saved by save_transactions.
+        Each is stored together with the length of the history it was seen
+        with, and entries that no longer agree with the history are dropped.
+        The survivors also prime self._addr_status_cache, so statuses need
+        not be re-hashed from the (unchanged) histories on startup.'''
+        self._addr_server_status = {}
+        d = self.storage.get('addr_status', {})
+        if not isinstance(d, dict):
+            return
+        dropped = 0
+        for addr, item in self.to_Address_dict(d).items():
+            try:
+                status, hist_len = item
+            except (TypeError, ValueError):
+                dropped += 1
+                continue
+            hist = self._history.get(addr)
+            if hist is None or len(hist) != hist_len or bool(status) != bool(hist):
+                dropped += 1
+                continue
+            self._addr_server_status[addr] = status
+            if status:
+                self._addr_status_cache[addr] = (status, 0, None)
+        if dropped:
+            self.print_error("load_address_statuses: dropped {} stale entries".format(dropped))
+
+    def set_address_server_status(self, address, status):
+        '''Called by the Synchronizer once the wallet's history for address
+        is known to match the server's status for it.'''
+        self._addr_server_status[address] = status
+
+    def get_address_server_statuses(self):
+        '''Returns a copy of the Address -> status dict of statuses the
+        server reported and that matched our history at the time.'''
+        return self._addr_server_status.copy()
+
     def activate_slp(self):
         # This gets called in two situations:
         # - Upon wallet startup, it checks config to see if SLP should be enabled.
@@ -498,6 +581,7 @@ class Abstract_Wallet(PrintError):
     def save_verified_tx(self, write=False):
         with self.lock:
             self.storage.put('verified_tx3', self.verified_tx)
+            self.storage.put('verified_block_roots', self.verified_block_roots)
             if write:
                 self.storage.write()
 
@@ -510,6 +594,8 @@ class Abstract_Wallet(PrintError):
             self.pruned_txo_values = set()
             self.save_transactions()
             self._addr_bal_cache = {}
+            self._addr_status_cache = {}
+            self._addr_server_status = {}
             self._history = {}
             self.tx_addr_hist = defaultdict(set)
 
@@ -527,6 +613,8 @@ class Abstract_Wallet(PrintError):
 
         for addr in set(self._history) - set(my_addrs):
             self._history.pop(addr)
+            self._addr_status_cache.pop(addr, None)
+            self._addr_server_status.pop(addr, None)
             save = True
 
         for addr in my_addrs:
@@ -613,6 +701,7 @@ class Abstract_Wallet(PrintError):
             if changed:
                 run_hook('set_label', self, name, text)
                 self.storage.put('labels', self.labels)
+                self.events.label_changed(name, self.labels.get(name))
 
             return changed
 
@@ -684,10 +773,34 @@ class Abstract_Wallet(PrintError):
         sequence = self.get_address_index(address)
         return self.get_pubkeys(*sequence)
 
+    def _set_verified_tx(self, tx_hash, info):
+        ''' Call with self.lock held. '''
+        self._pop_verified_tx(tx_hash)
+        self.verified_tx[tx_hash] = info
+        self._verified_tx_heights[info[0]].add(tx_hash)
+
+    def _pop_verified_tx(self, tx_hash):
+        ''' Call with self.lock held. '''
+        info = self.verified_tx.pop(tx_hash, None)
+        if info is not None:
+            s = self._verified_tx_heights.get(info[0])
+            if s is not None:
+                s.discard(tx_hash)
+                if not s:
+                    del self._verified_tx_heights[info[0]]
+                    self.verified_block_roots.pop(info[0], None)
+        return info
+
+    def _clear_verified_tx(self):
+        ''' Call with self.lock held. '''
+        self.verified_tx.clear()
+        self._verified_tx_heights.clear()
+        self.verified_block_roots.clear()
+
     def add_unverified_tx(self, tx_hash, tx_height):
         with self.lock:
             if tx_height == 0 and tx_hash in self.verified_tx:
-                self.verified_tx.pop(tx_hash)
+                self._pop_verified_tx(tx_hash)
                 if self.verifier:
                     self.verifier.merkle_roots.pop(tx_hash, None)
 
@@ -699,10 +812,26 @@ class Abstract_Wallet(PrintError):
         # Remove from the unverified map and add to the verified map and
         with self.lock:
             self.unverified_tx.pop(tx_hash, None)
-            self.verified_tx[tx_hash] = info  # (tx_height, timestamp, pos)
+            self._set_verified_tx(tx_hash, info)  # (tx_height, timestamp, pos)
             height, conf, timestamp = self.get_tx_height(tx_hash)
+        self.events.tx_verified(tx_hash, height)
         self.network.trigger_callback('verified2', self, tx_hash, height, conf, timestamp)
 
+    def add_verified_txs(self, items):
+        ''' Bulk version of add_verified_tx used by the verifier. items is an
+        iterable of (tx_hash, (tx_height, timestamp, pos), merkle_root). '''
+        notify = []
+        with self.lock:
+            for tx_hash, info, merkle_root in items:
+                self.unverified_tx.pop(tx_hash, None)
+                self._set_verified_tx(tx_hash, info)
+                if merkle_root:
+                    self.verified_block_roots[info[0]] = merkle_root
+                notify.append((tx_hash,) + self.get_tx_height(tx_hash))
+        for tx_hash, height, conf, timestamp in notify:
+            self.events.tx_verified(tx_hash, height)
+            self.network.trigger_callback('verified2', self, tx_hash, height, conf, timestamp)
+
     def get_unverified_txs(self):
         '''Returns a map from tx hash to transaction height'''
         with self.lock:
@@ -715,16 +844,25 @@ class Abstract_Wallet(PrintError):
             return len([1 for height in self.unverified_tx.values() if height > 0])
 
     def undo_verifications(self, blockchain, height):
-        '''Used by the verifier when a reorg has happened'''
+        '''Used by the verifier when a reorg has happened.  Only blocks at or
+        above height are looked at, and each block's header is read once.'''
         txs = set()
         with self.lock:
-            for tx_hash, item in list(self.verified_tx.items()):
-                tx_height, timestamp, pos = item
-                if tx_height >= height:
-                    header = blockchain.read_header(tx_height)
-                    # fixme: use block hash, not timestamp
-                    if not header or header.get('timestamp') != timestamp:
-                        self.verified_tx.pop(tx_hash, None)
+            for tx_height in sorted(h for h in self._verified_tx_heights if h >= height):
+                header = blockchain.read_header(tx_height)
+                root = self.verified_block_roots.get(tx_height)
+                for tx_hash in list(self._verified_tx_heights.get(tx_height, ())):
+                    if not header:
+                        ok = False
+                    elif root is not None:
+                        ok = header.get('merkle_root') == root
+                    else:
+                        # No merkle root was recorded (verified by an older
+                        # version).
+                        # fixme: use block hash, not timestamp
+                        ok = header.get('timestamp') == self.verified_tx[tx_hash][1]
+                    if not ok:
+                        self._pop_verified_tx(tx_hash)
                         txs.add(tx_hash)
         if txs:
             self._addr_bal_cache = {}  # this is probably not necessary -- as the receive_history_callback will invalidate bad cache items -- but just to be paranoid we clear the whole balance cache on reorg anyway as a safety measure
@@ -1110,29 +1248,67 @@ class Abstract_Wallet(PrintError):
 
     def get_utxos(self, *, domain = None, exclude_frozen = False, mature = False, confirmed_only = False, exclude_slp = True):
         ''' Note that exclude_frozen = True checks for BOTH address-level and coin-level frozen status. '''
-        coins = []
+        return list(self.iter_utxos(domain=domain, exclude_frozen=exclude_frozen, mature=mature,
+                                    confirmed_only=confirmed_only, exclude_slp=exclude_slp, ordered=False))
+
+    def iter_utxos(self, *, domain = None, exclude_frozen = False, mature = False, confirmed_only = False, exclude_slp = True,
+                   ordered = True, after = None):
+        ''' Generator version of get_utxos. With `ordered` the coins come
+        address by address in domain order, and sorted by (prevout_hash,
+        prevout_n) within an address, so that `after` can resume a listing:
+        pass the "prevout_hash:n" of the last coin seen to get only the coins
+        that come after it. That coin doesn't need to be unspent anymore,
+        just known to the wallet. '''
+        after_addr = after_key = None
+        if after is not None:
+            prevout_hash, n = after.split(':')
+            after_key = (prevout_hash, int(n))
+            with self.lock:
+                for addr, l in self.txo.get(prevout_hash, {}).items():
+                    if any(nn == after_key[1] for nn, v, is_cb in l):
+                        after_addr = addr
+                        break
+            if after_addr is None:
+                raise ValueError(f"unknown coin: {after}")
         if domain is None:
             domain = self.get_addresses()
+            if after_addr is not None:
+                # skip straight to the address we resume from
+                i = self.get_address_position(after_addr)
+                if i is None:
+                    raise ValueError(f"unknown coin: {after}")
+                domain = itertools.islice(domain, i, None)
+        elif after_addr is not None:
+            if after_addr not in domain:
+                raise ValueError(f"unknown coin: {after}")
+            domain = itertools.dropwhile(lambda addr: addr != after_addr, domain)
         if exclude_frozen:
-            domain = set(domain) - self.frozen_addresses
+            domain = [addr for addr in domain if addr not in self.frozen_addresses]
+        local_height = self.get_local_height()
         for addr in domain:
             utxos = self.get_addr_utxo(addr, exclude_slp=exclude_slp)
-            for x in utxos.values():
+            coins = utxos.values()
+            if ordered:
+                coins = sorted(coins, key=lambda x: (x['prevout_hash'], x['prevout_n']))
+            for x in coins:
+                if after_addr is not None and (x['prevout_hash'], x['prevout_n']) <= after_key:
+                    continue
                 if exclude_frozen and x['is_frozen_coin']:
                     continue
                 if confirmed_only and x['height'] <= 0:
                     continue
-                if mature and x['coinbase'] and x['height'] + COINBASE_MATURITY > self.get_local_height():
+                if mature and x['coinbase'] and x['height'] + COINBASE_MATURITY > local_height:
                     continue
-                coins.append(x)
-                continue
-        return coins
+                yield x
+            after_addr = None
 
     def get_slp_utxos(self, slpTokenId, *, domain = None, exclude_frozen = False, confirmed_only = False, slp_include_invalid=False, slp_include_baton=False):
         ''' Note that exclude_frozen = True checks for BOTH address-level and coin-level frozen status. '''
         coins = []
         if domain is None:
-            domain = self.get_addresses()
+            # only the addresses that ever held this token can have its coins
+            token_addrs = self.get_slp_token_addresses(slpTokenId)
+            domain = [addr for addr in self.get_addresses() if addr in token_addrs]
         if exclude_frozen:
             domain = set(domain) - self.frozen_addresses
         for addr in domain:
@@ -1152,6 +1328,14 @@ class Abstract_Wallet(PrintError):
     def get_addresses(self):
         return self.get_receiving_addresses() + self.get_change_addresses()
 
+    def get_address_position(self, address):
+        ''' Returns the index of `address` in get_addresses(), or None if it
+        isn't one of the wallet's addresses. '''
+        try:
+            return self.get_addresses().index(address)
+        except ValueError:
+            return None
+
     def get_frozen_balance(self):
         if not self.frozen_coins:
             # performance short-cut -- get the balance of the frozen address set only IFF we don't have any frozen coins
@@ -1195,6 +1379,49 @@ class Abstract_Wallet(PrintError):
         assert isinstance(address, Address)
         return self._history.get(address, [])
 
+    @staticmethod
+    def _make_status_entry(hist, base_entry=None, base_hist=None):
+        '''Returns a (status, n_confirmed, hasher) tuple for hist, suitable
+        for self._addr_status_cache.  If base_entry (the cache entry for
+        base_hist) is given, the confirmed items hist shares with base_hist
+        are not hashed again.'''
+        n0, hasher = 0, None
+        if base_entry is not None:
+            n = base_entry[1]  # 0 (with a None hasher) for entries primed from storage
+            if n and n <= len(hist) and hist[:n] == base_hist[:n]:
+                n0, hasher = n, base_entry[2].copy()
+        if hasher is None:
+            hasher = hashlib.sha256()
+        n_confirmed = n0
+        while n_confirmed < len(hist) and hist[n_confirmed][1] > 0:
+            n_confirmed += 1
+        hasher.update(''.join('%s:%d:' % (tx_hash, height)
+                              for tx_hash, height in hist[n0:n_confirmed]).encode('ascii'))
+        if not hist:
+            return None, 0, hasher
+        h = hasher
+        if n_confirmed < len(hist):
+            # unconfirmed items get hashed into a copy, as their heights change
+            h = hasher.copy()
+            h.update(''.join('%s:%d:' % (tx_hash, height)
+                             for tx_hash, height in hist[n_confirmed:]).encode('ascii'))
+        return h.hexdigest(), n_confirmed, hasher
+
+    def get_address_status(self, address, hist=None):
+        '''Returns the Electrum protocol status hash (a hex string) for the
+        address' history, or None if the history is empty.  Pass hist to get
+        the status of a candidate history (such as one received from a
+        server) instead of the one the wallet currently has.  Cached, see
+        self._addr_status_cache.'''
+        cur_hist = self.get_address_history(address)
+        entry = self._addr_status_cache.get(address)
+        if entry is None:
+            entry = self._make_status_entry(cur_hist)
+            self._addr_status_cache[address] = entry
+        if hist is None or hist == cur_hist:
+            return entry[0]
+        return self._make_status_entry(hist, entry, cur_hist)[0]
+
     def _clean_pruned_txo_thread(self):
         ''' Runs in the thread self.pruned_txo_cleaner_thread which is only
         active if self.network. Cleans the self.pruned_txo dict and the
@@ -1343,6 +1570,7 @@ class Abstract_Wallet(PrintError):
             self.print_error("add_transaction: WARNING a tx came in from the network with 0 inputs! Bad server? Ignoring tx:", tx_hash)
             return
         is_coinbase = tx.inputs()[0]['type'] == 'coinbase'
+        coins_added, coins_spent = [], []  # for self.events
         with self.lock:
             # HELPER FUNCTIONS
             def add_to_self_txi(tx_hash, addr, ser, v):
@@ -1398,6 +1626,7 @@ class Abstract_Wallet(PrintError):
                     for n, v, is_cb in dd.get(addr, []):
                         if n == prevout_n:
                             add_to_self_txi(tx_hash, addr, ser, v)
+                            coins_spent.append(ser)
                             break
                     else:
                         # Coin's spend tx came in before its receive tx: flag
@@ -1415,6 +1644,7 @@ class Abstract_Wallet(PrintError):
                     addr2, v = find_in_self_txo(prevout_hash, prevout_n)
                     if addr2 is not None and self.is_mine(addr2):
                         add_to_self_txi(tx_hash, addr2, ser, v)
+                        coins_spent.append(ser)
                         self._addr_bal_cache.pop(addr2, None)  # invalidate cache entry
                     else:
                         # Not found in self.txo. It may still be one of ours
@@ -1454,10 +1684,12 @@ class Abstract_Wallet(PrintError):
                     l.append((n, v, is_coinbase))
                     del l
                     self._addr_bal_cache.pop(addr, None)  # invalidate cache entry
+                    coins_added.append(ser)
                 # give v to txi that spends me
                 next_tx = pop_pruned_txo(ser)
                 if next_tx is not None and mine:
                     add_to_self_txi(next_tx, addr, ser, v)
+                    coins_spent.append(ser)
             # don't keep empty entries in self.txo
             if not d:
                 self.txo.pop(tx_hash, None)
@@ -1469,6 +1701,30 @@ class Abstract_Wallet(PrintError):
             ### SLP: Handle incoming SLP transaction outputs here
             self.handleSlpTransaction(tx_hash, tx)
 
+        self.events.tx_added(tx_hash)
+        self.events.utxos_changed(coins_added, coins_spent)
+
+    def _put_slp_txo(self, addr, tx_hash, n, d):
+        self._slp_txo[addr][tx_hash][n] = d
+        if self._slp_token_addrs is not None and d['token_id'] is not None:
+            self._slp_token_addrs[d['token_id']].add(addr)
+
+    def get_slp_token_addresses(self, slpTokenId):
+        ''' Returns the set of addresses that have (or once had) a txo of
+        token slpTokenId, so per-token lookups need not scan every address
+        in the wallet. May include addresses whose token coins were since
+        spent or dropped; callers re-check against the wallet. '''
+        with self.lock:
+            if self._slp_token_addrs is None:
+                index = defaultdict(set)
+                for addr, addrdict in self._slp_txo.items():
+                    for txdict in addrdict.values():
+                        for txo in txdict.values():
+                            if txo['token_id'] is not None:
+                                index[txo['token_id']].add(addr)
+                self._slp_token_addrs = index
+            return set(self._slp_token_addrs.get(slpTokenId, ()))
+
     """
     Callers are expected to take lock(s). We take no locks
     """
@@ -1481,11 +1737,11 @@ class Abstract_Wallet(PrintError):
             token_type = 'SLP%d'%(e.args[0],)
             for i, (_type, addr, _) in enumerate(txouts):
                 if _type == TYPE_ADDRESS and self.is_mine(addr):
-                    self._slp_txo[addr][tx_hash][i] = {
+                    self._put_slp_txo(addr, tx_hash, i, {
                             'type': token_type,
                             'qty': None,
                             'token_id': None,
-                            }
+                            })
             return
         except (SlpParsingError, IndexError, OpreturnError):
             return
@@ -1497,31 +1753,31 @@ class Abstract_Wallet(PrintError):
             for i, qty in enumerate(amounts):
                 _type, addr, _ = txouts[i]
                 if _type == TYPE_ADDRESS and qty > 0 and self.is_mine(addr):
-                    self._slp_txo[addr][tx_hash][i] = {
+                    self._put_slp_txo(addr, tx_hash, i, {
                             'type': 'SLP%d'%(slpMsg.token_type,),
                             'token_id': token_id_hex,
                             'qty': qty,
-                            }
+                            })
         elif slpMsg.transaction_type == 'GENESIS':
             token_id_hex = tx_hash
             try:
                 _type, addr, _ = txouts[1]
                 if _type == TYPE_ADDRESS:
                     if slpMsg.op_return_fields['initial_token_mint_quantity'] > 0 and self.is_mine(addr):
-                        self._slp_txo[addr][tx_hash][1] = {
+                        self._put_slp_txo(addr, tx_hash, 1, {
                                 'type': 'SLP%d'%(slpMsg.token_type,),
                                 'token_id': token_id_hex,
                                 'qty': slpMsg.op_return_fields['initial_token_mint_quantity'],
-                            }
+                            })
                     if slpMsg.op_return_fields['mint_baton_vout'] is not None:
                         i = slpMsg.op_return_fields['mint_baton_vout']
                         _type, addr, _ = txouts[i]
                         if _type == TYPE_ADDRESS:
-                            self._slp_txo[addr][tx_hash][i] = {
+                            self._put_slp_txo(addr, tx_hash, i, {
                                     'type': 'SLP%d'%(slpMsg.token_type,),
                                     'token_id': token_id_hex,
                                     'qty': 'MINT_BATON',
-                                }
+                                })
             except IndexError: # if too few outputs (compared to mint_baton_vout)
                 pass
         elif slpMsg.transaction_type == "MINT":
@@ -1530,20 +1786,20 @@ class Abstract_Wallet(PrintError):
                 _type, addr, _ = txouts[1]
                 if _type == TYPE_ADDRESS:
                     if slpMsg.op_return_fields['additional_token_quantity'] > 0 and self.is_mine(addr):
-                        self._slp_txo[addr][tx_hash][1] = {
+                        self._put_slp_txo(addr, tx_hash, 1, {
                                 'type': 'SLP%d'%(slpMsg.token_type,),
                                 'token_id': token_id_hex,
                                 'qty': slpMsg.op_return_fields['additional_token_quantity'],
-                            }
+                            })
                     if slpMsg.op_return_fields['mint_baton_vout'] is not None:
                         i = slpMsg.op_return_fields['mint_baton_vout']
                         _type, addr, _ = txouts[i]
                         if _type == TYPE_ADDRESS:
-                            self._slp_txo[addr][tx_hash][i] = {
+                            self._put_slp_txo(addr, tx_hash, i, {
                                     'type': 'SLP%d'%(slpMsg.token_type,),
                                     'token_id': token_id_hex,
                                     'qty': 'MINT_BATON',
-                                }
+                                })
             except IndexError: # if too few outputs (compared to mint_baton_vout)
                 pass
         elif slpMsg.transaction_type == 'COMMIT':
@@ -1597,6 +1853,7 @@ class Abstract_Wallet(PrintError):
                 (txid,node), = job.nodes.items()
                 val = node.validity
                 tti['validity'] = val
+                self.events.slp_validity_changed(txid, val)
                 ui_cb = self.ui_emit_validity_updated
                 if ui_cb:
                     ui_cb(txid, val)
@@ -1622,6 +1879,7 @@ class Abstract_Wallet(PrintError):
         """
         with self.lock:
             self._slp_txo = defaultdict(lambda: defaultdict(dict))
+            self._slp_token_addrs = None
             self.tx_tokinfo = {}
             for txid, tx in self.transactions.items():
                 self.handleSlpTransaction(txid, tx)
@@ -1638,6 +1896,7 @@ class Abstract_Wallet(PrintError):
                     self.pruned_txo.pop(ser)
                     self.pruned_txo_values.discard(hh)
             # add tx to pruned_txo, and undo the txi addition
+            already_spent = set()
             for next_tx, dd in self.txi.items():
                 for addr, l in list(dd.items()):
                     ll = l[:]
@@ -1649,6 +1908,7 @@ class Abstract_Wallet(PrintError):
                             l.remove(item)
                             self.pruned_txo[ser] = next_tx
                             self.pruned_txo_values.add(next_tx)
+                            already_spent.add(ser)
                     if l == []:
                         dd.pop(addr)
                     else:
@@ -1659,6 +1919,13 @@ class Abstract_Wallet(PrintError):
             for addr in d:
                 self._addr_bal_cache.pop(addr, None)  # invalidate cache entry
 
+            # our coins this tx created are gone, the ones it spent are back
+            self.events.tx_removed(tx_hash)
+            self.events.utxos_changed(
+                added=[ser for l in self.txi.get(tx_hash, {}).values() for ser, v in l],
+                spent=[ser for ser in ('{}:{}'.format(tx_hash, n) for l in d.values() for n, v, is_cb in l)
+                       if ser not in already_spent])
+
             self.txi.pop(tx_hash, None)
             self.txo.pop(tx_hash, None)
             self.tx_fees.pop(tx_hash, None)
@@ -1690,7 +1957,11 @@ class Abstract_Wallet(PrintError):
                         # and self.txo dicts
                         self.remove_transaction(tx_hash)
             self._addr_bal_cache.pop(addr, None)  # unconditionally invalidate cache entry
+            old_status_entry = self._addr_status_cache.get(addr)
+            self._addr_status_cache[addr] = self._make_status_entry(hist, old_status_entry, old_hist)
+            self._addr_server_status.pop(addr, None)  # caller sets it again if appropriate
             self._history[addr] = hist
+            self.events.address_history_changed(addr)
 
             for tx_hash, tx_height in hist:
                 # add it in case it was previously unconfirmed
@@ -1771,6 +2042,33 @@ class Abstract_Wallet(PrintError):
 
         return histories
 
+    def get_slp_tx_deltas(self, tx_hash, validities_considered=(0,1)):
+        ''' The token deltas of a single tx on this wallet, as a dict of
+        token_id -> delta. This is what get_slp_histories() would report for
+        tx_hash, but only looks at the addresses whose history it is in, so
+        callers can keep a token history up to date tx by tx. '''
+        deltas = defaultdict(int)
+        with self.lock:
+            if tx_hash in self.pruned_txo_values:
+                return {}
+            tti = self.tx_tokinfo.get(tx_hash)
+            received = tti and tti['validity'] in validities_considered
+            for addr in self.tx_addr_hist.get(tx_hash, ()):
+                addrslptxo = self._slp_txo.get(addr, {})
+                if received:
+                    for idx, d in addrslptxo.get(tx_hash, {}).items():
+                        if isinstance(d['qty'], int):
+                            deltas[d['token_id']] += d['qty']  # received!
+                for n, _ in self.txi.get(tx_hash, {}).get(addr, ()):
+                    prevtxid, prevout_str = n.rsplit(':', 1)
+                    tti = self.tx_tokinfo.get(prevtxid)
+                    if not (tti and tti['validity'] in validities_considered):
+                        continue
+                    d = addrslptxo.get(prevtxid, {}).get(int(prevout_str), {})
+                    if isinstance(d.get('qty', None), int):
+                        deltas[d['token_id']] -= d['qty']  # spent
+        return dict(deltas)
+
     def get_history(self, domain=None, *, reverse=False):
         # get domain
         if domain is None:
@@ -1810,99 +2108,221 @@ class Abstract_Wallet(PrintError):
 
         return h2
 
+    def get_history_entry(self, tx_hash):
+        ''' What get_history() over all of the wallet's addresses has for
+        tx_hash, less the running balance and plus its get_txpos(): (height,
+        conf, timestamp, delta, txpos), with delta None if it isn't known
+        yet. None if the tx isn't in the wallet's history at all. '''
+        with self.lock:
+            addrs = self.tx_addr_hist.get(tx_hash)
+            if not addrs:
+                return None
+            delta = 0
+            for addr in addrs:
+                d = self.get_tx_delta(tx_hash, addr)
+                if d is None:
+                    delta = None
+                    break
+                delta += d
+            return self.get_tx_height(tx_hash) + (delta, self.get_txpos(tx_hash))
+
+    # how many prevout txs resolve_fees keeps requested from the network at once
+    FEE_RESOLVER_MAX_INFLIGHT = 100
+    # how many history rows iter_export_history computes the fees of at once
+    EXPORT_FEE_CHUNK = 1000
+
+    def resolve_fees(self, tx_hashes, *, use_network=False, timeout=10.0):
+        ''' Works out the fees of the wallet txs in `tx_hashes` in one go.
+        Returns a dict of tx_hash -> fee for the ones whose fee is known, and
+        saves the newly computed fees in self.tx_fees.
+
+        The input values come from the wallet's own coins first, then from
+        the prevout txs in the wallet or in the process-wide tx store. With
+        `use_network` (and a network), the prevout txs that are still missing
+        are downloaded (each one once, however many inputs spend from it)
+        into the tx store, spread over the connected servers, for at most
+        `timeout` seconds in total. Fees are then computed locally, by
+        scanning the raw txs rather than deserializing them. '''
+        fees = {}
+        views = {}
+        prev_values = {}  # prevout txid -> list of its output values, or None if not available
+        def get_prev_values(prevout_hash):
+            if prevout_hash not in prev_values:
+                tx = self.transactions.get(prevout_hash) or Transaction.tx_cache_get(prevout_hash)
+                try:
+                    prev_values[prevout_hash] = TxView(tx.raw).output_values() if tx and tx.raw else None
+                except SerializationError as e:
+                    self.print_error("resolve_fees: bad prevout tx", prevout_hash, repr(e))
+                    prev_values[prevout_hash] = None
+            return prev_values[prevout_hash]
+        def try_fee(tx_hash, view, missing):
+            ''' Returns the fee of tx_hash, or None, adding the txids of the
+            prevout txs it would need to `missing`. '''
+            total_in = 0
+            for prevout_hash, n in view.prevouts():
+                if not any(prevout_hash):
+                    return 0  # coinbase
+                prevout_hash = prevout_hash.hex()
+                value = None
+                for l in self.txo.get(prevout_hash, {}).values():
+                    value = next((v for nn, v, is_cb in l if nn == n), None)
+                    if value is not None:
+                        break
+                if value is None:
+                    values = get_prev_values(prevout_hash)
+                    if values is None or n >= len(values):
+                        missing.add(prevout_hash)
+                        continue
+                    value = values[n]
+                total_in += value
+            if missing:
+                return None
+            return total_in - sum(view.output_values())
+
+        missing = set()
+        for tx_hash in tx_hashes:
+            fee = self.tx_fees.get(tx_hash)
+            if fee is not None:
+                fees[tx_hash] = fee
+                continue
+            tx = self.transactions.get(tx_hash)
+            if not tx or not tx.raw:
+                continue
+            try:
+                view = TxView(tx.raw)
+            except SerializationError as e:
+                self.print_error("resolve_fees: cannot scan", tx_hash, repr(e))
+                continue
+            tx_missing = set()
+            fee = try_fee(tx_hash, view, tx_missing)
+            if fee is not None:
+                fees[tx_hash] = self.tx_fees[tx_hash] = fee
+            else:
+                views[tx_hash] = view
+                missing |= tx_missing
+
+        if missing and views and use_network and self.network and timeout > 0:
+            self._download_txs(missing, timeout)
+            for prevout_hash in missing:
+                prev_values.pop(prevout_hash, None)
+            for tx_hash, view in views.items():
+                fee = try_fee(tx_hash, view, set())
+                if fee is not None:
+                    fees[tx_hash] = self.tx_fees[tx_hash] = fee
+        return fees
+
+    def _download_txs(self, txids, timeout):
+        ''' Fetches txids into the process-wide tx store, from random
+        connected servers, keeping at most FEE_RESOLVER_MAX_INFLIGHT requests
+        outstanding. Gives up on whatever is left after `timeout` seconds. '''
+        network = self.network
+        todo = list(txids)
+        q = queue.Queue()
+        def on_reply(r):
+            # Runs in the network thread: just check the tx hashes to what we
+            # asked for and store it, no deserializing.
+            try:
+                tx = Transaction(r['result'])
+                txid = r['params'][0]
+                if txid == Transaction._txid(tx.raw):
+                    Transaction.tx_cache_put(tx=tx, txid=txid)
+                else:
+                    self.print_error("_download_txs: server sent the wrong tx for", txid)
+            except Exception as e:
+                self.print_error("_download_txs: bad reply", repr(e))
+            q.put(None)
+        t0 = time.time()
+        inflight = 0
+        try:
+            while todo or inflight:
+                while todo and inflight < self.FEE_RESOLVER_MAX_INFLIGHT:
+                    network.queue_request('blockchain.transaction.get', [todo.pop()],
+                                          interface='random', callback=on_reply)
+                    inflight += 1
+                remaining = timeout - (time.time() - t0)
+                if remaining <= 0:
+                    break
+                try:
+                    q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                inflight -= 1
+        finally:
+            network.cancel_requests(on_reply)
+        if todo or inflight:
+            self.print_error(f"_download_txs: timed out with {len(todo) + inflight} of {len(txids)} txs not fetched")
+        else:
+            self.print_error(f"_download_txs: fetched {len(txids)} txs in {time.time() - t0:.3f} sec")
+
     def export_history(self, domain=None, from_timestamp=None, to_timestamp=None, fx=None,
                        show_addresses=False, decimal_point=8,
                        *, fee_calc_timeout=10.0, download_inputs=False,
                        progress_callback=None):
-        ''' Export history. Used by RPC & GUI.
+        ''' Export history. Used by RPC & GUI. Returns the list of rows
+        iter_export_history yields, see there. '''
+        return list(self.iter_export_history(domain, from_timestamp, to_timestamp, fx,
+                                             show_addresses, decimal_point,
+                                             fee_calc_timeout=fee_calc_timeout,
+                                             download_inputs=download_inputs,
+                                             progress_callback=progress_callback))
+
+    def iter_export_history(self, domain=None, from_timestamp=None, to_timestamp=None, fx=None,
+                            show_addresses=False, decimal_point=8,
+                            *, fee_calc_timeout=10.0, download_inputs=False,
+                            progress_callback=None, after=None):
+        ''' Generator yielding the exported history rows, newest first. Each
+        row is only built (fee, label, fiat) when it is asked for, so callers
+        that write the rows out as they come never hold the whole export.
 
         Arg notes:
-        - `fee_calc_timeout` is used when computing the fee (which is done
-          asynchronously in another thread) to limit the total amount of time in
-          seconds spent waiting for fee calculation. The timeout is a total time
-          allotment for this function call. (The reason the fee calc can take a
-          long time is for some pathological tx's, it is very slow to calculate
-          fee as it involves deserializing prevout_tx from the wallet, for each
-          input).
+        - `fee_calc_timeout` limits the total amount of time in seconds spent
+          downloading the prevout txs needed for fees. These are fetched for
+          the whole exported range in one go before the first row is yielded
+          (see resolve_fees); the fees themselves are then computed locally a
+          chunk of rows at a time. Rows whose fee couldn't be worked out in
+          time are exported without one.
         - `download_inputs`, if True, will allow for more accurate fee data to
-          be exported with the history by using the Transaction class input
-          fetcher to download *all* prevout_hash tx's for inputs (even for
-          inputs not in wallet). This feature requires self.network (ie, we need
-          to be online) otherwise it will behave as if download_inputs=False.
+          be exported with the history by downloading the prevout_hash tx's
+          for inputs that aren't in the wallet. This feature requires
+          self.network (ie, we need to be online) otherwise it will behave as if
+          download_inputs=False.
         - `progress_callback`, if specified, is a callback which receives a
           single float argument in the range [0.0,1.0] indicating how far along
           the history export is going. This is intended for interop with GUI
           code. Node the progress callback is not guaranteed to be called in the
           context of the main thread, therefore GUI code should use appropriate
           signals/slots to update the GUI with progress info.
+        - `after`, if specified, is the txid of the last row previously seen;
+          only the rows older than it are yielded. Raises ValueError if that
+          tx is not in the history (anymore).
 
         Note on side effects: This function may update self.tx_fees. Rationale:
         it will spend some time trying very hard to calculate accurate fees by
-        examining prevout_tx's (leveraging the fetch_input_data code in the
-        Transaction class). As such, it is worthwhile to cache the results in
+        examining prevout_tx's. As such, it is worthwhile to cache the results in
         self.tx_fees, which gets saved to wallet storage. This is not very
         demanding on storage as even for very large wallets with huge histories,
         tx_fees does not use more than a few hundred kb of space. '''
-        from .util import timestamp_to_datetime
-        # we save copies of tx's we deserialize to this temp dict because we do
-        # *not* want to deserialize tx's in wallet.transactoins since that
-        # wastes memory
-        local_tx_cache = {}
         # some helpers for this function
-        t0 = time.time()
-        def time_remaining(): return max(fee_calc_timeout - (time.time()-t0), 0)
         class MissingTx(RuntimeError):
             ''' Can happen in rare circumstances if wallet history is being
             radically reorged by network thread while we are in this code. '''
         def get_tx(tx_hash):
             ''' Try to get a tx from wallet, then from the Transaction class
-            cache if that fails. In either case it deserializes the copy and
-            puts the deserialized tx in local stack dict local_tx_cache. The
+            cache if that fails. In either case it deserializes a copy. The
             reason we don't deserialize the tx's from self.transactions is that
             we do not want to keep deserialized tx's in memory. The
             self.transactions dict should contain just raw tx's (not
             deserialized). Deserialized tx's eat on the order of 10x the memory
             because because of the Python lists, dict, etc they contain, per
             instance. '''
-            tx = local_tx_cache.get(tx_hash)
-            if tx:
-                return tx
             tx = Transaction.tx_cache_get(tx_hash)
             if not tx:
                 tx = copy.deepcopy(self.transactions.get(tx_hash))
             if tx:
                 tx.deserialize()
-                local_tx_cache[tx_hash] = tx
             else:
                 raise MissingTx(f'txid {tx_hash} dropped out of wallet history while exporting')
             return tx
-        def try_calc_fee(tx_hash):
-            ''' Try to calc fee from cheapest to most expensive calculation.
-            Ultimately asks the transaction class to look at prevouts in wallet and uses
-            that scheme as a last (more CPU intensive) resort. '''
-            fee = self.tx_fees.get(tx_hash)
-            if fee is not None:
-                return fee
-            def do_get_fee(tx_hash):
-                tx = get_tx(tx_hash)
-                def try_get_fee(tx):
-                    try: return tx.get_fee()
-                    except InputValueMissing: pass
-                fee = try_get_fee(tx)
-                t_remain = time_remaining()
-                if fee is None and t_remain:
-                    q = queue.Queue()
-                    def done():
-                        q.put(1)
-                    tx.fetch_input_data(self, use_network=bool(download_inputs), done_callback=done)
-                    try: q.get(timeout=t_remain)
-                    except queue.Empty: pass
-                    fee = try_get_fee(tx)
-                return fee
-            fee = do_get_fee(tx_hash)
-            if fee is not None:
-                self.tx_fees[tx_hash] = fee  # save fee to wallet if we bothered to dl/calculate it.
-            return fee
         def fmt_amt(v, is_diff):
             if v is None:
                 return '--'
@@ -1911,24 +2331,51 @@ class Abstract_Wallet(PrintError):
 
         # grab history
         h = self.get_history(domain, reverse=True)
-        out = []
+        start = 0
+        if after is not None:
+            start = next((i + 1 for i, row in enumerate(h) if row[0] == after), None)
+            if start is None:
+                raise ValueError(f"unknown txid: {after}")
+
+        def rows_in_range():
+            for n in range(start, len(h)):
+                row = h[n]
+                timestamp = row[3]
+                timestamp_safe = timestamp
+                if timestamp is None:
+                    timestamp_safe = time.time()  # set it to "now" so below code doesn't explode.
+                if from_timestamp and timestamp_safe < from_timestamp:
+                    continue
+                if to_timestamp and timestamp_safe >= to_timestamp:
+                    continue
+                yield (n,) + row + (timestamp_safe,)
+        def rows_with_fees():
+            ''' Resolves the fees (and fiat rates) a chunk of rows at a time. '''
+            if download_inputs and self.network:
+                # Download the prevouts missing for the fees of the whole
+                # range at once, with the full time budget, so the chunks
+                # below only need what is now local.
+                self.resolve_fees([row[1] for row in rows_in_range()], use_network=True,
+                                  timeout=fee_calc_timeout)
+            rows = rows_in_range()
+            while True:
+                chunk = list(itertools.islice(rows, self.EXPORT_FEE_CHUNK))
+                if not chunk:
+                    return
+                fees = self.resolve_fees([row[1] for row in chunk])
+                if fx is not None:
+                    rates = fx.timestamp_rates([row[-1] for row in chunk])
+                else:
+                    rates = itertools.repeat(None)
+                for row, rate in zip(chunk, rates):
+                    yield row + (fees.get(row[1]), rate)
 
-        n, l = 0, max(1, float(len(h)))
-        for tx_hash, height, conf, timestamp, value, balance in h:
+        l = max(1, float(len(h)))
+        for n, tx_hash, height, conf, timestamp, value, balance, timestamp_safe, fee, rate in rows_with_fees():
             if progress_callback:
                 progress_callback(n/l)
-            n += 1
-            timestamp_safe = timestamp
-            if timestamp is None:
-                timestamp_safe = time.time()  # set it to "now" so below code doesn't explode.
-            if from_timestamp and timestamp_safe < from_timestamp:
-                continue
-            if to_timestamp and timestamp_safe >= to_timestamp:
-                continue
-            try:
-                fee = try_calc_fee(tx_hash)
-            except MissingTx as e:
-                self.print_error(str(e))
+            if fee is None and tx_hash not in self.transactions:
+                self.print_error(f'txid {tx_hash} dropped out of wallet history while exporting')
                 continue
             item = {
                 'txid'          : tx_hash,
@@ -1953,7 +2400,11 @@ class Abstract_Wallet(PrintError):
                 self.print_error(f"Warning: could not export label for {tx_hash}, defaulting to ???")
                 item['label'] = "???"
             if show_addresses:
-                tx = get_tx(tx_hash)
+                try:
+                    tx = get_tx(tx_hash)
+                except MissingTx as e:
+                    self.print_error(str(e))
+                    continue
                 input_addresses = []
                 output_addresses = []
                 for x in tx.inputs():
@@ -1966,14 +2417,12 @@ class Abstract_Wallet(PrintError):
                 item['input_addresses'] = input_addresses
                 item['output_addresses'] = output_addresses
             if fx is not None:
-                date = timestamp_to_datetime(timestamp_safe)
-                item['fiat_value'] = fx.historical_value_str(value, date)
-                item['fiat_balance'] = fx.historical_value_str(balance, date)
-                item['fiat_fee'] = fx.historical_value_str(fee, date)
-            out.append(item)
+                item['fiat_value'] = fx.value_str(value, rate)
+                item['fiat_balance'] = fx.value_str(balance, rate)
+                item['fiat_fee'] = fx.value_str(fee, rate)
+            yield item
         if progress_callback:
             progress_callback(1.0)  # indicate done, just in case client code expects a 1.0 in order to detect completion
-        return out
 
     def get_label(self, tx_hash):
         label = self.labels.get(tx_hash, '')
@@ -2096,10 +2545,25 @@ class Abstract_Wallet(PrintError):
         if i_max is None:
             # Let the coin chooser select the coins to spend
             max_change = self.max_change_outputs if self.multiple_change else 1
-            coin_chooser = coinchooser.CoinChooserPrivacy()
-            tx = coin_chooser.make_tx(inputs, outputs, change_addrs[:max_change],
-                                        fee_estimator, self.dust_threshold(), sign_schnorr=sign_schnorr,
-                                        mandatory_coins=mandatory_coins)
+            coin_chooser = coinchooser.get_coin_chooser(config)
+            # Send previews call this on every keystroke; if only the fee
+            # changed since last time, keep the coins picked then as long as
+            # they still cover it.
+            selection_key = (coinchooser.get_name(config), sign_schnorr, list(outputs),
+                             change_addrs[:max_change], self.dust_threshold(),
+                             [(c['prevout_hash'], c['prevout_n']) for c in inputs],
+                             [(c['prevout_hash'], c['prevout_n']) for c in mandatory_coins])
+            tx = None
+            last = self._last_coin_selection
+            if last is not None and last[0] == selection_key:
+                tx = coin_chooser.reuse_selection(last[1], last[2], outputs, change_addrs[:max_change],
+                                                  fee_estimator, self.dust_threshold(), sign_schnorr=sign_schnorr,
+                                                  mandatory_coins=mandatory_coins)
+            if tx is None:
+                tx = coin_chooser.make_tx(inputs, outputs, change_addrs[:max_change],
+                                          fee_estimator, self.dust_threshold(), sign_schnorr=sign_schnorr,
+                                          mandatory_coins=mandatory_coins)
+                self._last_coin_selection = (selection_key, coin_chooser.selected, coin_chooser.seed)
         else:
             inputs = mandatory_coins + inputs
             sendable = sum(map(lambda x:x['value'], inputs))
@@ -2180,7 +2644,7 @@ class Abstract_Wallet(PrintError):
         if i_max is None:
             # Let the coin chooser select the coins to spend
             max_change = self.max_change_outputs if self.multiple_change else 1
-            coin_chooser = coinchooser.CoinChooserPrivacy()
+            coin_chooser = coinchooser.get_coin_chooser(config)
             # determine if this transaction should utilize all available inputs
             tx = coin_chooser.make_tx(inputs, outputs, change_addrs[:max_change],
                                       fee_estimator, self.dust_threshold(), sign_schnorr=sign_schnorr)
@@ -2311,7 +2775,8 @@ class Abstract_Wallet(PrintError):
             self.synchronizer = Synchronizer(self, network)
             finalization_print_error(self.verifier, "[{}.{}] finalized".format(self.diagnostic_name(), self.verifier.diagnostic_name()))
             finalization_print_error(self.synchronizer, "[{}.{}] finalized".format(self.diagnostic_name(), self.synchronizer.diagnostic_name()))
-            network.add_jobs([self.verifier, self.synchronizer])
+            self.events_job = WalletEventsJob(self.events)
+            network.add_jobs([self.verifier, self.synchronizer, self.events_job])
         else:
             self.verifier = None
             self.synchronizer = None
@@ -2329,6 +2794,9 @@ class Abstract_Wallet(PrintError):
             self.verifier.release()
             self.synchronizer = None
             self.verifier = None
+            self.network.remove_jobs([self.events_job])
+            self.events_job = None
+            self.events.flush()  # deliver whatever is still pending
             self.stop_pruned_txo_cleaner_thread()
             # Now no references to the syncronizer or verifier
             # remain so they will be GC-ed
@@ -2835,8 +3303,9 @@ class Abstract_Wallet(PrintError):
         self.stop_threads()
         do_addr_save = False
         with self.lock:
-            self.transactions.clear(); self.unverified_tx.clear(); self.verified_tx.clear()
+            self.transactions.clear(); self.unverified_tx.clear(); self._clear_verified_tx()
             self._slp_txo.clear(); self.slpv1_validity.clear(); self.token_types.clear(); self.tx_tokinfo.clear()
+            self._slp_token_addrs = None
             self.clear_history()
             if isinstance(self, Standard_Wallet):
                 # reset the address list to default too, just in case. New synchronizer will pick up the addresses again.
@@ -2989,11 +3458,13 @@ class ImportedWalletBase(Simple_Wallet):
                         transactions_new.add(tx_hash)
             transactions_to_remove -= transactions_new
             self._history.pop(address, None)
+            self._addr_status_cache.pop(address, None)
+            self._addr_server_status.pop(address, None)
 
             for tx_hash in transactions_to_remove:
                 self.remove_transaction(tx_hash)
                 self.tx_fees.pop(tx_hash, None)
-                self.verified_tx.pop(tx_hash, None)
+                self._pop_verified_tx(tx_hash)
                 self.unverified_tx.pop(tx_hash, None)
                 self.transactions.pop(tx_hash, None)
                 self._addr_bal_cache.pop(address, None)  # not strictly necessary, above calls also have this side-effect. but here to be safe. :)
@@ -3006,6 +3477,7 @@ class ImportedWalletBase(Simple_Wallet):
                 # FIXME: what about pruned_txo?
 
             self.storage.put('verified_tx3', self.verified_tx)
+            self.storage.put('verified_block_roots', self.verified_block_roots)
 
         self.save_transactions()
 
@@ -3196,6 +3668,9 @@ class Slp_ImportedPrivkeyWallet(ImportedPrivkeyWallet):
 class Deterministic_Wallet(Abstract_Wallet):
 
     def __init__(self, storage):
+        # address -> (for_change, n); see _update_address_index()
+        self._address_index = {}
+        self._address_index_state = [(None, 0), (None, 0)]  # (list, indexed length) per branch
         Abstract_Wallet.__init__(self, storage)
         self.gap_limit = storage.get('gap_limit', 20)
 
@@ -3208,6 +3683,44 @@ class Deterministic_Wallet(Abstract_Wallet):
     def get_change_addresses(self):
         return self.change_addresses
 
+    def _update_address_index(self):
+        ''' Brings self._address_index up to date with the receiving and
+        change address lists. Those lists normally only grow, so just the new
+        tail gets indexed; if one was replaced or got shorter (load_addresses,
+        change_gap_limit, rebuild_history) its branch is re-indexed from
+        scratch. Cheap when nothing changed, so it's called before every
+        lookup. '''
+        for for_change, addr_list in enumerate((self.receiving_addresses, self.change_addresses)):
+            indexed_list, n = self._address_index_state[for_change]
+            if indexed_list is addr_list and n == len(addr_list):
+                continue
+            with self.lock:
+                if indexed_list is not addr_list or len(addr_list) < n:
+                    for addr in [a for a, (c, _) in self._address_index.items() if c == for_change]:
+                        del self._address_index[addr]
+                    n = 0
+                for i in range(n, len(addr_list)):
+                    self._address_index[addr_list[i]] = (for_change, i)
+                self._address_index_state[for_change] = (addr_list, len(addr_list))
+
+    def get_address_index(self, address):
+        self._update_address_index()
+        try:
+            for_change, n = self._address_index[address]
+        except KeyError:
+            assert not isinstance(address, str)
+            raise Exception("Address {} not found".format(address))
+        return bool(for_change), n
+
+    def get_address_position(self, address):
+        ''' Overrides super. Uses the address index rather than scanning the
+        address list. '''
+        try:
+            for_change, n = self.get_address_index(address)
+        except Exception:
+            return None
+        return n + len(self.receiving_addresses) if for_change else n
+
     def get_seed(self, password):
         return self.keystore.get_seed(password)
 
@@ -3260,28 +3773,46 @@ class Deterministic_Wallet(Abstract_Wallet):
         return nmax + 1
 
     def create_new_address(self, for_change=False):
+        return self.create_new_addresses(for_change, 1)[0]
+
+    def create_new_addresses(self, for_change=False, count=1):
+        ''' Derives the next `count` addresses of the receiving or change
+        branch in one go. The address list is saved once for the whole batch
+        rather than once per address. '''
         for_change = bool(for_change)
         with self.lock:
             addr_list = self.change_addresses if for_change else self.receiving_addresses
             n = len(addr_list)
-            x = self.derive_pubkeys(for_change, n)
-            address = self.pubkeys_to_address(x)
-            addr_list.append(address)
+            pubkeys = self.derive_pubkeys_range(for_change, n, count)
+            addresses = [self.pubkeys_to_address(x) for x in pubkeys]
+            addr_list.extend(addresses)
             self.save_addresses()
-            self.add_address(address)
-            return address
+            for address in addresses:
+                self.add_address(address)
+            return addresses
+
+    def derive_pubkeys_range(self, c, start, count):
+        ''' Subclasses that can derive a whole range faster than key by key
+        should override this. '''
+        return [self.derive_pubkeys(c, i) for i in range(start, start + count)]
 
     def synchronize_sequence(self, for_change):
         limit = self.gap_limit_for_change if for_change else self.gap_limit
         while True:
             addresses = self.get_change_addresses() if for_change else self.get_receiving_addresses()
             if len(addresses) < limit:
-                self.create_new_address(for_change)
+                self.create_new_addresses(for_change, limit - len(addresses))
                 continue
-            if all(map(lambda a: not self.address_is_old(a), addresses[-limit:] )):
+            # Count the unused addresses after the last used one; top the
+            # gap back up to `limit` in a single batch.
+            gap = 0
+            for a in reversed(addresses[-limit:]):
+                if self.address_is_old(a):
+                    break
+                gap += 1
+            if gap >= limit:
                 break
-            else:
-                self.create_new_address(for_change)
+            self.create_new_addresses(for_change, limit - gap)
 
     def synchronize(self):
         with self.lock:
@@ -3296,7 +3827,10 @@ class Deterministic_Wallet(Abstract_Wallet):
             else:
                 addr_list = self.get_receiving_addresses()
                 limit = self.gap_limit
-            idx = addr_list.index(address)
+            self._update_address_index()
+            for_change, idx = self._address_index.get(address, (None, None))
+            if for_change != bool(is_change):
+                raise ValueError("{} is not in the {} address list".format(address, 'change' if is_change else 'receiving'))
             if idx < limit:
                 return False
             for addr in addr_list[-limit:]:
@@ -3353,6 +3887,9 @@ class Simple_Deterministic_Wallet(Simple_Wallet, Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return self.keystore.derive_pubkey(c, i)
 
+    def derive_pubkeys_range(self, c, start, count):
+        return self.keystore.derive_pubkey_range(c, start, count)
+
 
 class Standard_Wallet(Simple_Deterministic_Wallet):
     wallet_type = 'standard'
@@ -3393,6 +3930,10 @@ class Multisig_Wallet(Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return [k.derive_pubkey(c, i) for k in self.get_keystores()]
 
+    def derive_pubkeys_range(self, c, start, count):
+        ranges = [k.derive_pubkey_range(c, start, count) for k in self.get_keystores()]
+        return [list(pubkeys) for pubkeys in zip(*ranges)]
+
     def load_keystore(self):
         self.keystores = {}
         for i in range(self.n):
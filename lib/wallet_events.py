@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+#
+# Electron Cash - A Bitcoin Cash SPV Wallet
+#
+# License: MIT License
+#
+''' Batched notifications of what changed in a wallet.
+
+Abstract_Wallet records changes into its `events` (a WalletEvents) as they
+happen, in whatever thread that is. The pending changes are coalesced into
+one WalletChanges batch, which is handed to every subscriber the next time
+WalletEvents.flush() runs. While the wallet is attached to a network that
+is once per network loop iteration (see WalletEventsJob), so subscribers
+are called from the network thread and GUI code has to get back to its own
+thread by itself. Without a network (wallet.events_job is None) it's up to
+the subscribers to flush, or the changes pile up; the Qt GUI does it from
+its timer.
+
+Nothing is recorded while there are no subscribers. '''
+import threading
+
+from .util import PrintError, ThreadJob
+
+
+class WalletChanges:
+    ''' One batch of wallet changes.
+
+    tx_added, tx_removed -- sets of tx hashes added to or removed from the
+        wallet. A tx added and then removed within the same batch (or vice
+        versa) only shows up in the set for what happened last.
+    tx_verified -- dict of tx_hash -> the block height it was verified at
+    utxo_added, utxo_spent -- sets of "prevout_hash:n" coins of the wallet
+        that appeared or went away (spent, or their tx was removed). A coin
+        that came and went within the batch is in neither.
+    address_history_changed -- set of Addresses whose history changed
+    slp_validity_changed -- dict of tx_hash -> new SLP validity
+    label_changed -- dict of label key (tx hash or address storage string)
+        -> new text, or None if the label was removed '''
+
+    __slots__ = ('tx_added', 'tx_removed', 'tx_verified', 'utxo_added', 'utxo_spent',
+                 'address_history_changed', 'slp_validity_changed', 'label_changed')
+
+    def __init__(self):
+        self.tx_added = set()
+        self.tx_removed = set()
+        self.tx_verified = dict()
+        self.utxo_added = set()
+        self.utxo_spent = set()
+        self.address_history_changed = set()
+        self.slp_validity_changed = dict()
+        self.label_changed = dict()
+
+    def __bool__(self):
+        return any(getattr(self, name) for name in self.__slots__)
+
+    def to_dict(self):
+        ''' The batch as JSON-friendly lists and dicts. '''
+        return {
+            'tx_added': sorted(self.tx_added),
+            'tx_removed': sorted(self.tx_removed),
+            'tx_verified': dict(self.tx_verified),
+            'utxo_added': sorted(self.utxo_added),
+            'utxo_spent': sorted(self.utxo_spent),
+            'address_history_changed': sorted(a.to_ui_string() for a in self.address_history_changed),
+            'slp_validity_changed': dict(self.slp_validity_changed),
+            'label_changed': dict(self.label_changed),
+        }
+
+
+class WalletEvents(PrintError):
+    ''' The change recorder and subscriber list of one wallet. The
+    recording methods are cheap no-ops while nobody is subscribed. '''
+
+    def __init__(self, wallet_name):
+        self.wallet_name = wallet_name
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.pending = WalletChanges()
+
+    def subscribe(self, callback):
+        ''' callback(changes) will be called with each WalletChanges batch. '''
+        with self.lock:
+            if callback not in self.subscribers:
+                self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+            if not self.subscribers:
+                self.pending = WalletChanges()
+
+    def diagnostic_name(self):
+        return self.wallet_name + '/WalletEvents'
+
+    def tx_added(self, tx_hash):
+        if self.subscribers:
+            with self.lock:
+                self.pending.tx_removed.discard(tx_hash)
+                self.pending.tx_added.add(tx_hash)
+
+    def tx_removed(self, tx_hash):
+        if self.subscribers:
+            with self.lock:
+                self.pending.tx_added.discard(tx_hash)
+                self.pending.tx_verified.pop(tx_hash, None)
+                self.pending.tx_removed.add(tx_hash)
+
+    def tx_verified(self, tx_hash, height):
+        if self.subscribers:
+            with self.lock:
+                self.pending.tx_verified[tx_hash] = height
+
+    def utxos_changed(self, added=(), spent=()):
+        if self.subscribers:
+            with self.lock:
+                p = self.pending
+                for ser in added:
+                    if ser in p.utxo_spent:
+                        p.utxo_spent.discard(ser)
+                    else:
+                        p.utxo_added.add(ser)
+                for ser in spent:
+                    if ser in p.utxo_added:
+                        p.utxo_added.discard(ser)
+                    else:
+                        p.utxo_spent.add(ser)
+
+    def address_history_changed(self, address):
+        if self.subscribers:
+            with self.lock:
+                self.pending.address_history_changed.add(address)
+
+    def slp_validity_changed(self, tx_hash, validity):
+        if self.subscribers:
+            with self.lock:
+                self.pending.slp_validity_changed[tx_hash] = validity
+
+    def label_changed(self, key, text):
+        if self.subscribers:
+            with self.lock:
+                self.pending.label_changed[key] = text
+
+    def flush(self):
+        ''' Hands the changes recorded since the last flush to the
+        subscribers, as one batch. Returns the batch, or None if nothing
+        changed. '''
+        with self.lock:
+            if not self.pending:
+                return None
+            changes, self.pending = self.pending, WalletChanges()
+            subscribers = self.subscribers[:]
+        for callback in subscribers:
+            try:
+                callback(changes)
+            except Exception as e:
+                # a misbehaving subscriber shouldn't keep the others from being told
+                self.print_error("subscriber", callback, "raised:", repr(e))
+        return changes
+
+
+class WalletEventsJob(ThreadJob):
+    ''' Flushes a wallet's events on each iteration of the network loop. '''
+
+    def __init__(self, events):
+        self.events = events
+
+    def diagnostic_name(self):
+        return self.events.wallet_name + '/WalletEventsJob'
+
+    def run(self):
+        self.events.flush()